@@ -0,0 +1,131 @@
+# !/usr/bin/env python3
+# coding: utf-8
+# -*- coding: utf-8 -*-
+
+# Sound clips for the Wiimote speaker.
+#
+# The speaker takes output report 0x18 with up to 20 bytes of sound data, either 8-bit signed PCM
+# (20 samples per report) or 4-bit Yamaha ADPCM (40 samples per report). A Clip is encoded into
+# these reports once, so playing it only means sending the prepared bytes at the right pace
+# (see wiimote.Speaker). See http://wiibrew.org/wiki/Wiimote#Speaker
+
+import threading
+import wave
+import numpy as np
+
+PCM8 = 'pcm8'
+ADPCM = 'adpcm'
+
+REPORT_DATA_SIZE = 20
+SAMPLES_PER_BYTE = {PCM8: 1, ADPCM: 2}
+
+# Yamaha ADPCM tables
+_ADPCM_DIFF = [1, 3, 5, 7, 9, 11, 13, 15, -1, -3, -5, -7, -9, -11, -13, -15]
+_ADPCM_SCALE = [230, 230, 230, 230, 307, 409, 512, 614] * 2
+
+
+# 16 bit samples -> 8-bit signed PCM bytes
+def encode_pcm8(samples):
+    return (np.asarray(samples, dtype=np.int16) >> 8).astype(np.int8).tobytes()
+
+
+# 16 bit samples -> 4-bit Yamaha ADPCM, two samples per byte (first sample in the high nibble)
+def encode_adpcm(samples):
+    predictor = 0
+    step = 127
+    nibbles = []
+    for sample in np.asarray(samples, dtype=np.int16).tolist():
+        delta = sample - predictor
+        nibble = min(7, abs(delta) * 4 // step)
+        if delta < 0:
+            nibble += 8
+        predictor += int(step * _ADPCM_DIFF[nibble] / 8)
+        predictor = max(-32768, min(32767, predictor))
+        step = max(127, min(24576, (step * _ADPCM_SCALE[nibble]) >> 8))
+        nibbles.append(nibble)
+    if len(nibbles) % 2:
+        nibbles.append(0)
+    return bytes((high << 4) | low for high, low in zip(nibbles[0::2], nibbles[1::2]))
+
+
+class Clip:
+    # A sound prepared for the speaker. `data` is already encoded in `fmt`.
+    # `payloads` holds the payload of every speaker report (length byte + 20 data bytes).
+    def __init__(self, data, sample_rate=2000, fmt=PCM8, volume=0x30):
+        super().__init__()
+        if fmt not in SAMPLES_PER_BYTE:
+            raise ValueError("unknown speaker format '%s'" % fmt)
+        self.fmt = fmt
+        self.sample_rate = sample_rate
+        self.volume = volume
+        self.payloads = []
+        for offset in range(0, len(data), REPORT_DATA_SIZE):
+            chunk = data[offset:offset + REPORT_DATA_SIZE]
+            payload = bytearray(1 + REPORT_DATA_SIZE)
+            payload[0] = len(chunk) << 3
+            payload[1:1 + len(chunk)] = chunk
+            self.payloads.append(bytes(payload))
+        # time one full report takes to play
+        self.interval = REPORT_DATA_SIZE * SAMPLES_PER_BYTE[fmt] / sample_rate
+        self.duration = len(self.payloads) * self.interval
+
+    @classmethod
+    def from_samples(cls, samples, sample_rate=2000, fmt=PCM8, volume=0x30):
+        data = encode_pcm8(samples) if fmt == PCM8 else encode_adpcm(samples)
+        return cls(data, sample_rate, fmt, volume)
+
+    # The 7 configuration bytes for register 0xa20001.
+    def config(self):
+        if self.fmt == PCM8:
+            format_byte, rate = 0x40, 12000000 // self.sample_rate
+        else:
+            format_byte, rate = 0x00, 6000000 // self.sample_rate
+        return [0x00, format_byte, rate & 0xff, rate >> 8, self.volume, 0x00, 0x00]
+
+
+# A sine tone of `frequency` Hz.
+def tone(frequency, duration, sample_rate=2000, fmt=PCM8, amplitude=0.5, volume=0x30):
+    t = np.arange(int(duration * sample_rate)) / sample_rate
+    samples = (np.sin(2 * np.pi * frequency * t) * amplitude * 32767).astype(np.int16)
+    return Clip.from_samples(samples, sample_rate, fmt, volume)
+
+
+# Loads a 16 bit WAV file (the first channel) and resamples it to `sample_rate`.
+def load_wav(path, sample_rate=3000, fmt=ADPCM, volume=0x40):
+    with wave.open(path, "rb") as f:
+        if f.getsampwidth() != 2:
+            raise ValueError("only 16 bit WAV files are supported")
+        frames = np.frombuffer(f.readframes(f.getnframes()), dtype='<i2')
+        samples = frames[::f.getnchannels()].astype(np.float64)
+        rate = f.getframerate()
+    duration = len(samples) / rate
+    target = np.arange(int(duration * sample_rate)) / sample_rate
+    resampled = np.interp(target, np.arange(len(samples)) / rate, samples)
+    return Clip.from_samples(resampled.astype(np.int16), sample_rate, fmt, volume)
+
+
+class ClipCache:
+    # Encodes every clip only once. `factory` builds the clip if `key` is not cached yet.
+    def __init__(self):
+        super().__init__()
+        self._clips = {}
+        self._lock = threading.Lock()
+
+    def get(self, key, factory):
+        with self._lock:
+            clip = self._clips.get(key)
+        if clip is None:
+            clip = factory()
+            with self._lock:
+                clip = self._clips.setdefault(key, clip)
+        return clip
+
+    def wav(self, path, sample_rate=3000, fmt=ADPCM, volume=0x40):
+        return self.get((path, sample_rate, fmt, volume), lambda: load_wav(path, sample_rate, fmt, volume))
+
+    def tone(self, frequency, duration, sample_rate=2000, fmt=PCM8):
+        return self.get(('tone', frequency, duration, sample_rate, fmt),
+                        lambda: tone(frequency, duration, sample_rate, fmt))
+
+
+clips = ClipCache()
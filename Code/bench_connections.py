@@ -0,0 +1,134 @@
+# !/usr/bin/env python3
+# coding: utf-8
+# -*- coding: utf-8 -*-
+
+# Scaling benchmark for ConnectionManager: a board with 10 to 100k connections between random cards (about
+# four connections per card). For every size it measures building the board (connect, every connection
+# offered twice, once in each direction), looking up connections, deleting the connections of cards
+# (restoreable, like a shake does) and undo/redo of the last connection. The list-based implementation it
+# replaced is measured up to --legacy-max connections, its connect() alone is quadratic.
+#
+# Usage: python3 bench_connections.py [--sizes 10 100 ...] [--legacy-max 10000]
+
+import argparse
+import random
+import time
+from connectionmanager import ConnectionManager
+
+
+class BenchCard:
+    def __init__(self, id):
+        super().__init__()
+        self.id = id
+
+    def center(self):
+        return self.id, self.id
+
+
+class LegacyConnectionManager:
+    # The previous ConnectionManager: a list of card pairs.
+    def __init__(self):
+        super().__init__()
+        self.connections = []
+        self.restoreable_connections = []
+
+    def __contains__(self, connection):
+        c1, c2 = connection
+        return (c1, c2) in self.connections or (c2, c1) in self.connections
+
+    def connect(self, new_connection):
+        c1, c2 = new_connection
+        if (c1, c2) not in self.connections and (c2, c1) not in self.connections:
+            self.connections.append(new_connection)
+
+    def delete_all_card_connections(self, card, is_restoreable):
+        new_connections = []
+        for conn in self.connections:
+            c1, c2 = conn
+            if c1 is not card and c2 is not card:
+                new_connections.append((c1, c2))
+            else:
+                if is_restoreable is True:
+                    self.restoreable_connections.append(conn)
+        self.connections = new_connections
+
+    def remove_last_connection(self):
+        if len(self.connections) > 0:
+            deleteable_connection = self.connections[-1]
+            self.restoreable_connections.append(deleteable_connection)
+            self.connections.remove(deleteable_connection)
+
+    def restore_connection(self):
+        if len(self.restoreable_connections) > 0:
+            restoreable = self.restoreable_connections[-1]
+            self.connections.append(restoreable)
+            self.restoreable_connections.remove(restoreable)
+
+
+# `count` distinct connections between max(2, count // 2) cards.
+def random_board(count, seed=1):
+    rng = random.Random(seed)
+    cards = [BenchCard(i) for i in range(max(2, count // 2))]
+    pairs = set()
+    connections = []
+    while len(connections) < count:
+        c1, c2 = rng.sample(cards, 2)
+        if frozenset((c1.id, c2.id)) not in pairs:
+            pairs.add(frozenset((c1.id, c2.id)))
+            connections.append((c1, c2))
+    return cards, connections
+
+
+# Seconds per operation of every phase.
+def run(manager_class, cards, connections, rounds):
+    rng = random.Random(2)
+    manager = manager_class()
+    start = time.perf_counter()
+    for c1, c2 in connections:
+        manager.connect((c1, c2))
+        manager.connect((c2, c1))
+    times = {'connect': (time.perf_counter() - start) / (2 * len(connections))}
+
+    lookups = [rng.choice(connections) for _ in range(rounds)] + [tuple(rng.sample(cards, 2)) for _ in range(rounds)]
+    start = time.perf_counter()
+    for connection in lookups:
+        connection in manager
+    times['lookup'] = (time.perf_counter() - start) / len(lookups)
+
+    start = time.perf_counter()
+    for _ in range(rounds):
+        manager.remove_last_connection()
+    for _ in range(rounds):
+        manager.restore_connection()
+    times['undo/redo'] = (time.perf_counter() - start) / (2 * rounds)
+
+    count = len(manager.connections)
+    start = time.perf_counter()
+    for card in rng.sample(cards, min(rounds, len(cards))):
+        manager.delete_all_card_connections(card, True)
+    times['delete card'] = (time.perf_counter() - start) / min(rounds, len(cards))
+    if count != len(connections) or len(manager.connections) + len(manager.restoreable_connections) != count:
+        raise AssertionError("%s lost connections" % manager_class.__name__)
+    return times
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10, 100, 1000, 10000, 100000])
+    parser.add_argument("--legacy-max", type=int, default=10000, help="largest board for the list implementation")
+    parser.add_argument("--rounds", type=int, default=100, help="lookups, undos and card deletions per board")
+    args = parser.parse_args()
+    phases = ('connect', 'lookup', 'undo/redo', 'delete card')
+    print("%-8s %-7s" % ("edges", "manager") + "".join("%15s" % phase for phase in phases) + "   (us/operation)")
+    for size in args.sizes:
+        cards, connections = random_board(size)
+        managers = [("dict", ConnectionManager)]
+        if size <= args.legacy_max:
+            managers.append(("list", LegacyConnectionManager))
+        for name, manager_class in managers:
+            times = run(manager_class, cards, connections, args.rounds)
+            print("%-8d %-7s" % (size, name) + "".join("%15.2f" % (times[phase] * 1e6) for phase in phases))
+
+
+if __name__ == '__main__':
+    main()
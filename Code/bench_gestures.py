@@ -0,0 +1,270 @@
+# !/usr/bin/env python3
+# coding: utf-8
+# -*- coding: utf-8 -*-
+
+# Benchmarks for GestureClassifier.
+#
+# Usage: python3 bench_gestures.py <benchmark> [options]
+
+import argparse
+import tempfile
+import time
+import timeit
+import numpy as np
+import gestureclassifier
+from gesturebackends import BACKENDS, create_backend
+from gestureclassifier import GestureClassifier, GestureDebouncer, GestureEvent
+from modelstore import ModelStore
+from telemetry import RingBuffer
+
+
+# Accelerometer samples at 100 Hz: a resting Wiimote with some noise and a shake (19 Hz like the shakes in
+# gestures/shake.csv, with `amplitude` and `noise`) in the last second of every five.
+def accelerometer_samples(count, seed=1, amplitude=100, noise=30):
+    rng = np.random.default_rng(seed)
+    t = np.arange(count) / 100
+    shaking = t % 5.0 > 4.0
+    samples = [512 + np.where(shaking, amplitude, 2) * np.sin(2 * np.pi * 19.0 * t + phase) for phase in (0, 0.5, 1)]
+    samples = np.stack(samples, axis=1) + rng.normal(0, 2, (count, 3))
+    samples += shaking[:, None] * rng.normal(0, noise, (count, 3))
+    return np.round(samples).astype(int).tolist()
+
+
+class LegacyFeatures:
+    # Features of the previous implementation: the whole window is transformed with an FFT on every sample.
+    def __init__(self, size=32):
+        super().__init__()
+        self.raw_data = RingBuffer(size, (3,))
+
+    def get_frequency(self, x, y, z):
+        self.raw_data.append((x, y, z))
+        window = self.raw_data.last()
+        raw_gesture_data = [window[:, 0] + window[:, 1] + window[:, 2] / 3]
+        return [np.abs(np.fft.fft(l) / len(l))[1:int(len(l) / 2)] for l in raw_gesture_data]
+
+
+# Cost per accelerometer sample of the FFT features and the sliding DFT (features for every sample and
+# for every Nth sample), and the largest difference between their features.
+def bench_features(args):
+    samples = accelerometer_samples(args.samples)
+    legacy = LegacyFeatures()
+    expected = [legacy.get_frequency(*sample)[0] for sample in samples]
+    classifier = GestureClassifier(load=False)
+    features = [classifier.get_frequency(*sample)[0] for sample in samples]
+    difference = max(np.max(np.abs(a - b), initial=0) for a, b in zip(expected, features))
+
+    def run_legacy():
+        features = LegacyFeatures()
+        for sample in samples:
+            features.get_frequency(*sample)
+
+    def run_sliding(interval):
+        classifier = GestureClassifier(load=False)
+        spectrum = classifier.spectrum
+        for sample in samples:
+            classifier.add_sample(*sample)
+            if spectrum.count % interval == 0:
+                spectrum.magnitudes()
+
+    runs = [("fft", run_legacy)] + [("sliding/%d" % n, lambda n=n: run_sliding(n)) for n in args.intervals]
+    for name, run in runs:
+        seconds = min(timeit.repeat(run, number=1, repeat=3))
+        print("%-11s %7.2f us/sample" % (name, seconds / len(samples) * 1e6))
+    print("largest difference to the FFT features: %.3g" % difference)
+
+
+class BinVoting:
+    # The previous model: every spectral bin is one sample with one feature, a window gets the category
+    # most of its bins are predicted as.
+    def __init__(self):
+        super().__init__()
+        from sklearn import svm
+        self.predicter = svm.SVC()
+
+    def fit(self, features, categories):
+        self.predicter.fit(features.reshape(-1, 1), np.repeat(categories, features.shape[1]))
+
+    def predict_window(self, features):
+        prediction = self.predicter.predict(np.array(features.reshape(-1, 1)))
+        u, indices = np.unique(prediction, return_inverse=True)
+        return u[np.argmax(np.bincount(indices))]
+
+    def predict(self, features):
+        return np.array([self.predict_window(row) for row in features])
+
+
+# Windows of the bundled CSV files split into a training and a test set (`test` of the windows of every
+# category).
+def split_windows(test=0.3, seed=1):
+    features, categories = GestureClassifier(load=False).training_data()
+    rng = np.random.default_rng(seed)
+    is_test = np.zeros(len(categories), dtype=bool)
+    for category in np.unique(categories):
+        rows = np.flatnonzero(categories == category)
+        is_test[rng.choice(rows, int(len(rows) * test), replace=False)] = True
+    return features[~is_test], categories[~is_test], features[is_test], categories[is_test]
+
+
+# Offline accuracy of the window model and of the per-bin voting on the bundled CSV data.
+def bench_accuracy(args):
+    train_x, train_y, test_x, test_y = split_windows(args.test)
+    print("%d training and %d test windows" % (len(train_y), len(test_y)))
+    print("%-12s %9s %9s %9s %12s" % ("model", "accuracy", "steady", "shake", "us/window"))
+    for name, model in (("bin voting", BinVoting()), ("window", create_backend("svc"))):
+        model.fit(train_x, train_y)
+        start = time.perf_counter()
+        predicted = model.predict(test_x)
+        seconds = time.perf_counter() - start
+        per_class = [np.mean(predicted[test_y == category] == category) for category in ("steady", "shake")]
+        print("%-12s %8.1f%% %8.1f%% %8.1f%% %12.1f" % (name, np.mean(predicted == test_y) * 100,
+                                                         per_class[0] * 100, per_class[1] * 100,
+                                                         seconds / len(test_y) * 1e6))
+
+
+# Accuracy on held-out windows and the cost of a single decision and of a batch for every backend. The
+# fastest backend whose accuracy is within --tolerance of the best one is picked.
+def bench_backends(args):
+    train_x, train_y, test_x, test_y = split_windows(args.test)
+    results = []
+    print("%-10s %9s %9s %9s %12s %12s %10s" % ("backend", "accuracy", "steady", "shake", "us/decision",
+                                                 "us/window", "fit ms"))
+    for name in args.backends:
+        backend = create_backend(name)
+        start = time.perf_counter()
+        backend.fit(train_x, train_y)
+        fit_seconds = time.perf_counter() - start
+        predicted = backend.predict(test_x)
+        accuracy = np.mean(predicted == test_y)
+        per_class = [np.mean(predicted[test_y == category] == category) for category in ("steady", "shake")]
+        row = test_x[:1]
+        single = min(timeit.repeat(lambda: backend.predict(row), number=200, repeat=3)) / 200
+        batch = min(timeit.repeat(lambda: backend.predict(test_x), number=5, repeat=3)) / 5 / len(test_x)
+        print("%-10s %8.1f%% %8.1f%% %8.1f%% %12.1f %12.2f %10.1f" % (
+            name, accuracy * 100, per_class[0] * 100, per_class[1] * 100, single * 1e6, batch * 1e6,
+            fit_seconds * 1000))
+        results.append((name, accuracy, single))
+    best = max(accuracy for _, accuracy, _ in results)
+    name = min((single, name) for name, accuracy, single in results if accuracy >= best - args.tolerance)[1]
+    print("picked: %s" % name)
+
+
+# Events of the debouncer for the synthetic session (one shake in every five seconds) compared to the
+# windows classified as 'shake', which used to notify the observers one by one.
+def bench_events(args):
+    samples = accelerometer_samples(int(args.seconds * 100), amplitude=args.amplitude)
+    with tempfile.TemporaryDirectory() as directory:
+        classifier = GestureClassifier(store=ModelStore(directory), backend=args.backend)
+    spectrum = gestureclassifier.SlidingDFT(classifier.BUFFER_SIZE)
+    features = []
+    for x, y, z in samples:
+        spectrum.add(x + y + z / 3)
+        if spectrum.count >= spectrum.size:
+            features.append(spectrum.magnitudes())
+    categories = classifier.predict(np.array(features))
+    times = (np.arange(len(categories)) + spectrum.size - 1) / 100
+    debouncer = GestureDebouncer("shake", args.onset, args.offset, args.smoothing, args.refractory)
+    events = [event for event in (debouncer.update(c, t) for c, t in zip(categories, times.tolist()))
+              if event is not None]
+
+    # only shakes that are over (the window has moved past them) count
+    shakes = int((times[-1] - 0.31) // 5)
+    started = [event for event in events if event.kind == GestureEvent.STARTED and event.time < shakes * 5]
+    ended = [event for event in events if event.kind == GestureEvent.ENDED and event.time < shakes * 5 + 1.5]
+    print("%d shakes, %d windows classified as 'shake'" % (shakes,
+                                                          np.sum(categories[times < shakes * 5 + 1.5] == "shake")))
+    print("%d started and %d ended events" % (len(started), len(ended)))
+    if started:
+        delays = [(event.time - 4) % 5 for event in started]
+        print("onset delay %.0f ms (mean), confidence %.2f" % (np.mean(delays) * 1000,
+                                                               np.mean([event.confidence for event in started])))
+    if ended:
+        print("gesture duration %.2f s (mean), peak confidence %.2f" % (
+            np.mean([event.duration for event in ended]), np.mean([event.confidence for event in ended])))
+
+
+# Samples per second the accelerometer thread gets through and the decision latency of the prediction
+# worker, compared to predicting with per-bin voting on the accelerometer thread for every sample.
+def bench_inference(args):
+    samples = accelerometer_samples(args.samples)
+    with tempfile.TemporaryDirectory() as directory:
+        store = ModelStore(directory)
+        classifier = GestureClassifier(store=store, feature_interval=args.interval, backend=args.backend)
+        # as fast as possible: windows are dropped when the worker falls behind
+        start = time.perf_counter()
+        for sample in samples:
+            classifier.add_accelerometer_data(*sample)
+        seconds = time.perf_counter() - start
+        classifier.flush()
+        stats = classifier.get_stats()
+        print("worker      %10.0f samples/s  %d windows in %d batches (%.1f per batch), %d dropped" % (
+            len(samples) / seconds, stats['windows'], stats['batches'], stats['mean_batch_size'],
+            stats['dropped_windows']))
+
+        # at the pace of the Wiimote
+        classifier = GestureClassifier(store=store, feature_interval=args.interval, backend=args.backend)
+        shakes = []
+        classifier.register_callback(shakes.append)
+        deadline = time.perf_counter()
+        for sample in samples[:int(args.seconds * args.rate)]:
+            classifier.add_accelerometer_data(*sample)
+            deadline += 1 / args.rate
+            time.sleep(max(0.0, deadline - time.perf_counter()))
+        classifier.flush()
+        stats = classifier.get_stats()
+        print("at %.0f Hz   decision latency p50 %.2f ms, p95 %.2f ms, %d gesture events from %d windows" % (
+            args.rate, stats['decision_latency_p50'] * 1000, stats['decision_latency_p95'] * 1000, len(shakes),
+            stats['windows']))
+
+    features, categories = classifier.training_data()
+    legacy = BinVoting()
+    legacy.fit(features, categories)
+    spectrum = gestureclassifier.SlidingDFT(classifier.BUFFER_SIZE)
+    count = min(len(samples), args.legacy_samples)
+    start = time.perf_counter()
+    for x, y, z in samples[:count]:
+        spectrum.add(x + y + z / 3)
+        if spectrum.count >= spectrum.size:
+            legacy.predict_window(spectrum.magnitudes())
+    seconds = time.perf_counter() - start
+    print("bin voting  %10.0f samples/s  (prediction on the accelerometer thread)" % (count / seconds))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    sub = parser.add_subparsers(dest="benchmark")
+    sub.required = True
+    features = sub.add_parser("features", help="cost of the spectral features per sample")
+    features.add_argument("--samples", type=int, default=50000)
+    features.add_argument("--intervals", type=int, nargs="+", default=[1, 4], help="features every N samples")
+    features.set_defaults(func=bench_features)
+    accuracy = sub.add_parser("accuracy", help="window model against per-bin voting on the CSV data")
+    accuracy.add_argument("--test", type=float, default=0.3, help="part of the windows used for testing")
+    accuracy.set_defaults(func=bench_accuracy)
+    backends = sub.add_parser("backends", help="accuracy and latency of the gesture backends")
+    backends.add_argument("--test", type=float, default=0.3, help="part of the windows used for testing")
+    backends.add_argument("--backends", nargs="+", choices=list(BACKENDS), default=list(BACKENDS))
+    backends.add_argument("--tolerance", type=float, default=0.01, help="accuracy a faster backend may lose")
+    backends.set_defaults(func=bench_backends)
+    events = sub.add_parser("events", help="debounced gesture events for a synthetic session")
+    events.add_argument("--seconds", type=float, default=60)
+    events.add_argument("--backend", choices=list(BACKENDS), default="linear")
+    events.add_argument("--amplitude", type=float, default=100, help="of the shakes (60: weak, flickering)")
+    events.add_argument("--onset", type=float, default=0.6)
+    events.add_argument("--offset", type=float, default=0.2)
+    events.add_argument("--smoothing", type=float, default=0.2)
+    events.add_argument("--refractory", type=float, default=1.0, help="seconds")
+    events.set_defaults(func=bench_events)
+    inference = sub.add_parser("inference", help="throughput and decision latency")
+    inference.add_argument("--samples", type=int, default=20000)
+    inference.add_argument("--legacy-samples", type=int, default=2000)
+    inference.add_argument("--interval", type=int, default=1, help="features every N samples")
+    inference.add_argument("--backend", choices=list(BACKENDS), default="svc")
+    inference.add_argument("--rate", type=float, default=100, help="samples per second for the latency")
+    inference.add_argument("--seconds", type=float, default=10)
+    inference.set_defaults(func=bench_inference)
+    args = parser.parse_args()
+    args.func(args)
+
+
+if __name__ == '__main__':
+    main()
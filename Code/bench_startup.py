@@ -0,0 +1,140 @@
+# !/usr/bin/env python3
+# coding: utf-8
+# -*- coding: utf-8 -*-
+
+# Startup benchmarks for IPlanPy. Every measurement runs in a fresh interpreter, so nothing is
+# imported already. Both benchmarks exit with status 1 if the budget is exceeded.
+#
+# Usage:
+#   python3 bench_startup.py imports [--budget MS] [--modules ...]   python -X importtime per module
+#   python3 bench_startup.py paint [--budget MS]                     time to the first paint of the window
+#                                                                    (offscreen Qt platform) and until the
+#                                                                    gesture model is ready
+
+import argparse
+import os
+import subprocess
+import sys
+import time
+
+# not needed at startup, should only be imported in the background
+HEAVY_MODULES = ("matplotlib", "pylab", "sklearn", "scipy")
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+
+# Runs `python -X importtime -c "import module"` and returns the cumulative import time of `module` in
+# seconds and the names of all imported modules, or None and the error output if the import failed.
+def import_time(module):
+    process = subprocess.run([sys.executable, "-X", "importtime", "-c", "import " + module],
+                             cwd=HERE, stderr=subprocess.PIPE, universal_newlines=True)
+    if process.returncode != 0:
+        return None, process.stderr.strip().splitlines()[-1:]
+    total = None
+    imported = []
+    for line in process.stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        if not cumulative.strip().isdigit():
+            continue  # header
+        name = name.strip()
+        imported.append(name)
+        if name == module:
+            total = int(cumulative) / 1e6
+    return total, imported
+
+
+def bench_imports(args):
+    failed = False
+    for module in args.modules:
+        seconds, imported = import_time(module)
+        if seconds is None:
+            print("%-20s import failed: %s" % (module, " ".join(imported)))
+            failed = True
+            continue
+        heavy = sorted({name.split(".")[0] for name in imported} & set(HEAVY_MODULES))
+        over = seconds * 1000 > args.budget
+        print("%-20s %8.1f ms%s%s" % (module, seconds * 1000, "  over budget" if over else "",
+                                      "  imports " + ", ".join(heavy) if heavy else ""))
+        failed = failed or over or bool(heavy)
+    sys.exit(1 if failed else 0)
+
+
+# Started by bench_paint() in a new interpreter: prints "paint" when the IPlanPy window is painted for
+# the first time and "model" when the gesture model is ready.
+def paint_child(args):
+    from PyQt5 import QtCore, QtWidgets
+    from iplanpy import IPlanPy
+
+    class PaintWatcher(QtCore.QObject):
+        def eventFilter(self, obj, event):
+            if event.type() == QtCore.QEvent.Paint and not self.painted:
+                self.painted = True
+                print("paint", flush=True)
+            return False
+
+    app = QtWidgets.QApplication(sys.argv)
+    watcher = PaintWatcher()
+    watcher.painted = False
+    app.installEventFilter(watcher)
+    window = IPlanPy()
+    timer = QtCore.QTimer()
+
+    def check_model():
+        if window.classifier.ready.is_set():
+            print("model", flush=True)
+            app.quit()
+
+    timer.timeout.connect(check_model)
+    timer.start(10)
+    QtCore.QTimer.singleShot(int(args.timeout * 1000), app.quit)
+    app.exec_()
+
+
+def bench_paint(args):
+    env = dict(os.environ, QT_QPA_PLATFORM="offscreen")
+    times = {}
+    for _ in range(args.runs):
+        start = time.perf_counter()
+        process = subprocess.Popen([sys.executable, os.path.abspath(__file__), "paint-child"], cwd=HERE, env=env,
+                                   stdout=subprocess.PIPE, universal_newlines=True)
+        for line in process.stdout:
+            times.setdefault(line.strip(), []).append(time.perf_counter() - start)
+        process.wait()
+        if process.returncode != 0:
+            print("IPlanPy failed to start (exit status %d)" % process.returncode)
+            sys.exit(1)
+    if "paint" not in times:
+        print("the window was not painted")
+        sys.exit(1)
+    paint = min(times["paint"])
+    print("first paint %8.1f ms (best of %d)" % (paint * 1000, args.runs))
+    if "model" in times:
+        print("model ready %8.1f ms" % (min(times["model"]) * 1000))
+    if paint * 1000 > args.budget:
+        print("over budget (%.0f ms)" % args.budget)
+        sys.exit(1)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    sub = parser.add_subparsers(dest="benchmark")
+    sub.required = True
+    imports = sub.add_parser("imports", help="import time of the application modules")
+    imports.add_argument("--budget", type=float, default=400, help="milliseconds per module")
+    imports.add_argument("--modules", nargs="+",
+                         default=["vectortransform", "gestureclassifier", "deviceregistry", "iplanpy"])
+    imports.set_defaults(func=bench_imports)
+    paint = sub.add_parser("paint", help="time to the first paint of the IPlanPy window")
+    paint.add_argument("--budget", type=float, default=1000, help="milliseconds")
+    paint.add_argument("--runs", type=int, default=3)
+    paint.set_defaults(func=bench_paint)
+    child = sub.add_parser("paint-child")
+    child.add_argument("--timeout", type=float, default=30)
+    child.set_defaults(func=paint_child)
+    args = parser.parse_args()
+    args.func(args)
+
+
+if __name__ == '__main__':
+    main()
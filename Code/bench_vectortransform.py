@@ -0,0 +1,282 @@
+# !/usr/bin/env python3
+# coding: utf-8
+# -*- coding: utf-8 -*-
+
+# Benchmarks for VectorTransform (IR markers -> screen coordinates).
+#
+# Usage: python3 bench_vectortransform.py <benchmark> [options]
+
+import argparse
+import math
+import random
+import timeit
+import numpy as np
+import recording
+from pointerfilter import NoFilter, WeightedAverageFilter, OneEuroFilter, PredictiveFilter
+from vectortransform import VectorTransform
+
+WIDTH = 1920
+HEIGHT = 1080
+
+
+# IR events of a pointer circling over the screen (four markers moving together) with `jitter`
+# camera pixels of noise, `still` frames out of 4 repeat the previous frame unchanged.
+def ir_events(count, jitter=1, still=0, seed=1):
+    rng = random.Random(seed)
+    events = []
+    for i in range(count):
+        if i > 0 and i % 4 < still:
+            events.append(events[-1])
+            continue
+        t = i / 100
+        cx = 512 + 150 * math.cos(t)
+        cy = 384 + 100 * math.sin(t)
+        event = []
+        for slot, (dx, dy) in enumerate(((-200, -150), (200, -150), (200, 150), (-200, 150))):
+            event.append({'id': slot,
+                          'x': int(cx + dx + rng.randint(-jitter, jitter)),
+                          'y': int(cy + dy + rng.randint(-jitter, jitter)),
+                          'size': 2 + slot % 3})
+        events.append(event)
+    return events
+
+
+# Frames of a pointer that jumps between random targets (`move` seconds of movement, then `hold` seconds
+# resting) at 100 frames per second. Returns the times, the exact markers and the markers with `jitter`
+# camera pixels of noise.
+def pointer_trace(seconds, jitter=1.0, move=0.3, hold=0.7, seed=1):
+    rng = np.random.default_rng(seed)
+    times = np.arange(int(seconds * 100)) / 100
+    phase = times % (move + hold)
+    segment = (times // (move + hold)).astype(int)
+    targets = rng.uniform((400, 320), (624, 448), size=(segment[-1] + 2, 2))
+    progress = np.minimum(phase / move, 1.0)
+    progress = progress * progress * (3 - 2 * progress)  # smoothstep
+    center = targets[segment] + (targets[segment + 1] - targets[segment]) * progress[:, None]
+    corners = np.array(((-200, -150), (200, -150), (200, 150), (-200, 150)))
+    exact = np.zeros((len(times), 4, 3))
+    exact[:, :, :2] = center[:, None, :] + corners
+    exact[:, :, 2] = 3
+    noisy = exact.copy()
+    noisy[:, :, :2] = np.round(exact[:, :, :2] + rng.normal(0, jitter, size=(len(times), 4, 2)))
+    return times, exact, noisy
+
+
+class LegacyVectorTransform(VectorTransform):
+    # Per-frame math of the previous implementation (numpy.matrix, solve() and inv() on every frame,
+    # destination basis rebuilt every time), kept as the baseline for the frame benchmark.
+    def transform(self, signals, x_size, y_size):
+        coords = self.filter_signals(signals)
+        vectors = self.get_ordered_vectors(coords)
+        sx1, sy1 = vectors[0]
+        sx2, sy2 = vectors[1]
+        sx3, sy3 = vectors[2]
+        sx4, sy4 = vectors[3]
+        l, m, t = self.legacy_factor_vector(sx1, sx2, sx3, sx4, sy1, sy2, sy3, sy4)
+        unit_to_source = np.matrix([[l * sx1, m * sx2, t * sx3],
+                                    [l * sy1, m * sy2, t * sy3],
+                                    [l, m, t]])
+        dx1, dy1 = 0, y_size
+        dx2, dy2 = x_size, y_size
+        dx3, dy3 = x_size, 0
+        dx4, dy4 = 0, 0
+        l, m, t = self.legacy_factor_vector(dx1, dx2, dx3, dx4, dy1, dy2, dy3, dy4)
+        unit_to_destination = np.matrix([[l * dx1, m * dx2, t * dx3],
+                                         [l * dy1, m * dy2, t * dy3],
+                                         [l, m, t]])
+        try:
+            source_to_unit = np.linalg.inv(unit_to_source)
+        except Exception:
+            return 0, 0
+        source_to_destination = unit_to_destination @ source_to_unit
+        x, y, z = np.asarray(source_to_destination @ np.matrix([[512], [384], [1]])).ravel().tolist()
+        return self.pointer_filter.apply(x / z, y / z, 0.0)
+
+    def legacy_factor_vector(self, x1, x2, x3, x4, y1, y2, y3, y4):
+        source_points_123 = np.matrix([[x1, x2, x3], [y1, y2, y3], [1, 1, 1]])
+        try:
+            scale_to_source = np.linalg.solve(source_points_123, [[x4], [y4], [1]])
+        except Exception:
+            return 0, 0, 0
+        return np.asarray(scale_to_source).ravel().tolist()
+
+
+class UntrackedVectorTransform(VectorTransform):
+    # Orders the markers by position in every frame and drops frames without all four of them, like before
+    # the marker tracker.
+    def transform(self, signals, x_size, y_size, report_time=None, default=(0, 0)):
+        if len(signals) < 4:
+            return default
+        point = self.map_center(self.get_ordered_vectors(self.filter_signals(signals)), x_size, y_size)
+        if point is None:
+            return default
+        return self.pointer_filter.apply(point[0], point[1], report_time)
+
+
+# Cost per IR frame of the previous and the current implementation, and the largest difference
+# between their results. "unfiltered" is the current implementation without a pointer filter, the
+# filter rows are the cost of the filters alone (apply() on the unfiltered points), "weighted" is the
+# default filter.
+def bench_frame(args):
+    events = ir_events(args.frames, args.jitter, args.still)
+    results = {}
+
+    def report(name, seconds):
+        print("%-10s %7.2f us/frame  %9.0f frames/s" % (name, seconds / len(events) * 1e6, len(events) / seconds))
+
+    for name, transform in (("legacy", LegacyVectorTransform()), ("cached", VectorTransform()),
+                            ("unfiltered", VectorTransform(NoFilter()))):
+        results[name] = [transform.transform(event, WIDTH, HEIGHT) for event in events]
+
+        def run():
+            for event in events:
+                transform.transform(event, WIDTH, HEIGHT)
+
+        report(name, min(timeit.repeat(run, number=1, repeat=5)))
+    points = [(x, y, k * 0.01) for k, (x, y) in enumerate(results["unfiltered"])]
+    for name in ("weighted", "one-euro", "predictive"):
+        pointer_filter = FILTERS[name](args)
+
+        def run():
+            for x, y, t in points:
+                pointer_filter.apply(x, y, t)
+
+        report(name, min(timeit.repeat(run, number=1, repeat=5)))
+    difference = np.max(np.abs(np.array(results["legacy"]) - np.array(results["cached"])))
+    print("largest difference to legacy: %.3g px" % difference)
+
+
+# Frames per second of transform_batch() compared to calling transform() per frame, and whether
+# both give exactly the same coordinates.
+def bench_batch(args):
+    events = ir_events(args.frames, args.jitter)
+    frames = np.array([[(blob['x'], blob['y'], blob['size']) for blob in event] for event in events], dtype=np.int16)
+    transform = VectorTransform()
+    start = timeit.default_timer()
+    streamed = np.array([transform.transform(event, WIDTH, HEIGHT) for event in events])
+    streaming_seconds = timeit.default_timer() - start
+    batched = VectorTransform().transform_batch(frames, WIDTH, HEIGHT)
+    print("streaming %12.0f frames/s" % (len(events) / streaming_seconds))
+    for n in args.sizes:
+        repeated = np.resize(frames, (n, 4, 3))
+        seconds = min(timeit.repeat(lambda: VectorTransform().transform_batch(repeated, WIDTH, HEIGHT),
+                                    number=1, repeat=3))
+        print("batch of %8d %12.0f frames/s" % (n, n / seconds))
+    print("identical to streaming: %s" % np.array_equal(streamed, batched))
+
+
+# Frames with a pointer position and error against the exact path while markers flicker: every marker is
+# missing from a frame with probability --dropout.
+def bench_tracking(args):
+    times, exact, noisy = pointer_trace(args.seconds, args.jitter)
+    truth = VectorTransform(NoFilter()).transform_batch(exact, WIDTH, HEIGHT, times)
+    rng = np.random.default_rng(2)
+    visible = rng.random(noisy.shape[:2]) >= args.dropout
+    events = [[{'id': slot, 'x': int(x), 'y': int(y), 'size': int(size)}
+               for slot, ((x, y, size), seen) in enumerate(zip(frame, mask)) if seen]
+              for frame, mask in zip(noisy.tolist(), visible.tolist())]
+    print("%d%% of the frames have all four markers" % (np.all(visible, axis=1).mean() * 100))
+    print("%-10s %10s %10s %10s %10s" % ("", "positions", "error px", "resolved", "us/frame"))
+    for name, cls in (("untracked", UntrackedVectorTransform), ("tracked", VectorTransform)):
+        transform = cls(NoFilter())
+        start = timeit.default_timer()
+        points = [transform.transform(event, WIDTH, HEIGHT, t, None) for event, t in zip(events, times.tolist())]
+        seconds = timeit.default_timer() - start
+        found = np.array([point is not None for point in points])
+        errors = np.sum((np.array([point for point in points if point is not None]) - truth[found]) ** 2, axis=1)
+        resolved = transform.tracker.resolved if name == "tracked" else found.sum()
+        print("%-10s %9.1f%% %10.2f %10d %10.2f" % (name, found.mean() * 100, rms(errors), resolved,
+                                                  seconds / len(events) * 1e6))
+
+
+# Root mean square of squared distances (nan if there are none).
+def rms(squared):
+    return math.sqrt(squared.mean()) if len(squared) else float('nan')
+
+
+FILTERS = {
+    'none': lambda args: NoFilter(),
+    'weighted': lambda args: WeightedAverageFilter(8),
+    'one-euro': lambda args: OneEuroFilter(args.min_cutoff, args.beta),
+    'predictive': lambda args: PredictiveFilter(args.lead, smoothing=OneEuroFilter(args.min_cutoff, args.beta)),
+}
+
+
+# Lag and jitter of every pointer filter. The reference is the exact pointer path of a synthetic trace, or
+# for a capture (--capture) the raw points smoothed without delay (centered moving average). Lag is the
+# delay that fits the output best to the reference while the pointer moves, jitter the RMS deviation
+# while it rests (reference slower than --still-speed px/s).
+def bench_filters(args):
+    if args.capture:
+        times, frames = recording.ir_frames(recording.load_capture(args.capture))
+        raw = VectorTransform(NoFilter()).transform_batch(frames, WIDTH, HEIGHT, times)
+        valid = np.any(raw != 0, axis=1)
+        times, frames, raw = times[valid], frames[valid], raw[valid]
+        kernel = np.ones(9) / 9
+        reference = np.stack([np.convolve(np.pad(raw[:, k], 4, mode='edge'), kernel, mode='valid')
+                              for k in range(2)], axis=1)
+    else:
+        times, exact, frames = pointer_trace(args.seconds, args.jitter)
+        reference = VectorTransform(NoFilter()).transform_batch(exact, WIDTH, HEIGHT, times)
+    if len(times) < 2:
+        print("not enough IR frames")
+        return
+    speed = np.hypot(*np.gradient(reference, times, axis=0).T)
+    moving = speed >= args.still_speed
+    still = ~moving
+    lags = np.arange(-0.05, 0.2, 0.001)
+
+    print("%-11s %8s %12s %12s %10s" % ("filter", "lag ms", "moving px", "jitter px", "us/frame"))
+    for name in args.filters:
+        transform = VectorTransform(FILTERS[name](args))
+        start = timeit.default_timer()
+        points = transform.transform_batch(frames, WIDTH, HEIGHT, times)
+        seconds = timeit.default_timer() - start
+        errors = []
+        for lag in lags:
+            delayed = np.stack([np.interp(times - lag, times, reference[:, k]) for k in range(2)], axis=1)
+            errors.append(rms(np.sum((points[moving] - delayed[moving]) ** 2, axis=1)))
+        deviation = np.sum((points - reference) ** 2, axis=1)
+        print("%-11s %8.1f %12.2f %12.2f %10.2f" % (
+            name, lags[int(np.argmin(errors))] * 1000, rms(deviation[moving]), rms(deviation[still]),
+            seconds / len(times) * 1e6))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    sub = parser.add_subparsers(dest="benchmark")
+    sub.required = True
+    frame = sub.add_parser("frame", help="cost per IR frame")
+    frame.add_argument("--frames", type=int, default=20000)
+    frame.add_argument("--jitter", type=int, default=1, help="noise of the marker positions in camera pixels")
+    frame.add_argument("--still", type=int, default=0, help="unchanged frames out of every 4")
+    frame.add_argument("--min-cutoff", type=float, default=1.0)
+    frame.add_argument("--beta", type=float, default=0.007)
+    frame.add_argument("--lead", type=float, default=0.03)
+    frame.set_defaults(func=bench_frame)
+    batch = sub.add_parser("batch", help="throughput of transform_batch()")
+    batch.add_argument("--frames", type=int, default=20000, help="frames compared with the streaming path")
+    batch.add_argument("--jitter", type=int, default=1)
+    batch.add_argument("--sizes", type=int, nargs="+", default=[1000, 100000, 1000000])
+    batch.set_defaults(func=bench_batch)
+    tracking = sub.add_parser("tracking", help="positions and error with flickering markers")
+    tracking.add_argument("--seconds", type=float, default=30)
+    tracking.add_argument("--jitter", type=float, default=1.0)
+    tracking.add_argument("--dropout", type=float, default=0.1, help="probability of a marker to be missing")
+    tracking.set_defaults(func=bench_tracking)
+    filters = sub.add_parser("filters", help="lag and jitter of the pointer filters")
+    filters.add_argument("--capture", help="capture file (see recording.py) instead of a synthetic trace")
+    filters.add_argument("--seconds", type=float, default=30)
+    filters.add_argument("--jitter", type=float, default=1.0, help="noise of the synthetic markers in camera pixels")
+    filters.add_argument("--still-speed", type=float, default=50.0)
+    filters.add_argument("--filters", nargs="+", choices=list(FILTERS), default=list(FILTERS))
+    filters.add_argument("--min-cutoff", type=float, default=1.0)
+    filters.add_argument("--beta", type=float, default=0.007)
+    filters.add_argument("--lead", type=float, default=0.03, help="prediction of the predictive filter in seconds")
+    filters.set_defaults(func=bench_filters)
+    args = parser.parse_args()
+    args.func(args)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,708 @@
+# !/usr/bin/env python3
+# coding: utf-8
+# -*- coding: utf-8 -*-
+
+# Benchmarks for the Wiimote driver that run without Bluetooth hardware.
+# A SocketPairTransport stands in for the L2CAP sockets of a real Wiimote.
+#
+# Usage: python3 bench_wiimote.py <benchmark> [options]
+
+import argparse
+import collections
+import os
+import statistics
+import sys
+import tempfile
+import threading
+import time
+import timeit
+import tracemalloc
+import latency
+import recording
+import tracing
+import wiimote
+
+MODEL = 'Nintendo RVL-CNT-01-TR'
+ADDRESS = '00:00:00:00:00:00'
+
+
+# Input report 0x31 (buttons + accelerometer) as sent over the data channel.
+def accelerometer_report(x=0x80, y=0x80, z=0x80, buttons=0x0000):
+    return bytes([0xa1, 0x31, buttons >> 8, buttons & 0xff, x, y, z])
+
+
+# Input report 0x33 (buttons + accelerometer + extended IR) with four IR objects.
+def ir_report():
+    ir = [0x40, 0x30, 0x15, 0xc0, 0x30, 0x25, 0x40, 0xb0, 0x35, 0xc0, 0xb0, 0x44, 0xff, 0xff]
+    return bytes([0xa1, 0x33, 0x00, 0x00, 0x80, 0x82, 0x9a] + ir[:12])
+
+
+class SimulatedWiimote:
+    # Answers memory reads and writes arriving at the peer end of a SocketPairTransport.
+    # Each answer leaves `latency` seconds after its request arrived, and the device needs
+    # `service_time` seconds per request, like a Wiimote behind a Bluetooth link.
+    def __init__(self, transport, latency=0.004, service_time=0.0005):
+        self.peer = transport.peer
+        self.latency = latency
+        self.service_time = service_time
+        self.memory = collections.defaultdict(int)
+        self.arrivals = collections.defaultdict(list)  # report id -> arrival times
+        self._answers = collections.deque()
+        self._ready = threading.Condition()
+        self._last_due = 0
+        self.running = True
+        threading.Thread(target=self._receive, daemon=True).start()
+        threading.Thread(target=self._answer, daemon=True).start()
+
+    def _receive(self):
+        while self.running:
+            try:
+                request = self.peer.recv(32)
+            except OSError:
+                return
+            if len(request) < 2:
+                return
+            self.arrivals[request[1]].append(time.perf_counter())
+            answers = self._process(request)
+            if not answers:
+                continue
+            with self._ready:
+                for answer in answers:
+                    due = max(time.perf_counter() + self.latency, self._last_due + self.service_time)
+                    self._last_due = due
+                    self._answers.append((due, answer))
+                self._ready.notify()
+
+    def _process(self, request):
+        rpt = request[1]
+        if rpt == 0x16:
+            address = int.from_bytes(request[3:6], 'big')
+            for i in range(request[6]):
+                self.memory[address + i] = request[7 + i]
+            return [bytes([0xa1, 0x22, 0x00, 0x00, 0x16, 0x00])]
+        if rpt == 0x17:
+            address = int.from_bytes(request[3:6], 'big')
+            amount = int.from_bytes(request[6:8], 'big')
+            answers = []
+            for offset in range(0, amount, 16):
+                size = min(16, amount - offset)
+                data = [self.memory[address + offset + i] for i in range(size)] + [0] * (16 - size)
+                low = (address + offset) & 0xffff
+                answers.append(bytes([0xa1, 0x21, 0x00, 0x00, (size - 1) << 4, low >> 8, low & 0xff] + data))
+            return answers
+        return []
+
+    def _answer(self):
+        while self.running:
+            with self._ready:
+                while not self._answers:
+                    self._ready.wait()
+                due, answer = self._answers.popleft()
+            delay = due - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            try:
+                self.peer.send(answer)
+            except OSError:
+                return
+
+
+def percentiles(samples_ns):
+    samples = sorted(samples_ns)
+    p = [samples[int(len(samples) * q) - 1] for q in (0.5, 0.95, 0.99)]
+    return "p50 %7.1f us  p95 %7.1f us  p99 %7.1f us  mean %7.1f us" % (
+        p[0] / 1000, p[1] / 1000, p[2] / 1000, statistics.mean(samples) / 1000)
+
+
+class PollingReceiver(threading.Thread):
+    # Receive loop of the previous implementation (blocking recv + sleep(0.001)),
+    # kept here as the baseline for the receive benchmark.
+    def __init__(self, com, sock):
+        super().__init__(daemon=True)
+        self.com = com
+        self.sock = sock
+        self.sock.setblocking(True)
+        self.sock.settimeout(1)
+        self.running = True
+
+    def run(self):
+        while self.running:
+            try:
+                data = self.sock.recv(32)
+            except OSError:
+                continue
+            self.com._handle(data)
+            time.sleep(0.001)
+
+
+# Measures the time from writing a report into the socket until the accelerometer callback runs.
+def bench_receive(args):
+    for loop in ("event", "polling"):
+        transport = wiimote.SocketPairTransport()
+        reactor = wiimote.Reactor(stop_when_idle=True)
+        mote = wiimote.WiiMote(ADDRESS, MODEL, transport, reactor=reactor)
+        if loop == "polling":
+            mote._com.stop()
+            reactor.join()
+            transport = wiimote.SocketPairTransport()
+            mote._com._transport = transport
+            poller = PollingReceiver(mote._com, transport._socket)
+            poller.start()
+        arrived = threading.Event()
+        received = []
+
+        def on_accelerometer(state):
+            received.append(time.perf_counter_ns())
+            arrived.set()
+
+        mote.accelerometer.register_callback(on_accelerometer)
+        latencies = []
+        for i in range(args.reports):
+            arrived.clear()
+            sent = time.perf_counter_ns()
+            transport.peer.send(accelerometer_report(i & 0xff))
+            arrived.wait(1)
+            latencies.append(received[-1] - sent)
+            time.sleep(args.interval)
+        if loop == "polling":
+            poller.running = False
+        else:
+            mote.disconnect()
+        print("%-8s %s" % (loop, percentiles(latencies)))
+
+
+# Feeds reports at full speed to a deliberately slow IR/accelerometer consumer and
+# reports how the dispatch layer coalesced or queued payloads. The button changes are
+# lossless: once the consumer has caught up every change has to be delivered.
+def bench_dispatch(args):
+    transport = wiimote.SocketPairTransport()
+    mote = wiimote.WiiMote(ADDRESS, MODEL, transport)
+    changes = []
+
+    def slow_consumer(state):
+        time.sleep(args.consumer_delay)
+
+    def slow_buttons(diff):
+        changes.extend(diff)
+        time.sleep(args.consumer_delay)
+
+    mote.accelerometer.register_callback(slow_consumer)
+    mote.buttons.register_callback(slow_buttons)
+    start = time.perf_counter()
+    for i in range(args.reports):
+        # toggle the A button on every report so that each one (but the first) changes the button state
+        transport.peer.send(accelerometer_report(i & 0xff, buttons=0x0008 * (i & 1)))
+    elapsed = time.perf_counter() - start
+    time.sleep(0.1)  # let the receive loop drain the socket
+    handled = mote.get_dispatch_stats()
+    deadline = time.monotonic() + args.reports * args.consumer_delay + 5
+    while len(changes) < args.reports - 1 and time.monotonic() < deadline:
+        time.sleep(0.01)
+    mote.disconnect()
+    print("sent %d reports in %.3f s" % (args.reports, elapsed))
+    for stream, stats in sorted(handled.items()):
+        for entry in stats:
+            print("%-14s %s" % (stream, entry))
+    print("button changes: %d sent, %d delivered in the end" % (args.reports - 1, len(changes)))
+
+
+# Report decoding of the previous implementation, kept here as the baseline for the decode benchmark.
+def legacy_decode(bytes_read, button_state):
+    report = bytes_read[1:]
+    btn_bytes = (report[1] << 8) + report[2]
+    new_state = {}
+    for btn, mask in list(wiimote.Buttons.BUTTONS.items()):
+        new_state[btn] = bool(mask & btn_bytes)
+    diff = []
+    for btn, state in list(new_state.items()):
+        if button_state[btn] != state:
+            diff.append((btn, state))
+            button_state[btn] = state
+    report = bytes_read[1:]
+    x_msb, y_msb, z_msb = report[3:6]
+    x = (x_msb << 2) + ((report[1] & 0b01100000) >> 5)
+    y = (y_msb << 2) + ((report[2] & 0b00100000) >> 4)
+    z = (z_msb << 2) + ((report[2] & 0b01000000) >> 5)
+    accelerometer_state = [x, y, z]
+    report = bytes_read[1:]
+    ir_data = report[6:]
+    ir_state = []
+    for ir_obj in range(4):
+        data = ir_data[ir_obj*3:(ir_obj+1)*3]
+        x = data[0] + ((data[2] & 0b00110000) << 4)
+        y = data[1] + ((data[2] & 0b11000000) << 2)
+        size = data[2] & 0b00001111
+        if size != 0:
+            ir_state.append({'id': ir_obj, 'x': x, 'y': y, 'size': size})
+    return diff, accelerometer_state, ir_state
+
+
+# Peak of memory allocated while decoding a single report, in bytes.
+def allocated_per_report(decode, report):
+    decode(report)  # warm up caches
+    tracemalloc.start()
+    tracemalloc.reset_peak()
+    before = tracemalloc.get_traced_memory()[0]
+    decode(report)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return peak - before
+
+
+# Decode cost of one 0x33 report (buttons, accelerometer, IR) without callback work.
+# "app" is the setup IPlanPy uses: compat callbacks and no telemetry (telemetry_capacity=0).
+def bench_decode(args):
+    report = ir_report()
+    button_state = {btn: False for btn in wiimote.Buttons.BUTTONS}
+    transport = wiimote.SocketPairTransport()
+    mote = wiimote.WiiMote(ADDRESS, MODEL, transport)
+    mote.disconnect()
+
+    def ignore(payload):
+        pass
+
+    # the receive loop hands the same preallocated view to _handle_report() for every report
+    mote._com._rx_buffer[:len(report)] = report
+
+    def decode_received(report):
+        mote._com._handle_report(mote._com._rx_report)
+
+    def decode_legacy(report):
+        legacy_decode(report, button_state)
+
+    telemetry = mote.telemetry
+    candidates = [("legacy", decode_legacy), ("slots", decode_received), ("slots+compat", decode_received),
+                  ("app", decode_received), ("+tracing", decode_received)]
+    for name, decode in candidates:
+        if name == "slots+compat":
+            for sensor in (mote.accelerometer, mote.buttons, mote.ir):
+                sensor.register_callback(ignore, wiimote.DIRECT)
+        if name == "app":
+            mote.telemetry = None
+        if name == "+tracing":
+            mote.telemetry = telemetry
+            tracing.enable(tracing.ALL)
+        seconds = min(timeit.repeat(lambda: decode(report), number=args.reports, repeat=7))
+        print("%-13s %6.2f us/report  %5d bytes allocated/report" %
+              (name, seconds / args.reports * 1e6, allocated_per_report(decode, report)))
+    tracing.disable()
+
+
+# IR camera setup and memory reads against a simulated Wiimote. "serial" only sends a request
+# after the previous one has been answered, "legacy read" polls for the answer like the previous
+# implementation (sleep(0.01) until done).
+def bench_memory(args):
+    transport = wiimote.SocketPairTransport()
+    simulated = SimulatedWiimote(transport, args.latency / 1000, args.service_time / 1000)
+    mote = wiimote.WiiMote(ADDRESS, MODEL, transport)
+    mote.ir.set_mode_sensitivity(wiimote.IRCam.MODE_EXTENDED, 3).result(5)  # warm up
+    for name, window in (("serial", 1), ("pipelined", args.window)):
+        mote.memory.max_writes_in_flight = window
+        durations = []
+        for _ in range(args.repeat):
+            start = time.perf_counter()
+            mote.ir.set_mode_sensitivity(wiimote.IRCam.MODE_EXTENDED, 3).result(5)
+            durations.append(time.perf_counter() - start)
+        print("IR camera setup, %-10s %6.1f ms" % (name, statistics.median(durations) * 1000))
+    start = time.perf_counter()
+    mote.memory.write(0x0000, list(range(64)), eeprom=True).result(5)
+    print("64 byte write in 4 chunks   %6.1f ms" % ((time.perf_counter() - start) * 1000))
+    for name in ("legacy read", "future read"):
+        durations = []
+        for _ in range(args.repeat):
+            start = time.perf_counter()
+            future = mote.memory.read_async(0x0000, 64, eeprom=True)
+            if name == "legacy read":
+                while not future.done():
+                    time.sleep(0.01)
+            data = future.result(5)
+            durations.append(time.perf_counter() - start)
+        assert data == list(range(64))
+        print("64 byte %-19s %6.1f ms" % (name, statistics.median(durations) * 1000))
+    simulated.running = False
+    mote.disconnect()
+
+
+# Drives VectorTransform, GestureClassifier and optionally the whole IPlanPy window with a
+# replayed capture and reports the throughput and the latency per stage (see latency.py).
+# Without --capture an artificial session is used.
+def bench_replay(args):
+    path = args.capture
+    if path is None:
+        path = os.path.join(tempfile.mkdtemp(), "synthetic.wiirec")
+        recording.synthesize(path, seconds=args.seconds)
+    transport = recording.ReplayTransport(path, speed=args.speed or None)
+    latency.monitor.enabled = True
+    mote = wiimote.WiiMote(ADDRESS, MODEL, transport)
+    if args.gui:
+        os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+        from PyQt5 import QtWidgets
+        from iplanpy import IPlanPy
+        app = QtWidgets.QApplication(sys.argv)
+        window = IPlanPy()
+        window.attach_wiimote(mote)
+        start = time.perf_counter()
+        transport.start()
+        while not transport.finished.is_set():
+            app.processEvents()
+    else:
+        from vectortransform import VectorTransform
+        from gestureclassifier import GestureClassifier
+        transform = VectorTransform()
+        classifier = GestureClassifier()
+
+        def on_ir(event):
+            report_time = latency.current_report_time()
+            transform.transform(event, 1920, 1080, report_time)
+            latency.monitor.mark(latency.TRANSFORM, report_time)
+
+        def on_accelerometer(event):
+            classifier.add_accelerometer_data(event[0], event[1], event[2])
+
+        mote.ir.register_callback(on_ir, args.policy)
+        mote.accelerometer.register_callback(on_accelerometer, args.policy)
+        start = time.perf_counter()
+        transport.start()
+        transport.finished.wait()
+    elapsed = time.perf_counter() - start
+    time.sleep(0.1)  # let the queued callbacks finish
+    print("replayed %d reports in %.2f s: %.0f reports/s" % (transport.replayed, elapsed, transport.replayed / elapsed))
+    for stream, stats in sorted(mote.get_dispatch_stats().items()):
+        for entry in stats:
+            print("%-14s %s" % (stream, entry))
+    print("latency since report was received:")
+    print(latency.monitor.format())
+    mote.disconnect()
+
+
+# Simulates 1, 4 and 8 Wiimotes sending 100 reports/s each and compares one receive thread per
+# device with a single shared reactor: latency from socket to callback and per-device statistics.
+def bench_reactor(args):
+    for devices in args.devices:
+        for mode in ("threads", "shared"):
+            shared = wiimote.Reactor()
+            motes = []
+            sent = []
+            latencies = []
+            for n in range(devices):
+                transport = wiimote.SocketPairTransport()
+                reactor = shared if mode == "shared" else wiimote.Reactor(stop_when_idle=True)
+                mote = wiimote.WiiMote("00:00:00:00:00:%02x" % n, MODEL, transport, reactor=reactor)
+                times = collections.deque()
+
+                def on_accelerometer(state, times=times):
+                    latencies.append(time.perf_counter_ns() - times.popleft())
+
+                mote.accelerometer.register_callback(on_accelerometer, wiimote.DIRECT)
+                motes.append(mote)
+                sent.append((transport.peer, times))
+            interval = 1 / args.rate
+            due = time.perf_counter()
+            for i in range(int(args.seconds * args.rate)):
+                due += interval
+                delay = due - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+                for peer, times in sent:
+                    times.append(time.perf_counter_ns())
+                    peer.send(accelerometer_report(i & 0xff))
+            time.sleep(0.05)
+            stats = [mote.get_stats() for mote in motes]
+            for mote in motes:
+                mote.disconnect()
+            shared.stop()
+            print("%d devices, %-8s %s" % (devices, mode, percentiles(latencies)))
+            print("    reports/s per device %.1f, gaps %d, mean decode %.1f us, max decode %.1f us" % (
+                statistics.mean(s['reports_per_second'] for s in stats),
+                sum(s['gaps'] for s in stats),
+                statistics.mean(s['mean_decode_time'] for s in stats) * 1e6,
+                max(s['max_decode_time'] for s in stats) * 1e6))
+
+
+# Output report encoding and sending of the previous implementation (every call
+# sends immediately on the calling thread), kept as the baseline for the outbound benchmark.
+def legacy_send(com, *bytes_to_send):
+    data_str = com._CMD_SET_REPORT.to_bytes(1, 'big')
+    bytes_to_send = wiimote._flatten(bytes_to_send)
+    bytes_to_send[1] |= int(com.rumble)
+    for b in bytes_to_send:
+        data_str += b.to_bytes(1, 'big')
+    com._transport.send(data_str)
+
+
+# Lets the GUI thread fire LED and rumble changes as fast as it can (like a user dragging a slider)
+# and counts what arrives at the simulated Wiimote and how densely.
+def bench_outbound(args):
+    for mode in ("direct", "queued"):
+        transport = wiimote.SocketPairTransport()
+        mote = wiimote.WiiMote(ADDRESS, MODEL, transport, send_rate=args.rate)
+        arrivals = []
+
+        def drain():
+            while True:
+                try:
+                    data = transport.peer.recv(32)
+                except OSError:
+                    return
+                if not data:
+                    return
+                arrivals.append(time.perf_counter())
+
+        receiver = threading.Thread(target=drain, daemon=True)
+        receiver.start()
+        time.sleep(0.2)  # initial LED and IR setup
+        del arrivals[:]
+        start = time.perf_counter()
+        for i in range(args.changes):
+            if mode == "direct":
+                legacy_send(mote._com, 0x11, (1 << (4 + i % 4)) | (i & 1))
+            else:
+                mote.leds[i % 4] = bool(i & 1)
+                if i % 8 == 0:
+                    mote.rumbler.set_rumble(i % 16 == 0)
+            time.sleep(args.interval)
+        elapsed = time.perf_counter() - start
+        time.sleep(0.2)
+        stats = mote.get_stats()
+        mote.disconnect()
+        receiver.join(1)
+        gaps = [b - a for a, b in zip(arrivals, arrivals[1:])]
+        print("%-7s %d changes in %.3f s -> %d reports sent, %.1f reports/s, min gap %.2f ms" % (
+            mode, args.changes, elapsed, len(arrivals), len(arrivals) / elapsed,
+            min(gaps) * 1000 if gaps else 0))
+        if mode == "queued":
+            print("        coalesced %d, max queue depth %d, send latency mean %.2f ms max %.2f ms" % (
+                stats['coalesced_sends'], stats['max_send_queue_depth'],
+                stats['mean_send_latency'] * 1000, stats['max_send_latency'] * 1000))
+    com = mote._com
+    com._transport = collections.namedtuple('Null', 'send')(lambda data: None)
+    com._outbound = wiimote.OutboundQueue(0)
+    for name, func in (("legacy", lambda: legacy_send(com, 0x16, 0x04, [0xa2, 0x00, 0x09], 1, [0x08] * 16)),
+                       ("queued", lambda: (com._send(0x16, 0x04, [0xa2, 0x00, 0x09], 1, [0x08] * 16),
+                                           com._outbound.flush(com._transport, 0, time.monotonic())))):
+        per_call = min(timeit.repeat(func, number=2000, repeat=5)) / 2000
+        print("encode+send %-7s %.2f us per 22 byte report" % (name, per_call * 1e6))
+
+
+class StreamingWiimote:
+    # Streams input reports at `rate` in the report mode last requested with output report 0x12,
+    # like a Wiimote: 0x31 and 0x33 continuously, 0x30 only when the buttons change.
+    # The scene (buttons, pointer on the board, movement) is set through the attributes.
+    def __init__(self, transport, rate=100):
+        self.peer = transport.peer
+        self.rate = rate
+        self.mode = 0x30
+        self.buttons = 0x0000
+        self.pointing = False
+        self.moving = False
+        self.sent = collections.Counter()
+        self.running = True
+        threading.Thread(target=self._run, daemon=True).start()
+
+    def _report(self, i):
+        if self.mode == 0x30:
+            return bytes([0xa1, 0x30, self.buttons >> 8, self.buttons & 0xff])
+        acc = [0x200 + (60 * (i % 4) if self.moving else 0), 0x200, 0x260]
+        if self.mode == 0x31:
+            return accelerometer_report(acc[0] >> 2, acc[1] >> 2, acc[2] >> 2, self.buttons)
+        blobs = [(400, 300, 3), (600, 300, 3), (600, 500, 3), (400, 500, 3)] if self.pointing else [(1023, 1023, 15)] * 4
+        return recording.build_report(self.buttons, acc, blobs)
+
+    def _run(self):
+        self.peer.setblocking(False)
+        last_buttons = None
+        due = time.perf_counter()
+        i = 0
+        while self.running:
+            try:
+                while True:
+                    request = self.peer.recv(32)
+                    if len(request) > 3 and request[1] == 0x12:
+                        self.mode = request[3]
+            except BlockingIOError:
+                pass
+            except OSError:
+                return
+            if self.mode != 0x30 or self.buttons != last_buttons:
+                last_buttons = self.buttons
+                try:
+                    self.peer.send(self._report(i))
+                except OSError:
+                    return
+                self.sent[self.mode] += 1
+            i += 1
+            due += 1 / self.rate
+            delay = due - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+
+
+# Runs a scripted session against a simulated Wiimote with a fixed report mode (0x33) and with
+# the adaptive ReportModePolicy: reports sent per phase, host decode cost per report type and
+# how long it takes until the pointer moves again after the user picks the Wiimote up.
+def bench_modes(args):
+    phases = [("pointing", dict(pointing=True)),
+              ("idle", dict()),
+              ("B pressed", dict(buttons=0x0004)),
+              ("idle", dict()),
+              ("picked up", dict(pointing=True, moving=True)),
+              ("gestures only", dict(moving=True, gestures_only=True)),
+              ("buttons only", dict(moving=True, buttons_only=True))]
+    for adaptive in (False, True):
+        transport = wiimote.SocketPairTransport()
+        device = StreamingWiimote(transport, args.rate)
+        mote = wiimote.WiiMote(ADDRESS, MODEL, transport, adaptive_report_mode=adaptive)
+        if adaptive:
+            mote._com.mode_policy.idle_timeout = args.idle_timeout
+        pointer_seen = threading.Event()
+
+        def on_ir(event):
+            if len(event) >= 4:
+                pointer_seen.set()
+
+        def on_accelerometer(event):
+            pass
+
+        mote.ir.register_callback(on_ir, wiimote.DIRECT)
+        mote.accelerometer.register_callback(on_accelerometer, wiimote.DIRECT)
+        print("adaptive report mode" if adaptive else "fixed report mode 0x33")
+        for name, scene in phases:
+            if scene.get('gestures_only'):
+                mote.ir.unregister_callback(on_ir)
+            if scene.get('buttons_only'):
+                mote.accelerometer.unregister_callback(on_accelerometer)
+            device.buttons = scene.get('buttons', 0)
+            device.pointing = scene.get('pointing', False)
+            device.moving = scene.get('moving', False)
+            before = sum(device.sent.values())
+            pointer_seen.clear()
+            start = time.perf_counter()
+            wake = ""
+            if device.pointing and pointer_seen.wait(args.seconds):
+                wake = "  pointer after %.1f ms" % ((time.perf_counter() - start) * 1000)
+            time.sleep(max(0.0, args.seconds - (time.perf_counter() - start)))
+            sent = sum(device.sent.values()) - before
+            print("  %-14s %6.1f reports/s  mode 0x%02x%s" % (name, sent / args.seconds, device.mode, wake))
+        stats = mote.get_stats()
+        device.running = False
+        mote.disconnect()
+        for rpt, entry in sorted(stats['report_types'].items()):
+            print("  report 0x%02x: %6d received, %5.1f us decode and callbacks per report" % (
+                rpt, entry['reports'], entry['mean_decode_time'] * 1e6))
+        print("  mode switches: %s" % stats.get('mode_switches', 0))
+
+
+# Old Speaker.beep() loop: encodes every report again and paces with time.sleep(0.01).
+def legacy_beep(mote, samples):
+    for _ in range(20):
+        mote._com._send(0x18, len(samples) << 3, samples)
+        time.sleep(0.01)
+
+
+# Streams a clip while input reports arrive at 100 Hz and a busy thread competes for the GIL,
+# and measures the spacing of the speaker reports arriving at the simulated Wiimote (whose receive
+# thread competes for the GIL as well) and how late the scheduler wrote them.
+def bench_speaker(args):
+    import audio
+    clip = audio.tone(440, args.seconds)
+    samples = list(wiimote.Speaker.BEEP.payloads[0][1:])
+    for mode in ("legacy", "stream"):
+        transport = wiimote.SocketPairTransport()
+        simulated = SimulatedWiimote(transport, latency=0.001, service_time=0.0001)
+        mote = wiimote.WiiMote(ADDRESS, MODEL, transport)
+        mote.accelerometer.register_callback(lambda event: None)
+        running = [True]
+
+        def feed_input():
+            i = 0
+            while running[0]:
+                transport.peer.send(accelerometer_report(i & 0xff))
+                i += 1
+                time.sleep(0.01)
+
+        def busy():
+            while running[0]:
+                sum(range(1000))
+
+        threads = [threading.Thread(target=feed_input, daemon=True), threading.Thread(target=busy, daemon=True)]
+        for thread in threads:
+            thread.start()
+        time.sleep(0.2)
+        if mode == "legacy":
+            for _ in range(int(args.seconds / 0.2)):
+                legacy_beep(mote, samples)
+            expected = 0.01
+        else:
+            mote.speaker.play(clip).result(args.seconds * 2 + 5)
+            expected = clip.interval
+        running[0] = False
+        time.sleep(0.05)
+        arrivals = simulated.arrivals[0x18]
+        intervals = [b - a for a, b in zip(arrivals, arrivals[1:])]
+        deviations = sorted(abs(interval - expected) for interval in intervals)
+        drift = (arrivals[-1] - arrivals[0]) - expected * (len(arrivals) - 1)
+        print("%-7s %4d reports  interval mean %.2f ms  jitter p50 %.2f ms  p99 %.2f ms  max %.2f ms  drift %+.1f ms" % (
+            mode, len(arrivals), statistics.mean(intervals) * 1000, deviations[len(deviations) // 2] * 1000,
+            deviations[int(len(deviations) * 0.99) - 1] * 1000, deviations[-1] * 1000, drift * 1000))
+        if mode == "stream":
+            speaker = mote.speaker
+            print("        written by the scheduler: %d late (> 1 ms), max lateness %.2f ms, %d queued behind other reports" % (
+                speaker.late, speaker.max_lateness * 1000, speaker.queued))
+        simulated.running = False
+        mote.disconnect()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    sub = parser.add_subparsers(dest="benchmark")
+    sub.required = True
+    receive = sub.add_parser("receive", help="latency from socket to callback")
+    receive.add_argument("--reports", type=int, default=2000)
+    receive.add_argument("--interval", type=float, default=0.0005,
+                         help="pause between reports in seconds")
+    receive.set_defaults(func=bench_receive)
+    dispatch = sub.add_parser("dispatch", help="backpressure with a slow consumer")
+    dispatch.add_argument("--reports", type=int, default=1000)
+    dispatch.add_argument("--consumer-delay", type=float, default=0.005,
+                          help="time spent in each callback in seconds")
+    dispatch.set_defaults(func=bench_dispatch)
+    decode = sub.add_parser("decode", help="decode cost and allocations per report")
+    decode.add_argument("--reports", type=int, default=20000)
+    decode.set_defaults(func=bench_decode)
+    memory = sub.add_parser("memory", help="memory request engine against a simulated Wiimote")
+    memory.add_argument("--latency", type=float, default=4.0, help="answer latency in ms")
+    memory.add_argument("--service-time", type=float, default=0.5, help="device time per request in ms")
+    memory.add_argument("--window", type=int, default=4, help="writes in flight when pipelined")
+    memory.add_argument("--repeat", type=int, default=10)
+    memory.set_defaults(func=bench_memory)
+    replay = sub.add_parser("replay", help="drive the input pipeline with a recorded session")
+    replay.add_argument("--capture", help="capture file (default: synthetic session)")
+    replay.add_argument("--seconds", type=float, default=30, help="length of the synthetic session")
+    replay.add_argument("--speed", type=float, default=0, help="replay speed factor, 0: as fast as possible")
+    replay.add_argument("--policy", default=wiimote.DIRECT, help="delivery policy of the consumers")
+    replay.add_argument("--gui", action="store_true", help="drive the IPlanPy window (offscreen)")
+    replay.set_defaults(func=bench_replay)
+    reactor = sub.add_parser("reactor", help="several simulated devices on one receive thread")
+    reactor.add_argument("--devices", type=int, nargs="+", default=[1, 4, 8])
+    reactor.add_argument("--rate", type=float, default=100, help="reports per second and device")
+    reactor.add_argument("--seconds", type=float, default=3)
+    reactor.set_defaults(func=bench_reactor)
+    outbound = sub.add_parser("outbound", help="output report queue with coalescing and rate limit")
+    outbound.add_argument("--changes", type=int, default=2000, help="LED changes made by the GUI thread")
+    outbound.add_argument("--interval", type=float, default=0.0002, help="pause between changes in seconds")
+    outbound.add_argument("--rate", type=float, default=200, help="output reports per second")
+    outbound.set_defaults(func=bench_outbound)
+    modes = sub.add_parser("modes", help="adaptive report mode against a scripted session")
+    modes.add_argument("--seconds", type=float, default=3, help="length of each phase")
+    modes.add_argument("--rate", type=float, default=100, help="reports per second of the simulated Wiimote")
+    modes.add_argument("--idle-timeout", type=float, default=1.0)
+    modes.set_defaults(func=bench_modes)
+    speaker = sub.add_parser("speaker", help="pacing of speaker reports under load")
+    speaker.add_argument("--seconds", type=float, default=2, help="length of the played sound")
+    speaker.set_defaults(func=bench_speaker)
+    args = parser.parse_args()
+    args.func(args)
+
+
+if __name__ == '__main__':
+    main()
@@ -3,42 +3,81 @@
 # -*- coding: utf-8 -*-
 
 
+# Key of the connection between two cards, the same in both directions.
+def connection_key(c1, c2):
+    return frozenset((c1.id, c2.id))
+
+
 class ConnectionManager:
+    # The connections (card pairs) are kept in a dict in the order they were made, keyed by the ids of their
+    # cards, and every card id maps to the keys of its connections (in the same order). Connecting, looking
+    # up and removing a connection takes constant time, deleting the connections of a card time in the
+    # number of its connections. Iterating over the manager yields the connections as (card1, card2).
     def __init__(self):
         super(ConnectionManager, self).__init__()
-        self.connections = []
+        self.connections = {}
+        self.adjacency = {}
         self.restoreable_connections = []
 
+    def __iter__(self):
+        return iter(self.connections.values())
+
+    def __len__(self):
+        return len(self.connections)
+
+    def __contains__(self, connection):
+        return connection_key(*connection) in self.connections
+
+    def _add(self, key, connection):
+        self.connections[key] = connection
+        for card in connection:
+            self.adjacency.setdefault(card.id, {})[key] = None
+
+    def _remove(self, key):
+        connection = self.connections.pop(key)
+        for card in connection:
+            edges = self.adjacency.get(card.id)
+            if edges is not None:
+                edges.pop(key, None)
+                if not edges:
+                    del self.adjacency[card.id]
+        return connection
+
     # Save connection if it does not exist already.
     def connect(self, new_connection):
-        c1, c2 = new_connection
-        if (c1, c2) not in self.connections and (c2, c1) not in self.connections:
-            self.connections.append(new_connection)
+        key = connection_key(*new_connection)
+        if key not in self.connections:
+            self._add(key, new_connection)
+
+    # The connections of `card` in the order they were made.
+    def card_connections(self, card):
+        return [self.connections[key] for key in self.adjacency.get(card.id, ())]
 
     def delete_all_card_connections(self, card, is_restoreable):
-        new_connections = []
-        for conn in self.connections:
-            c1, c2 = conn
-            if c1 is not card and c2 is not card:
-                new_connections.append((c1, c2))
-            else:
-                if is_restoreable is True:
-                    self.restoreable_connections.append(conn)
-        self.connections = new_connections
+        for key in list(self.adjacency.get(card.id, ())):
+            conn = self._remove(key)
+            if is_restoreable is True:
+                self.restoreable_connections.append(conn)
 
     def remove_last_connection(self):
         if len(self.connections) > 0:
-            deleteable_connection = self.connections[-1]
-            if deleteable_connection is not None:
-                self.restoreable_connections.append(deleteable_connection)
-                self.connections.remove(deleteable_connection)
+            deleteable_connection = self._remove(next(reversed(self.connections)))
+            self.restoreable_connections.append(deleteable_connection)
 
+    # A restored connection that was made again in the meantime stays where it is.
     def restore_connection(self):
         if len(self.restoreable_connections) > 0:
-            restoreable = self.restoreable_connections[-1]
-            if restoreable is not None:
-                self.connections.append(restoreable)
-                self.restoreable_connections.remove(restoreable)
+            restoreable = self.restoreable_connections.pop()
+            key = connection_key(*restoreable)
+            if key not in self.connections:
+                self._add(key, restoreable)
+
+    # Deletes all connections and the ones that can be restored. Cards of a new chart get the ids of the
+    # old cards again, a restored connection would connect those.
+    def clear(self):
+        self.connections.clear()
+        self.adjacency.clear()
+        self.restoreable_connections.clear()
 
     def get_centers(self, connection):
         c1, c2 = connection
@@ -0,0 +1,164 @@
+# !/usr/bin/env python3
+# coding: utf-8
+# -*- coding: utf-8 -*-
+
+# Persistent registry of known Wiimotes.
+#
+# For every Wiimote that has been connected once, the registry keeps its Bluetooth address, model name
+# and the time it was last seen. The report mode is not kept, it follows the registered callbacks (see
+# wiimote.ReportModePolicy). A known Wiimote is reconnected with the stored model name, so neither
+# `bluetooth.lookup_name` nor an SDP scan is needed - connecting only costs the L2CAP handshake. The
+# registry is stored as JSON and replaces the old "wii.motes" file (one address per line), which is
+# imported once if present.
+#
+# Usage:
+#   python3 deviceregistry.py            list the known Wiimotes
+#   python3 deviceregistry.py probe      show which known Wiimotes are in reach
+#   python3 deviceregistry.py forget <btaddr>
+
+import argparse
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+import wiimote
+
+REGISTRY_FILE = "wiimotes.json"
+LEGACY_FILE = "wii.motes"
+
+
+class DeviceRecord:
+    def __init__(self, address, model=None, last_seen=0.0):
+        super().__init__()
+        self.address = address
+        self.model = model  # None: not known yet (e.g. imported from wii.motes)
+        self.last_seen = last_seen  # time.time() of the last connection
+
+    def as_dict(self):
+        return {'address': self.address, 'model': self.model,
+                'last_seen': self.last_seen}
+
+    def __repr__(self):
+        return "DeviceRecord(%r, %r)" % (self.address, self.model)
+
+
+class DeviceRegistry:
+    # Loads the registry from `path` once. Every change is written back atomically.
+    def __init__(self, path=REGISTRY_FILE, legacy_path=LEGACY_FILE, probe_timeout=2.0):
+        super().__init__()
+        self.path = path
+        self.probe_timeout = probe_timeout
+        self._lock = threading.Lock()
+        self._devices = {}
+        if os.path.exists(path):
+            with open(path) as f:
+                for entry in json.load(f):
+                    entry.pop('report_mode', None)  # stored by older versions
+                    record = DeviceRecord(**entry)
+                    self._devices[record.address] = record
+        elif legacy_path is not None and os.path.exists(legacy_path):
+            with open(legacy_path) as f:
+                for line in f:
+                    address = line.strip()
+                    if address != "":
+                        self._devices[address] = DeviceRecord(address)
+            self._save()
+
+    def __contains__(self, address):
+        return address in self._devices
+
+    def __len__(self):
+        return len(self._devices)
+
+    # Returns the record of `address` or None.
+    def get(self, address):
+        return self._devices.get(address)
+
+    # Returns all records, the most recently seen first.
+    def devices(self):
+        with self._lock:
+            records = list(self._devices.values())
+        return sorted(records, key=lambda record: record.last_seen, reverse=True)
+
+    def addresses(self):
+        return [record.address for record in self.devices()]
+
+    # Stores a device that has just been connected (or disconnected).
+    def remember(self, address, model):
+        with self._lock:
+            record = self._devices.get(address)
+            if record is None:
+                record = self._devices[address] = DeviceRecord(address)
+            record.model = model
+            record.last_seen = time.time()
+            self._save()
+        return record
+
+    # Stores the model of a connected wiimote.WiiMote.
+    def remember_wiimote(self, mote):
+        return self.remember(mote.btaddr, mote.model)
+
+    def forget(self, address):
+        with self._lock:
+            if self._devices.pop(address, None) is not None:
+                self._save()
+
+    # Connects to `address`. A known model name is used directly instead of asking the device.
+    # `telemetry_capacity` is passed to wiimote.WiiMote.
+    def connect(self, address, reactor=None, telemetry_capacity=1024):
+        record = self.get(address)
+        model = record.model if record is not None else None
+        mote = wiimote.connect(address, model, reactor=reactor, telemetry_capacity=telemetry_capacity)
+        self.remember_wiimote(mote)
+        return mote
+
+    # Checks all known Wiimotes at once. Returns the reachable records, the most recently seen first.
+    def probe(self):
+        records = self.devices()
+        if len(records) == 0:
+            return []
+        with ThreadPoolExecutor(max_workers=len(records)) as pool:
+            reachable = list(pool.map(lambda record: wiimote.probe(record.address, self.probe_timeout), records))
+        return [record for record, ok in zip(records, reachable) if ok]
+
+    # Returns (address, model) tuples of Wiimotes in reach. Known devices are probed first,
+    # the slow SDP scan only runs if none of them answers (or if `full_scan` is set).
+    def discover(self, full_scan=False):
+        found = [(record.address, record.model) for record in self.probe()]
+        if len(found) == 0 or full_scan:
+            for address, model in wiimote.find():
+                if address not in (known for known, _ in found):
+                    found.append((address, model))
+                self.remember(address, model)
+        return found
+
+    def _save(self):
+        data = [record.as_dict() for record in self._devices.values()]
+        temp_path = self.path + ".tmp"
+        with open(temp_path, "w") as f:
+            json.dump(data, f, indent=2)
+        os.replace(temp_path, self.path)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--file", default=REGISTRY_FILE)
+    sub = parser.add_subparsers(dest="command")
+    sub.add_parser("probe")
+    forget = sub.add_parser("forget")
+    forget.add_argument("btaddr")
+    args = parser.parse_args()
+    registry = DeviceRegistry(args.file)
+    if args.command == "forget":
+        registry.forget(args.btaddr)
+        return
+    records = registry.probe() if args.command == "probe" else registry.devices()
+    for record in records:
+        seen = time.strftime("%Y-%m-%d %H:%M", time.localtime(record.last_seen)) if record.last_seen else "never"
+        model = record.model or "unknown model"
+        print("%s  %-24s last seen %s" % (record.address, model, seen))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,181 @@
+# !/usr/bin/env python3
+# coding: utf-8
+# -*- coding: utf-8 -*-
+
+# Models for GestureClassifier. Every backend is fitted with a matrix of feature vectors (one row per
+# window, see GestureClassifier.training_data()) and their categories, and predicts the category of
+# every row of a feature matrix. All backends except "svc" only need NumPy and decide a window in a
+# few microseconds; the scikit-learn SVC is kept as the reference.
+#
+#   threshold  spectral energy in the shake band against a threshold
+#   centroid   nearest class centroid of the standardized features
+#   linear     linear discriminant (shared covariance) of the standardized features
+#   svc        scikit-learn SVC with the default RBF kernel
+#
+# Usage:
+#   backend = create_backend("linear")
+#   backend.fit(features, categories)
+#   backend.predict(features)
+
+import numpy as np
+
+
+class Backend:
+    name = None
+    numpy_only = True  # False if the backend imports scikit-learn (about a second)
+
+    def fit(self, features, categories):
+        raise NotImplementedError()
+
+    def predict(self, features):
+        raise NotImplementedError()
+
+    # Settings that change the fitted model, part of the model store key.
+    def parameters(self):
+        return {}
+
+
+class ThresholdBackend(Backend):
+    # Sum of the squared magnitudes of the bins `band` (start, stop). The threshold and which category is
+    # above it are chosen to classify most training windows correctly.
+    name = "threshold"
+
+    def __init__(self, band=(4, 15)):
+        super().__init__()
+        self.band = tuple(band)
+        self.threshold = None
+        self.categories = None  # (below, above)
+
+    def parameters(self):
+        return {'band': self.band}
+
+    def energy(self, features):
+        band = np.atleast_2d(features)[:, self.band[0]:self.band[1]]
+        return np.einsum('ij,ij->i', band, band)
+
+    def fit(self, features, categories):
+        categories = np.asarray(categories)
+        names = np.unique(categories)
+        if len(names) != 2:
+            raise ValueError("the threshold backend needs exactly two categories")
+        energy = self.energy(features)
+        order = np.argsort(energy)
+        energy, above = energy[order], categories[order] == names[1]
+        # errors when everything up to index k is below the threshold: names[1] below + names[0] above
+        errors = np.concatenate(([0], np.cumsum(above))) + np.concatenate(([0], np.cumsum(~above[::-1])))[::-1]
+        flipped = len(energy) - errors
+        if flipped.min() < errors.min():
+            errors, self.categories = flipped, (names[1], names[0])
+        else:
+            self.categories = (names[0], names[1])
+        k = int(np.argmin(errors))
+        if k == 0:
+            self.threshold = energy[0] - 1
+        elif k == len(energy):
+            self.threshold = energy[-1] + 1
+        else:
+            self.threshold = (energy[k - 1] + energy[k]) / 2
+        return self
+
+    def predict(self, features):
+        return np.where(self.energy(features) > self.threshold, self.categories[1], self.categories[0])
+
+
+class CentroidBackend(Backend):
+    # Features are standardized with the mean and standard deviation of the training data.
+    name = "centroid"
+
+    def __init__(self):
+        super().__init__()
+        self.mean = None
+        self.scale = None
+        self.centroids = None
+        self.categories = None
+
+    def fit(self, features, categories):
+        features = np.asarray(features, dtype=np.float64)
+        categories = np.asarray(categories)
+        self.mean = features.mean(axis=0)
+        self.scale = features.std(axis=0)
+        self.scale[self.scale == 0] = 1.0
+        standardized = (features - self.mean) / self.scale
+        self.categories = np.unique(categories)
+        self.centroids = np.array([standardized[categories == c].mean(axis=0) for c in self.categories])
+        return self
+
+    def predict(self, features):
+        standardized = (np.atleast_2d(features) - self.mean) / self.scale
+        distances = ((standardized[:, None, :] - self.centroids[None, :, :]) ** 2).sum(axis=2)
+        return self.categories[np.argmin(distances, axis=1)]
+
+
+class LinearBackend(Backend):
+    # One weight vector per category from the class means and the shared covariance of the standardized
+    # features (regularized with `ridge`); the category with the largest score wins.
+    name = "linear"
+
+    def __init__(self, ridge=0.1):
+        super().__init__()
+        self.ridge = ridge
+        self.mean = None
+        self.scale = None
+        self.weights = None
+        self.bias = None
+        self.categories = None
+
+    def parameters(self):
+        return {'ridge': self.ridge}
+
+    def fit(self, features, categories):
+        features = np.asarray(features, dtype=np.float64)
+        categories = np.asarray(categories)
+        self.mean = features.mean(axis=0)
+        self.scale = features.std(axis=0)
+        self.scale[self.scale == 0] = 1.0
+        standardized = (features - self.mean) / self.scale
+        self.categories = np.unique(categories)
+        means = np.array([standardized[categories == c].mean(axis=0) for c in self.categories])
+        centered = standardized - means[np.searchsorted(self.categories, categories)]
+        covariance = centered.T @ centered / len(centered) + self.ridge * np.eye(features.shape[1])
+        self.weights = np.linalg.solve(covariance, means.T)  # (features, categories)
+        priors = np.array([np.mean(categories == c) for c in self.categories])
+        self.bias = -0.5 * np.einsum('ij,ji->i', means, self.weights) + np.log(priors)
+        return self
+
+    def predict(self, features):
+        standardized = (np.atleast_2d(features) - self.mean) / self.scale
+        return self.categories[np.argmax(standardized @ self.weights + self.bias, axis=1)]
+
+
+class SVCBackend(Backend):
+    # scikit-learn is only imported when the model is fitted or unpickled. `C` and `gamma` are passed to
+    # the SVC.
+    name = "svc"
+    numpy_only = False
+
+    def __init__(self, C=1.0, gamma="scale"):
+        super().__init__()
+        self.C = C
+        self.gamma = gamma
+        self.predicter = None
+
+    def parameters(self):
+        return {'estimator': "svm.SVC()", 'C': self.C, 'gamma': self.gamma}
+
+    def fit(self, features, categories):
+        from sklearn import svm
+        self.predicter = svm.SVC(C=self.C, gamma=self.gamma)
+        self.predicter.fit(features, categories)
+        return self
+
+    def predict(self, features):
+        return self.predicter.predict(np.atleast_2d(features))
+
+
+BACKENDS = {backend.name: backend for backend in (ThresholdBackend, CentroidBackend, LinearBackend, SVCBackend)}
+
+
+def create_backend(name, **kwargs):
+    if name not in BACKENDS:
+        raise ValueError("unknown gesture backend '%s' (%s)" % (name, ", ".join(BACKENDS)))
+    return BACKENDS[name](**kwargs)
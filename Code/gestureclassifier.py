@@ -2,85 +2,311 @@
 # coding: utf-8
 # -*- coding: utf-8 -*-
 
+import collections
+import importlib.metadata
+import os
+import threading
+import time
 import numpy as np
-from sklearn import svm
-from scipy import fft
+from gesturebackends import create_backend
+from gesturedataset import GestureDataset, REST_GESTURE
+from latency import LatencyRing
+from modelstore import ModelStore, content_key, key_family
+
+
+class SlidingDFT:
+    # Magnitudes of the DFT bins 1 .. size / 2 - 1 over the last `size` values, divided by the window length
+    # (the features GestureClassifier has always used). The values are kept in a circular buffer, each new
+    # value updates the bins in O(bins):
+    #     X_k <- (X_k - oldest + new) * exp(2j * pi * k / size)
+    # Until `size` values are there, the spectrum of the shorter window is computed directly. Rounding
+    # errors add up over time, so the bins are recomputed with an FFT every `resync` values.
+    def __init__(self, size=32, resync=4096):
+        super().__init__()
+        self.size = size
+        self.resync = resync
+        self._values = np.zeros(size)
+        self._twiddle = np.exp(2j * np.pi * np.arange(1, size // 2) / size)
+        self._bins = np.zeros(size // 2 - 1, dtype=complex)
+        self.count = 0
+
+    def add(self, value):
+        i = self.count % self.size
+        oldest = self._values[i]
+        self._values[i] = value
+        self.count += 1
+        if self.count > self.size and self.count % self.resync != 0:
+            self._bins += value - oldest
+            self._bins *= self._twiddle
+        elif self.count >= self.size:
+            self._bins = np.fft.fft(self.window())[1:self.size // 2]
+
+    # The buffered values, oldest first.
+    def window(self):
+        if self.count < self.size:
+            return self._values[:self.count]
+        i = self.count % self.size
+        return np.concatenate((self._values[i:], self._values[:i]))
+
+    def clear(self):
+        self.count = 0
+
+    def magnitudes(self):
+        if self.count < self.size:
+            window = self.window()
+            return np.abs(np.fft.fft(window) / len(window))[1:int(len(window) / 2)]
+        return np.abs(self._bins) / self.size
+
+
+class GestureEvent:
+    STARTED = 'started'
+    ENDED = 'ended'
+
+    def __init__(self, kind, gesture, time, confidence, duration=0.0):
+        super().__init__()
+        self.kind = kind
+        self.gesture = gesture
+        self.time = time  # time.monotonic() of the window that caused the event
+        self.confidence = confidence  # at the start, for the end the highest during the gesture
+        self.duration = duration  # seconds from start to end (0 for STARTED)
+
+    def __repr__(self):
+        return "GestureEvent(%r, %r, confidence=%.2f)" % (self.kind, self.gesture, self.confidence)
+
+
+class GestureDebouncer:
+    # Turns the categories of consecutive windows into one STARTED and one ENDED event per gesture.
+    # The confidence is an exponential moving average of the windows classified as `gesture` (the newest
+    # window weighted with `smoothing`). A gesture starts when the confidence reaches `onset` and ends when
+    # it falls to `offset`. After a gesture ended, no new one starts for `refractory` seconds.
+    def __init__(self, gesture="shake", onset=0.6, offset=0.2, smoothing=0.2, refractory=1.0):
+        super().__init__()
+        if not 0 <= offset < onset <= 1:
+            raise ValueError("offset needs to be below onset")
+        self.gesture = gesture
+        self.onset = onset
+        self.offset = offset
+        self.smoothing = smoothing
+        self.refractory = refractory
+        self.reset()
+
+    def reset(self):
+        self.confidence = 0.0
+        self.active = False
+        self._started = None
+        self._peak = 0.0
+        self._ended = None
+
+    # Adds the category of the window at time `t`. Returns a GestureEvent or None.
+    def update(self, category, t):
+        vote = 1.0 if category == self.gesture else 0.0
+        self.confidence += self.smoothing * (vote - self.confidence)
+        if self.active:
+            self._peak = max(self._peak, self.confidence)
+            if self.confidence <= self.offset:
+                self.active = False
+                self._ended = t
+                return GestureEvent(GestureEvent.ENDED, self.gesture, t, self._peak, t - self._started)
+        elif self.confidence >= self.onset and (self._ended is None or t - self._ended >= self.refractory):
+            self.active = True
+            self._started = t
+            self._peak = self.confidence
+            return GestureEvent(GestureEvent.STARTED, self.gesture, t, self.confidence)
+        return None
 
 
 class GestureClassifier:
-    def __init__(self):
+    # The model classifies one window of BUFFER_SIZE samples by its feature vector: the MAX_LENGTH spectral
+    # magnitudes. Windows are predicted in batches on a worker thread, so the thread that adds the
+    # accelerometer data only updates the spectrum.
+    # The categories are the gestures of `dataset` (see gesturedataset.py). Observers get a GestureEvent
+    # when a gesture other than "steady" starts and when it ends (see GestureDebouncer, `debouncers`).
+    # Without `load` the model has to be loaded later with load() or load_in_background(). Until it is
+    # ready accelerometer data only fills the buffer. With `feature_interval` N the gesture is only
+    # predicted for every Nth sample. `backend` names the model (see gesturebackends.py) and
+    # `backend_options` are passed to it; without a backend the one chosen by gesturetraining.py for the
+    # current gestures is used ("svc" if there is none). Fitted models are kept in `store` (see modelstore.py). scikit-learn, which
+    # takes about a second to import, is only needed by the "svc" backend; IPlanPy loads the model in the
+    # background after its window is shown.
+    def __init__(self, load=True, feature_interval=1, store=None, max_pending=256, backend=None,
+                 backend_options=None, dataset=None):
         super().__init__()
-        self.CATEGORIES = ["steady", "shake"]
+        self.dataset = GestureDataset() if dataset is None else dataset
+        self.CATEGORIES = self.dataset.gestures()
         self.MAX_LENGTH = 15
+        self.BUFFER_SIZE = 32
+        self.feature_interval = feature_interval
+        if backend is None:
+            settings = self.dataset.settings()
+            if settings.get('categories', self.CATEGORIES) != self.CATEGORIES:
+                settings = {}  # chosen for other gestures, e.g. a threshold for two of them
+            backend = settings.get('backend', "svc")
+            if backend_options is None:
+                backend_options = settings.get('options')
+        self.backend = backend
+        self.backend_options = backend_options or {}
         self._observers = []
-        self.raw_x_data = np.array([])
-        self.raw_y_data = np.array([])
-        self.raw_z_data = np.array([])
-        self.predicter = svm.SVC()
-        self.train_predicter()
+        self.debouncers = [GestureDebouncer(gesture) for gesture in self.CATEGORIES if gesture != REST_GESTURE]
+        # spectrum of the last BUFFER_SIZE samples
+        self.spectrum = SlidingDFT(self.BUFFER_SIZE)
+        self.store = ModelStore() if store is None else store
+        self.model_key = None
+        self.predicter = None
+        self.ready = threading.Event()
+        # feature vectors and their time waiting for the worker, the oldest are dropped if it falls behind
+        self._pending = collections.deque(maxlen=max_pending)
+        lock = threading.Lock()
+        self._pending_cond = threading.Condition(lock)
+        self._done_cond = threading.Condition(lock)  # notified when the worker has finished a batch
+        self._worker = None
+        self.queued_windows = 0
+        self.windows = 0
+        self.batches = 0
+        self.dropped_windows = 0
+        self.decision_latency = LatencyRing()  # seconds from the last sample of a window to its prediction
+        if load:
+            self.load()
+
+    # Loads the stored model for the current training data. If the data changed, the last stored model with
+    # the same backend, options and categories is used while a new one is trained in the background. Without any stored model it is trained right away.
+    def load(self):
+        key = self.training_key()
+        stored = self.store.load(key)
+        if stored is None:
+            stored = self.store.latest(key_family(key))
+            if stored is None:
+                self.rebuild(key)
+                return
+            threading.Thread(target=self.rebuild, args=(key,), daemon=True).start()
+        self.model_key = stored.key
+        self.predicter = stored.model
+        self.ready.set()
+
+    def load_in_background(self):
+        threading.Thread(target=self.load, daemon=True).start()
 
     # Observer pattern taken from https://en.wikipedia.org/wiki/Observer_pattern
     def register_callback(self, func):
         self._observers.append(func)
 
-    def notify_observers(self):
+    def notify_observers(self, event):
         for func in self._observers:
-            func()
+            func(event)
 
-    # Gets raw x, y and z accelerometer data from wiimote and tries to predict the gesture using the svm.
-    # If gesture 'shake' is detected all observers get notified.
+    # Gets raw x, y and z accelerometer data from wiimote. The feature vector of every full window is
+    # queued for the prediction worker. When a gesture starts or ends all observers get notified.
     def add_accelerometer_data(self, x, y, z):
-        frequency = self.get_frequency(x, y, z)
-        try:
-            prediction = self.predicter.predict(np.array(frequency[0].reshape(-1, 1)))
-            # Source:
-            # https://stackoverflow.com/questions/12297016/how-to-find-most-frequent-values-in-numpy-ndarray
-            u, indices = np.unique(prediction, return_inverse=True)
-            actual_category = u[np.argmax(np.bincount(indices))]
-            if actual_category == "shake":
-                self.notify_observers()
-        except Exception as e:
-            print(e)
+        self.add_sample(x, y, z)
+        spectrum = self.spectrum
+        if self.predicter is None or spectrum.count < self.BUFFER_SIZE or spectrum.count % self.feature_interval != 0:
+            return
+        features = spectrum.magnitudes()
+        with self._pending_cond:
+            if len(self._pending) == self._pending.maxlen:
+                self.dropped_windows += 1
+            self._pending.append((features, time.monotonic()))
+            self.queued_windows += 1
+            if self._worker is None:
+                self._worker = threading.Thread(target=self._run, daemon=True)
+                self._worker.start()
+            self._pending_cond.notify()
+
+    # Returns the category of every feature vector (rows of `features`).
+    def predict(self, features):
+        return self.predicter.predict(features)
+
+    # Predicts all queued windows at once and passes their categories through the debouncers.
+    def _run(self):
+        while True:
+            with self._pending_cond:
+                while not self._pending:
+                    self._pending_cond.wait()
+                batch = list(self._pending)
+                self._pending.clear()
+            try:
+                categories = self.predict(np.stack([features for features, _ in batch]))
+            except Exception as e:
+                print(e)
+                categories = []
+            now = time.monotonic()
+            for _, queued in batch:
+                self.decision_latency.append(now - queued)
+            for (_, queued), category in zip(batch, categories):
+                for debouncer in self.debouncers:
+                    event = debouncer.update(category, queued)
+                    if event is not None:
+                        self.notify_observers(event)
+            with self._done_cond:
+                self.windows += len(batch)
+                self.batches += 1
+                self._done_cond.notify_all()
+
+    # Waits until all queued windows are predicted and their events delivered (e.g. before reading the
+    # statistics).
+    def flush(self, timeout=5.0):
+        with self._done_cond:
+            self._done_cond.wait_for(lambda: self.windows + self.dropped_windows >= self.queued_windows, timeout)
+
+    def get_stats(self):
+        latencies = self.decision_latency.values()
+        stats = {'windows': self.windows, 'batches': self.batches, 'dropped_windows': self.dropped_windows,
+                 'mean_batch_size': self.windows / self.batches if self.batches else 0.0}
+        if len(latencies) > 0:
+            stats['decision_latency_p50'], stats['decision_latency_p95'] = np.percentile(latencies, (50, 95))
+        return stats
+
+    def add_sample(self, x, y, z):
+        self.spectrum.add(x + y + z / 3)
 
     # Calculates frequency of raw x, y and z values
     def get_frequency(self, x, y, z):
-        buffer_size = 32
-        self.raw_x_data = np.append(self.raw_x_data, x)
-        self.raw_y_data = np.append(self.raw_y_data, y)
-        self.raw_z_data = np.append(self.raw_z_data, z)
-        self.raw_x_data = self.raw_x_data[-buffer_size:]
-        self.raw_y_data = self.raw_y_data[-buffer_size:]
-        self.raw_z_data = self.raw_z_data[-buffer_size:]
-        raw_gesture_data = [self.raw_x_data + self.raw_y_data + self.raw_z_data / 3]
-        return [np.abs(fft(l) / len(l))[1:int(len(l) / 2)] for l in raw_gesture_data]
-
-    # Reads csv files containing movement data. These data gets used to train the svm.
-    def train_predicter(self):
-        all_freq_raw = []
-        all_lengths = []
-        all_freq = []
-        all_categories = []
-        for i in range(0, len(self.CATEGORIES)):
-            category = self.CATEGORIES[i]
-            freq = self.read_csv(category + ".csv")
-            all_freq_raw.append(freq)
-            all_lengths.append(len(freq))
-
-        min_length = min(all_lengths)
-        for i in range(0, len(all_freq_raw)):
-            arr = all_freq_raw[i]
-            cat = self.CATEGORIES[i]
-            all_freq += arr[0:min_length]
-            all_categories += min_length * [cat]
-
-        all_freq = np.array(all_freq).reshape(-1, 1)
-        self.predicter.fit(all_freq, all_categories)
-
-    # reading csv-file and returning list of frequency-values (without header)
-    def read_csv(self, fileName):
-        result = []
-        for line in open(fileName, "r").readlines():
-            result.append(line)
-        result = result[1:]
-        result = list(map(float, result))
-        return result
+        self.add_sample(x, y, z)
+        return [self.spectrum.magnitudes()]
+
+    def training_files(self):
+        return [path for category in self.CATEGORIES for path in self.dataset.files(category)]
+
+    def create_backend(self):
+        return create_backend(self.backend, **self.backend_options)
+
+    # Key of the model for the current training files and parameters in the model store.
+    def training_key(self):
+        try:
+            sklearn_version = importlib.metadata.version("scikit-learn")
+        except importlib.metadata.PackageNotFoundError:
+            sklearn_version = None
+        files = self.training_files()
+        parameters = {'categories': tuple(self.CATEGORIES), 'features': self.MAX_LENGTH,
+                      'backend': self.backend, 'sklearn': sklearn_version}
+        parameters.update(self.create_backend().parameters())
+        return content_key(files, parameters, [os.path.relpath(path, self.dataset.directory) for path in files])
+
+    # Trains the model from the dataset, stores it under `key` (the current training_key() if not given)
+    # in place of older models with the same parameters and uses it. Returns the key.
+    def rebuild(self, key=None):
+        if key is None:
+            key = self.training_key()
+        predicter = self.create_backend()
+        features, labels = self.train_predicter(predicter)
+        self.store.save(key, predicter, features, labels)
+        self.store.clear(keep=(key,), family=key_family(key))
+        self.model_key = key
+        self.predicter = predicter
+        self.ready.set()
+        return key
+
+    # Reads the movement data of the dataset. These data gets used to train the backend `predicter`.
+    # Returns the training data.
+    def train_predicter(self, predicter):
+        features, categories = self.training_data()
+        predicter.fit(features, categories)
+        return features, categories
+
+    # The feature vectors of all categories, one row per window (MAX_LENGTH values each in the csv files),
+    # with the same number of windows for every category, and the category of each row.
+    def training_data(self):
+        windows = [self.dataset.windows(category, self.MAX_LENGTH) for category in self.CATEGORIES]
+        min_length = min(len(rows) for rows in windows)
+        features = np.concatenate([rows[:min_length] for rows in windows])
+        categories = np.repeat(self.CATEGORIES, min_length)
+        return features, categories
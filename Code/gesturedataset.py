@@ -0,0 +1,110 @@
+# !/usr/bin/env python3
+# coding: utf-8
+# -*- coding: utf-8 -*-
+
+# Training data of GestureClassifier.
+#
+# A dataset is a directory with one entry per gesture, named after the gesture:
+#   gestures/steady.csv        a csv file: a header line, then one spectral magnitude per line
+#   gestures/circle/*.csv      or a folder of such files, e.g. one per recording session
+# Every MAX_LENGTH consecutive values of a file are the feature vector of one window. "steady" is the
+# gesture of a Wiimote at rest, every other gesture gets start and end events. Adding a gesture only
+# means adding its file or folder and training again (see gesturetraining.py).
+#
+# The parsed files are cached as .npy files in <directory>/.cache and parsed again when a file changes.
+# gesturetraining.py writes the backend and the settings it found best for the gestures to
+# <directory>/training.json.
+
+import json
+import os
+import numpy as np
+
+DATASET_DIRECTORY = "gestures"
+REST_GESTURE = "steady"
+SETTINGS_FILE = "training.json"
+CACHE_DIRECTORY = ".cache"
+
+
+# Values of a csv file of the dataset (without the header line).
+def parse_csv(path):
+    with open(path, "rb") as f:
+        f.readline()
+        return np.array(f.read().split(), dtype=np.float64)
+
+
+class GestureDataset:
+    def __init__(self, directory=DATASET_DIRECTORY):
+        super().__init__()
+        self.directory = directory
+
+    # Names of all gestures, sorted.
+    def gestures(self):
+        gestures = []
+        for entry in os.scandir(self.directory):
+            if entry.name.startswith("."):
+                continue
+            if entry.is_dir():
+                gestures.append(entry.name)
+            elif entry.name.endswith(".csv"):
+                gestures.append(entry.name[:-len(".csv")])
+        return sorted(gestures)
+
+    # The csv files of `gesture`.
+    def files(self, gesture):
+        folder = os.path.join(self.directory, gesture)
+        if os.path.isdir(folder):
+            return sorted(os.path.join(folder, name) for name in os.listdir(folder) if name.endswith(".csv"))
+        return [folder + ".csv"]
+
+    def all_files(self):
+        return [path for gesture in self.gestures() for path in self.files(gesture)]
+
+    # Values of the file at `path`, from the cache if the file did not change since it was parsed.
+    def read(self, path):
+        stat = os.stat(path)
+        name = os.path.relpath(path, self.directory).replace(os.sep, "--")
+        cache_directory = os.path.join(self.directory, CACHE_DIRECTORY)
+        cache_path = os.path.join(cache_directory, "%s-%x-%x.npy" % (name, stat.st_size, stat.st_mtime_ns))
+        try:
+            return np.load(cache_path)
+        except (OSError, ValueError):
+            pass
+        values = parse_csv(path)
+        try:
+            os.makedirs(cache_directory, exist_ok=True)
+            for old in os.listdir(cache_directory):
+                if old.startswith(name + "-"):
+                    os.remove(os.path.join(cache_directory, old))
+            temp_path = cache_path + ".tmp"
+            with open(temp_path, "wb") as f:
+                np.save(f, values)
+            os.replace(temp_path, cache_path)
+        except OSError:
+            pass  # read-only dataset, parsed again next time
+        return values
+
+    # The windows of `gesture` as rows of `length` values. Values at the end of a file that do not fill a
+    # whole window are left out.
+    def windows(self, gesture, length):
+        windows = []
+        for path in self.files(gesture):
+            values = self.read(path)
+            windows.append(values[:len(values) // length * length].reshape(-1, length))
+        if not windows:
+            return np.zeros((0, length))
+        return np.concatenate(windows)
+
+    # The backend and its options chosen by gesturetraining.py, {} if there are none.
+    def settings(self):
+        try:
+            with open(os.path.join(self.directory, SETTINGS_FILE)) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def save_settings(self, settings):
+        path = os.path.join(self.directory, SETTINGS_FILE)
+        with open(path + ".tmp", "w") as f:
+            json.dump(settings, f, indent=4, sort_keys=True)
+            f.write("\n")
+        os.replace(path + ".tmp", path)
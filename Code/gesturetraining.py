@@ -0,0 +1,156 @@
+# !/usr/bin/env python3
+# coding: utf-8
+# -*- coding: utf-8 -*-
+
+# Chooses the gesture model for a dataset (see gesturedataset.py).
+#
+# `search` cross-validates every backend with every setting of SEARCH_SPACE on the windows of the dataset
+# (stratified folds, in a process pool on all cores). The most accurate one (the fastest of those within
+# --tolerance of the best) is trained on all windows and stored in the model store, and written to
+# <dataset>/training.json, where GestureClassifier (and so IPlanPy) picks it up. A backend that needs
+# scikit-learn, which delays the model by about a second of imports, is only chosen if it is more than
+# --sklearn-gain more accurate than the best NumPy-only one.
+#
+# Usage:
+#   python3 gesturetraining.py info                                  gestures, files and windows of the dataset
+#   python3 gesturetraining.py search [--folds 5] [--jobs N] [--backends ...] [--tolerance 0.005]
+#                                     [--sklearn-gain 0.02]
+
+import argparse
+import concurrent.futures
+import os
+import time
+import numpy as np
+from gesturebackends import BACKENDS, create_backend
+from gestureclassifier import GestureClassifier
+from gesturedataset import DATASET_DIRECTORY, GestureDataset
+from modelstore import MODEL_DIRECTORY, ModelStore
+
+SEARCH_SPACE = {
+    "threshold": [{'band': band} for band in ((2, 15), (4, 15), (6, 15), (4, 10), (8, 15))],
+    "centroid": [{}],
+    "linear": [{'ridge': ridge} for ridge in (0.001, 0.01, 0.1, 1.0, 10.0)],
+    "svc": [{'C': C, 'gamma': gamma} for C in (0.1, 1.0, 10.0, 100.0) for gamma in ("scale", 0.01, 0.1, 1.0)],
+}
+
+# training data of the worker processes, set once by _init_worker()
+_features = None
+_categories = None
+_folds = None
+
+
+# Assigns every window to one of `count` folds, with the windows of every category spread evenly.
+def stratified_folds(categories, count, seed=1):
+    rng = np.random.default_rng(seed)
+    folds = np.empty(len(categories), dtype=int)
+    for category in np.unique(categories):
+        rows = rng.permutation(np.flatnonzero(categories == category))
+        folds[rows] = np.arange(len(rows)) % count
+    return folds
+
+
+def _init_worker(features, categories, folds):
+    global _features, _categories, _folds
+    _features, _categories, _folds = features, categories, folds
+
+
+# Accuracy of the backend `name` with `options` in every fold and its prediction time per window.
+def evaluate(name, options):
+    accuracies = []
+    predict_seconds = 0.0
+    for fold in np.unique(_folds):
+        test = _folds == fold
+        backend = create_backend(name, **options)
+        backend.fit(_features[~test], _categories[~test])
+        start = time.perf_counter()
+        predicted = backend.predict(_features[test])
+        predict_seconds += time.perf_counter() - start
+        accuracies.append(np.mean(predicted == _categories[test]))
+    return name, options, np.array(accuracies), predict_seconds / len(_categories)
+
+
+# The fastest of the `results` within `tolerance` of the most accurate one. A NumPy-only backend is
+# preferred unless the scikit-learn one is more than `sklearn_gain` more accurate.
+def choose(results, tolerance, sklearn_gain):
+    def fastest_good(results):
+        best_accuracy = max(accuracies.mean() for _, _, accuracies, _ in results)
+        good = [result for result in results if result[2].mean() >= best_accuracy - tolerance]
+        return min(good, key=lambda result: result[3])
+
+    choice = fastest_good(results)
+    numpy_only = [result for result in results if BACKENDS[result[0]].numpy_only]
+    if numpy_only and not BACKENDS[choice[0]].numpy_only:
+        fallback = fastest_good(numpy_only)
+        if choice[2].mean() - fallback[2].mean() <= sklearn_gain:
+            choice = fallback
+    return choice
+
+
+def info(args):
+    dataset = GestureDataset(args.dataset)
+    classifier = GestureClassifier(load=False, dataset=dataset)
+    for gesture in classifier.CATEGORIES:
+        files = dataset.files(gesture)
+        print("%-12s %6d windows in %d file(s)" % (
+            gesture, len(dataset.windows(gesture, classifier.MAX_LENGTH)), len(files)))
+    settings = dataset.settings()
+    if settings:
+        print("model: %s %s" % (settings['backend'], settings.get('options', {})))
+
+
+def search(args):
+    dataset = GestureDataset(args.dataset)
+    features, categories = GestureClassifier(load=False, dataset=dataset).training_data()
+    folds = stratified_folds(categories, args.folds)
+    candidates = [(name, options) for name in args.backends for options in SEARCH_SPACE[name]]
+    print("%d windows of %s, %d settings x %d folds on %d processes" % (
+        len(categories), ", ".join(np.unique(categories)), len(candidates), args.folds, args.jobs))
+
+    results = []
+    start = time.perf_counter()
+    with concurrent.futures.ProcessPoolExecutor(args.jobs, initializer=_init_worker,
+                                                initargs=(features, categories, folds)) as pool:
+        futures = [pool.submit(evaluate, name, options) for name, options in candidates]
+        for (name, options), future in zip(candidates, futures):
+            try:
+                results.append(future.result())
+            except ValueError as e:  # e.g. the threshold backend with more than two gestures
+                print("skipped %s %s: %s" % (name, options, e))
+    print("searched in %.1f s" % (time.perf_counter() - start))
+    if not results:
+        return
+
+    print("%-10s %-30s %9s %7s %12s" % ("backend", "options", "accuracy", "std", "us/window"))
+    for name, options, accuracies, seconds in sorted(results, key=lambda result: -result[2].mean()):
+        print("%-10s %-30s %8.1f%% %6.1f%% %12.2f" % (name, options, accuracies.mean() * 100,
+                                                       accuracies.std() * 100, seconds * 1e6))
+    name, options, accuracies, _ = choose(results, args.tolerance, args.sklearn_gain)
+    print("best: %s %s (%.1f%%)" % (name, options, accuracies.mean() * 100))
+
+    dataset.save_settings({'backend': name, 'options': options, 'categories': list(np.unique(categories))})
+    classifier = GestureClassifier(load=False, store=ModelStore(args.store), dataset=dataset)
+    print("trained model %s" % classifier.rebuild())
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--dataset", default=DATASET_DIRECTORY)
+    sub = parser.add_subparsers(dest="command")
+    sub.required = True
+    info_parser = sub.add_parser("info", help="gestures, files and windows of the dataset")
+    info_parser.set_defaults(func=info)
+    search_parser = sub.add_parser("search", help="cross-validated search for the best model")
+    search_parser.add_argument("--folds", type=int, default=5)
+    search_parser.add_argument("--jobs", type=int, default=os.cpu_count())
+    search_parser.add_argument("--backends", nargs="+", choices=list(BACKENDS), default=list(SEARCH_SPACE))
+    search_parser.add_argument("--tolerance", type=float, default=0.005, help="accuracy given up for speed")
+    search_parser.add_argument("--sklearn-gain", type=float, default=0.02,
+                               help="accuracy a scikit-learn backend has to add over the NumPy-only ones")
+    search_parser.add_argument("--store", default=MODEL_DIRECTORY, help="model store directory")
+    search_parser.set_defaults(func=search)
+    args = parser.parse_args()
+    args.func(args)
+
+
+if __name__ == '__main__':
+    main()
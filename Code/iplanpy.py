@@ -9,27 +9,32 @@ from PyQt5 import uic, QtWidgets, QtCore, QtGui
 from PyQt5.QtWidgets import QMessageBox
 from PyQt5.QtGui import QPainter, QColor, QPen
 from operator import itemgetter
-import wiimote
 from vectortransform import VectorTransform
-from gestureclassifier import GestureClassifier
+from gestureclassifier import GestureClassifier, GestureEvent
 from connectionmanager import ConnectionManager
 from card import Card
+from deviceregistry import DeviceRegistry
+import latency
 
 
 class IPlanPy(QtWidgets.QWidget):
     def __init__(self):
         super().__init__()
-        self.CONNECTIONS_FILE = "wii.motes"
+        self.registry = DeviceRegistry()
         self.card_id = 0
         self.wiimote = None
-        self.ir_callback_count = 0
         self.old_x_coord = 0
         self.old_y_coord = 0
         self.all_cards = []
         self.default_delete_card_style = None
+        self.latency_overlay = None
+        self.latency_timer = None
 
         self.my_vector_transform = VectorTransform()
-        self.classifier = GestureClassifier()
+        # the gesture model chosen by gesturetraining.py (gestures/training.json) is loaded in the background
+        # after the first paint
+        self.classifier = GestureClassifier(load=False)
+        self.classifier_loading = False
         self.connections = ConnectionManager()
         self.classifier.register_callback(self.handle_shake_gesture)
 
@@ -38,25 +43,12 @@ class IPlanPy(QtWidgets.QWidget):
         self.display_known_wiimotes()
 
     def display_known_wiimotes(self):
-        content = self.get_all_known_connections()
+        content = self.registry.addresses()
         for address in content:
             self.ui.list_available_wiimotes.addItem(address)
         if len(content) > 0:
             self.ui.list_available_wiimotes.setCurrentRow(0)
 
-    def save_connection_address(self, address):
-        content = self.get_all_known_connections()
-        if address not in content:
-            with open(self.CONNECTIONS_FILE, "a") as f:
-                f.write("\n" + address)
-                f.close()
-
-    def get_all_known_connections(self):
-        with open(self.CONNECTIONS_FILE) as f:
-            content = f.readlines()
-            f.close()
-        return [x.strip() for x in content]
-
     def init_ui(self):
         self.ui = uic.loadUi("iplanpy.ui", self)
         self.setMouseTracking(True)
@@ -73,7 +65,7 @@ class IPlanPy(QtWidgets.QWidget):
 
     def on_btn_new_chart(self, event):
         self.remove_all_cards()
-        self.connections.connections.clear()
+        self.connections.clear()
         self.card_id = 0
         self.update()
 
@@ -103,7 +95,7 @@ class IPlanPy(QtWidgets.QWidget):
                 try:
                     self.card_id = 0
                     self.remove_all_cards()
-                    self.connections.connections.clear()
+                    self.connections.clear()
                     self.update()
                     self.create_card_from_file(card_infos)
                     self.create_conn_from_file(conn_info)
@@ -205,7 +197,7 @@ class IPlanPy(QtWidgets.QWidget):
             file.write(str(cid) + ";" + title + ";" + content + ";" + str(x_pos) +
                        ";" + str(y_pos) + ";" + card_type + ";" + str(color) + ";\n")
         file.write("-\n")
-        for conn in self.connections.connections:
+        for conn in self.connections:
             c1, c2 = conn
             file.write(str(c1.id) + ";" + str(c2.id) + ";\n")
 
@@ -218,7 +210,8 @@ class IPlanPy(QtWidgets.QWidget):
     def scan_for_wiimotes(self, event):
         self.ui.btn_scan_wiimotes.setText("Scanning...")
         self.ui.list_available_wiimotes.clear()
-        results = wiimote.find()
+        # known Wiimotes are probed first, a full scan only runs if none of them is in reach
+        results = self.registry.discover()
         for mote in results:
             address, name = mote
             self.ui.list_available_wiimotes.addItem(address)
@@ -239,7 +232,8 @@ class IPlanPy(QtWidgets.QWidget):
             address = current_item.text()
             if address is not "":
                 try:
-                    self.wiimote = wiimote.connect(address)
+                    # the app does not read the sensor history, so the receive loop need not keep it
+                    self.wiimote = self.registry.connect(address, telemetry_capacity=0)
                 except Exception:
                     QMessageBox.critical(self, "Error", "Could not connect to " + address + "!")
                     self.ui.btn_connect_wiimote.setText("Connect")
@@ -248,16 +242,21 @@ class IPlanPy(QtWidgets.QWidget):
                 if self.wiimote is None:
                     self.ui.btn_connect_wiimote.setText("Connect")
                 else:
-                    self.ui.btn_connect_wiimote.setText("Disconnect")
-                    self.ui.lbl_wiimote_address.setText("Connected to " + address)
-                    self.wiimote.buttons.register_callback(self.on_wiimote_button)
-                    self.wiimote.ir.register_callback(self.on_wiimote_ir)
-                    self.wiimote.accelerometer.register_callback(self.on_wiimote_accelerometer)
+                    self.attach_wiimote(self.wiimote)
                     self.wiimote.rumble()
                     self.ui.fr_connection.setVisible(False)
-                    self.save_connection_address(address)
+
+    # Registers all wiimote callbacks. Also used to drive the app with a replayed session.
+    def attach_wiimote(self, wiimote):
+        self.wiimote = wiimote
+        self.ui.btn_connect_wiimote.setText("Disconnect")
+        self.ui.lbl_wiimote_address.setText("Connected to " + wiimote.btaddr)
+        self.wiimote.buttons.register_callback(self.on_wiimote_button)
+        self.wiimote.ir.register_callback(self.on_wiimote_ir)
+        self.wiimote.accelerometer.register_callback(self.on_wiimote_accelerometer)
 
     def disconnect_wiimote(self):
+        self.registry.remember_wiimote(self.wiimote)
         self.wiimote.disconnect()
         self.wiimote = None
         self.ui.btn_connect_wiimote.setText("Connect")
@@ -300,17 +299,47 @@ class IPlanPy(QtWidgets.QWidget):
                     )
                     QtCore.QCoreApplication.postEvent(self, mouse_release_event)
 
+    # The transform keeps following the markers while only two or three of them are visible.
     def on_wiimote_ir(self, event):
-        # Only use every fourth output from ir sensor
-        if self.ir_callback_count % 4 == 0:
-            if len(event) >= 4:
-                x, y = self.my_vector_transform.transform(event, self.size().width(), self.size().height())
-                QtGui.QCursor.setPos(self.mapToGlobal(QtCore.QPoint(x, y)))
-        self.ir_callback_count = self.ir_callback_count + 1
+        report_time = latency.current_report_time()
+        point = self.my_vector_transform.transform(event, self.size().width(), self.size().height(), report_time,
+                                                   default=None)
+        latency.monitor.mark(latency.TRANSFORM, report_time)
+        if point is not None:
+            x, y = point
+            QtGui.QCursor.setPos(self.mapToGlobal(QtCore.QPoint(x, y)))
+            latency.monitor.mark(latency.CURSOR, report_time)
 
     def on_wiimote_accelerometer(self, event):
         self.classifier.add_accelerometer_data(event[0], event[1], event[2])
 
+    # Shows the input latency per stage (see latency.py) and records it while visible.
+    # Closing the overlay writes all samples to latency.csv.
+    def toggle_latency_overlay(self):
+        if self.latency_overlay is None:
+            self.latency_overlay = QtWidgets.QLabel(self)
+            self.latency_overlay.setFont(QtGui.QFontDatabase.systemFont(QtGui.QFontDatabase.FixedFont))
+            self.latency_overlay.setStyleSheet("background-color: rgba(0, 0, 0, 160); color: white; padding: 4px;")
+            self.latency_overlay.move(10, 10)
+            self.latency_timer = QtCore.QTimer(self)
+            self.latency_timer.timeout.connect(self.update_latency_overlay)
+        if self.latency_overlay.isVisible():
+            self.latency_timer.stop()
+            self.latency_overlay.setVisible(False)
+            latency.monitor.enabled = False
+            latency.monitor.dump("latency.csv")
+        else:
+            latency.monitor.clear()
+            latency.monitor.enabled = True
+            self.update_latency_overlay()
+            self.latency_overlay.setVisible(True)
+            self.latency_overlay.raise_()
+            self.latency_timer.start(500)
+
+    def update_latency_overlay(self):
+        self.latency_overlay.setText(latency.monitor.format())
+        self.latency_overlay.adjustSize()
+
     def keyPressEvent(self, event):
         alt_modifier = (event.modifiers() & QtCore.Qt.AltModifier) != 0
         card = self.get_card_under_mouse()
@@ -326,6 +355,9 @@ class IPlanPy(QtWidgets.QWidget):
                 card.toggle_type()
                 self.update()
 
+        if event.key() == QtCore.Qt.Key_F3:
+            self.toggle_latency_overlay()
+
         if event.key() == QtCore.Qt.Key_Control:
             self.connections.remove_last_connection()
             self.update()
@@ -481,22 +513,26 @@ class IPlanPy(QtWidgets.QWidget):
         pen.setWidth(3)
         pen.setColor(QColor(0, 0, 0))
         painter.setPen(pen)
-        for conn in self.connections.connections:
+        for conn in self.connections:
             card1, card2 = conn
             x1, y1 = card1.center()
             x2, y2 = card2.center()
             painter.drawLine(x1, y1, x2, y2)
         painter.end()
-
-    # Callback of gestureclassifier. Gets called when classifier detects "shake" gesture.
-    # Deletes all connections from currently focued card.
-    def handle_shake_gesture(self):
+        if not self.classifier_loading:
+            self.classifier_loading = True
+            self.classifier.load_in_background()
+
+    # Callback of gestureclassifier. Gets called when a "shake" gesture starts and when it ends.
+    # Deletes all connections from currently focued card once per shake.
+    def handle_shake_gesture(self, event):
+        if event.kind != GestureEvent.STARTED or event.gesture != "shake":
+            return
         for card in self.all_cards:
             if card.is_focused is True:
                 self.connections.delete_all_card_connections(card, True)
                 self.update()
 
-
 if __name__ == '__main__':
     app = QtWidgets.QApplication(sys.argv)
     i_plan_py = IPlanPy()
@@ -0,0 +1,113 @@
+# !/usr/bin/env python3
+# coding: utf-8
+# -*- coding: utf-8 -*-
+
+# End-to-end input latency measurement.
+#
+# Every Wiimote report is stamped with time.monotonic() when it is read from the socket
+# (CommunicationHandler.report_time). That stamp travels with the report's payload to the
+# callbacks, which can get it with current_report_time(). At each checkpoint the time since the
+# report was received is recorded for that stage:
+#   decode     the report has been decoded and is handed to the subscriptions
+#   dispatch   a callback starts working on the payload (includes queueing on its worker thread)
+#   transform  VectorTransform has mapped the IR markers to screen coordinates
+#   cursor     QCursor.setPos() has returned
+# The stages are cumulative, so the difference between two stages is the time spent in between.
+# Recording is off until `monitor.enabled` is set.
+
+import itertools
+import threading
+import time
+import numpy as np
+
+DECODE = 'decode'
+DISPATCH = 'dispatch'
+TRANSFORM = 'transform'
+CURSOR = 'cursor'
+STAGES = (DECODE, DISPATCH, TRANSFORM, CURSOR)
+
+_current = threading.local()
+
+
+# Returns the receive time of the report whose payload the calling callback is handling
+# (None outside of Wiimote callbacks).
+def current_report_time():
+    return getattr(_current, 'report_time', None)
+
+
+# Called by the Wiimote driver before a callback is run.
+def set_current_report_time(report_time):
+    _current.report_time = report_time
+
+
+class LatencyRing:
+    # Keeps the last `capacity` latencies of one stage. Several threads may record at the same time
+    # without a lock: each gets its own slot from an atomic counter.
+    def __init__(self, capacity=4096):
+        super().__init__()
+        self.capacity = capacity
+        self._data = np.zeros(capacity)
+        self._counter = itertools.count()
+        self.count = 0
+
+    def append(self, value):
+        i = next(self._counter)
+        self._data[i % self.capacity] = value
+        self.count = i + 1
+
+    def values(self):
+        # copy first: writers keep going while the percentiles are computed
+        return self._data[:min(self.count, self.capacity)].copy()
+
+    def clear(self):
+        self._counter = itertools.count()
+        self.count = 0
+
+
+class LatencyMonitor:
+    def __init__(self, stages=STAGES, capacity=4096):
+        super().__init__()
+        self.enabled = False
+        self.stages = stages
+        self._rings = {stage: LatencyRing(capacity) for stage in stages}
+
+    # Records the time since `report_time` (time.monotonic()) for `stage`.
+    def mark(self, stage, report_time):
+        if self.enabled and report_time is not None:
+            self._rings[stage].append(time.monotonic() - report_time)
+
+    def clear(self):
+        for ring in self._rings.values():
+            ring.clear()
+
+    # Returns {stage: (p50, p95, p99, samples)} in seconds for all stages with samples.
+    def percentiles(self):
+        result = {}
+        for stage in self.stages:
+            values = self._rings[stage].values()
+            if len(values) > 0:
+                p50, p95, p99 = np.percentile(values, (50, 95, 99))
+                result[stage] = (p50, p95, p99, len(values))
+        return result
+
+    # One line per stage, used by the IPlanPy overlay and the benchmarks.
+    def format(self):
+        lines = ["%-9s %8s %8s %8s" % ("ms", "p50", "p95", "p99")]
+        for stage, (p50, p95, p99, _) in self.percentiles().items():
+            lines.append("%-9s %8.2f %8.2f %8.2f" % (stage, p50 * 1000, p95 * 1000, p99 * 1000))
+        return "\n".join(lines)
+
+    # Writes the percentiles and all raw samples (seconds) of every stage to a CSV file.
+    def dump(self, path):
+        with open(path, "w") as f:
+            f.write("stage,p50,p95,p99,samples\n")
+            for stage, (p50, p95, p99, count) in self.percentiles().items():
+                f.write("%s,%f,%f,%f,%d\n" % (stage, p50, p95, p99, count))
+            f.write("\nstage,latency\n")
+            for stage in self.stages:
+                for value in self._rings[stage].values():
+                    f.write("%s,%f\n" % (stage, value))
+
+
+# Shared by the Wiimote driver and the application.
+monitor = LatencyMonitor()
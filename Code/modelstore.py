@@ -0,0 +1,156 @@
+# !/usr/bin/env python3
+# coding: utf-8
+# -*- coding: utf-8 -*-
+
+# Persistent store for the fitted gesture model.
+#
+# A model is stored under a key "<family>-<content>": the family is a hash of the training parameters
+# (backend, its options, the categories, ...), the content a SHA-256 hash of the training CSV files and
+# the parameters. While a new model is trained, the newest one of the same family is used, and only the
+# older models of that family are deleted, so classifiers with different backends can share a store.
+# Next to the pickled estimator the parsed training data is kept as .npy files, which can be
+# memory-mapped. As long as the CSV files do not change, GestureClassifier loads the stored model
+# instead of parsing the files and fitting the SVM again.
+#
+# Usage:
+#   python3 modelstore.py rebuild     train the gesture model from the CSV files and store it
+#   python3 modelstore.py             list the stored models
+#   python3 modelstore.py clear       delete all stored models
+
+import argparse
+import glob
+import hashlib
+import os
+import pickle
+import time
+import numpy as np
+
+MODEL_DIRECTORY = "models"
+# part of every key, increased when the stored files change
+FORMAT = 2
+
+
+# Hash of the `parameters` dict, the family of all models trained with them.
+def family_key(parameters):
+    return hashlib.sha256(repr((FORMAT, sorted(parameters.items()))).encode()).hexdigest()[:8]
+
+
+# Key of the model trained with `parameters` on the files at `paths` (in this order), hashed with their
+# `names` (default: the file names) and contents.
+def content_key(paths, parameters, names=None):
+    if names is None:
+        names = [os.path.basename(path) for path in paths]
+    digest = hashlib.sha256()
+    digest.update(repr((FORMAT, sorted(parameters.items()))).encode())
+    for name, path in zip(names, paths):
+        digest.update(name.encode() + b"\0")
+        with open(path, "rb") as f:
+            for chunk in iter(lambda: f.read(1 << 16), b""):
+                digest.update(chunk)
+    return family_key(parameters) + "-" + digest.hexdigest()[:16]
+
+
+def key_family(key):
+    return key.split("-", 1)[0]
+
+
+class StoredModel:
+    def __init__(self, key, model, features, labels, saved):
+        super().__init__()
+        self.key = key
+        self.model = model
+        self.features = features  # training data as (memory-mapped) arrays
+        self.labels = labels
+        self.saved = saved  # time.time() when it was stored
+
+    def __repr__(self):
+        return "StoredModel(%r, %d samples)" % (self.key, len(self.labels))
+
+
+class ModelStore:
+    # Every model is kept as <key>.pickle, <key>-features.npy and <key>-labels.npy in `directory`.
+    def __init__(self, directory=MODEL_DIRECTORY):
+        super().__init__()
+        self.directory = directory
+
+    def _path(self, key, suffix):
+        return os.path.join(self.directory, key + suffix)
+
+    # Returns the StoredModel for `key` or None if there is none (or it cannot be read).
+    def load(self, key):
+        path = self._path(key, ".pickle")
+        try:
+            features = np.load(self._path(key, "-features.npy"), mmap_mode='r')
+            labels = np.load(self._path(key, "-labels.npy"), mmap_mode='r')
+            with open(path, "rb") as f:
+                model = pickle.load(f)
+            return StoredModel(key, model, features, labels, os.path.getmtime(path))
+        except (OSError, ValueError, EOFError, pickle.UnpicklingError):
+            return None
+
+    # The most recently stored model of `family` (see key_family()), used while a new one is trained.
+    def latest(self, family):
+        for key in self.keys(family):
+            stored = self.load(key)
+            if stored is not None:
+                return stored
+        return None
+
+    # Keys of all stored models (of `family` if given), the most recent first.
+    def keys(self, family=None):
+        pattern = "*.pickle" if family is None else glob.escape(family) + "-*.pickle"
+        paths = glob.glob(os.path.join(self.directory, pattern))
+        paths.sort(key=os.path.getmtime, reverse=True)
+        return [os.path.basename(path)[:-len(".pickle")] for path in paths]
+
+    # Writes the model atomically: the pickle, which marks a complete entry, is moved in place last.
+    def save(self, key, model, features, labels):
+        os.makedirs(self.directory, exist_ok=True)
+        for suffix, array in (("-features.npy", features), ("-labels.npy", labels)):
+            temp_path = self._path(key, suffix + ".tmp")
+            with open(temp_path, "wb") as f:
+                np.save(f, np.asarray(array))
+            os.replace(temp_path, self._path(key, suffix))
+        temp_path = self._path(key, ".pickle.tmp")
+        with open(temp_path, "wb") as f:
+            pickle.dump(model, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(temp_path, self._path(key, ".pickle"))
+
+    # Deletes all models (of `family` if given) except `keep`.
+    def clear(self, keep=(), family=None):
+        for key in self.keys(family):
+            if key not in keep:
+                for suffix in (".pickle", "-features.npy", "-labels.npy"):
+                    try:
+                        os.remove(self._path(key, suffix))
+                    except OSError:
+                        pass
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--directory", default=MODEL_DIRECTORY)
+    sub = parser.add_subparsers(dest="command")
+    sub.add_parser("rebuild")
+    sub.add_parser("clear")
+    args = parser.parse_args()
+    store = ModelStore(args.directory)
+    if args.command == "rebuild":
+        from gestureclassifier import GestureClassifier
+        classifier = GestureClassifier(load=False, store=store)
+        start = time.perf_counter()
+        key = classifier.rebuild()
+        print("trained model %s in %.1f s" % (key, time.perf_counter() - start))
+        return
+    if args.command == "clear":
+        store.clear()
+        return
+    for key in store.keys():
+        stored = store.load(key)
+        if stored is not None:
+            saved = time.strftime("%Y-%m-%d %H:%M", time.localtime(stored.saved))
+            print("%s  %s  %d samples" % (key, saved, len(stored.labels)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,199 @@
+# !/usr/bin/env python3
+# coding: utf-8
+# -*- coding: utf-8 -*-
+
+# Filters for the pointer position computed by VectorTransform.
+#
+# A filter gets one raw screen position per IR frame together with its time in seconds (the receive
+# time of the report, see latency.current_report_time()) and returns the position to show. Every
+# filter keeps the rows (t, x, y) it needs in a telemetry.RingBuffer (WeightedAverageFilter only its points
+# in a deque), reset() forgets them.
+# apply_batch() runs a filter over a whole sequence and returns the same points apply() would.
+#
+#   WeightedAverageFilter  exponentially weighted average of the last points (the default)
+#   OneEuroFilter          low-pass whose cutoff frequency grows with the speed of the pointer:
+#                          steady while the pointer rests, little lag while it moves
+#   PredictiveFilter       smooths with another filter and extrapolates the result `lead` seconds
+#                          with constant velocity to make up for the Bluetooth and processing latency
+#   NoFilter               the raw points
+#
+# Usage:
+#   transform = VectorTransform(pointer_filter=PredictiveFilter(lead=0.03))
+
+import collections
+import copy
+import math
+import numpy as np
+from telemetry import RingBuffer
+
+
+class PointerFilter:
+    def __init__(self, history_size):
+        super().__init__()
+        self.history = RingBuffer(history_size, (3,))
+
+    def apply(self, x, y, t):
+        raise NotImplementedError()
+
+    def reset(self):
+        self.history.clear()
+
+    # Returns an (N, 2) array with the filtered points for the arrays `times`, `xs` and `ys`,
+    # starting from an empty history. The state of this filter is not changed.
+    def apply_batch(self, times, xs, ys):
+        pointer_filter = self.clone()
+        result = np.zeros((len(xs), 2))
+        for k, (t, x, y) in enumerate(zip(np.asarray(times).tolist(), np.asarray(xs).tolist(),
+                                          np.asarray(ys).tolist())):
+            result[k] = pointer_filter.apply(x, y, t)
+        return result
+
+    # A copy with the same settings and an empty history.
+    def clone(self):
+        pointer_filter = copy.deepcopy(self)
+        pointer_filter.reset()
+        return pointer_filter
+
+
+class NoFilter(PointerFilter):
+    def __init__(self):
+        super().__init__(1)
+
+    def apply(self, x, y, t):
+        return x, y
+
+
+# Weights of the last `size` points, oldest first, from a flattened exponential function.
+def exponential_weights(size):
+    weights = []
+    wsum = 0
+    for i in range(0, size):
+        weights.append(math.exp(i * 0.5))
+        wsum += weights[i]
+
+    for i in range(0, len(weights)):
+        weights[i] = weights[i] / wsum
+
+    return np.array(weights)
+
+
+class WeightedAverageFilter(PointerFilter):
+    # Keeps the last `size` raw points. The time is not used.
+    # Runs once per IR frame, so the points are kept as floats in a deque instead of the RingBuffer and the
+    # weights (and their sums for every number of points) as float lists: small NumPy arrays cost more per
+    # call than the few multiplications.
+    def __init__(self, size=8):
+        super().__init__(1)
+        self.size = size
+        self.weights = exponential_weights(size)
+        self._weights = self.weights.tolist()
+        self._weight_sums = [float(self.weights[:n].sum()) for n in range(1, size + 1)]
+        self._points = collections.deque(maxlen=size)
+
+    def reset(self):
+        super().reset()
+        self._points.clear()
+
+    def apply(self, x, y, t):
+        points = self._points
+        points.append((float(x), float(y)))
+        # oldest point first, apply_batch() adds in the same order
+        x_sum = y_sum = 0.0
+        for weight, (px, py) in zip(self._weights, points):
+            x_sum += weight * px
+            y_sum += weight * py
+        wsum = self._weight_sums[len(points) - 1]
+        return x_sum / wsum, y_sum / wsum
+
+    def apply_batch(self, times, xs, ys):
+        xs, ys = np.asarray(xs, dtype=np.float64), np.asarray(ys, dtype=np.float64)
+        n = len(xs)
+        x_sum = np.zeros(n)
+        y_sum = np.zeros(n)
+        size = self.size
+        for k in range(min(n, size - 1)):  # history still filling up
+            weights = self.weights[:k + 1]
+            for j in range(k + 1):
+                x_sum[k] += weights[j] * xs[j]
+                y_sum[k] += weights[j] * ys[j]
+            x_sum[k] /= weights.sum()
+            y_sum[k] /= weights.sum()
+        if n >= size:
+            full_x = np.zeros(n - size + 1)
+            full_y = np.zeros(n - size + 1)
+            for j in range(size):
+                full_x += self.weights[j] * xs[j:n - size + 1 + j]
+                full_y += self.weights[j] * ys[j:n - size + 1 + j]
+            wsum = self.weights.sum()
+            x_sum[size - 1:] = full_x / wsum
+            y_sum[size - 1:] = full_y / wsum
+        return np.stack((x_sum, y_sum), axis=1)
+
+
+class OneEuroFilter(PointerFilter):
+    # One Euro filter (Casiez et al., 2012) on both axes with a shared cutoff: the cutoff frequency is
+    # `min_cutoff` Hz plus `beta` times the speed in pixels per second, the speed itself is low-pass
+    # filtered with `derivative_cutoff` Hz. Keeps the last filtered point and the filtered velocity.
+    def __init__(self, min_cutoff=1.0, beta=0.007, derivative_cutoff=1.0):
+        super().__init__(1)
+        self.min_cutoff = min_cutoff
+        self.beta = beta
+        self.derivative_cutoff = derivative_cutoff
+        self._dx = 0.0
+        self._dy = 0.0
+
+    def reset(self):
+        super().reset()
+        self._dx = 0.0
+        self._dy = 0.0
+
+    @staticmethod
+    def smoothing_factor(cutoff, dt):
+        r = 2 * math.pi * cutoff * dt
+        return r / (r + 1)
+
+    def apply(self, x, y, t):
+        if len(self.history) == 0:
+            self.history.append((t, x, y))
+            return x, y
+        last_t, last_x, last_y = self.history.last(1)[0].tolist()
+        dt = t - last_t
+        if dt <= 0:
+            return last_x, last_y
+
+        a = self.smoothing_factor(self.derivative_cutoff, dt)
+        self._dx += a * ((x - last_x) / dt - self._dx)
+        self._dy += a * ((y - last_y) / dt - self._dy)
+        cutoff = self.min_cutoff + self.beta * math.hypot(self._dx, self._dy)
+        a = self.smoothing_factor(cutoff, dt)
+        x = last_x + a * (x - last_x)
+        y = last_y + a * (y - last_y)
+        self.history.append((t, x, y))
+        return x, y
+
+
+class PredictiveFilter(PointerFilter):
+    # Smooths with `smoothing` (a OneEuroFilter by default) and moves the result `lead` seconds
+    # ahead along the velocity fitted (least squares) through the last `window` smoothed points.
+    def __init__(self, lead=0.03, window=4, smoothing=None):
+        super().__init__(window)
+        self.lead = lead
+        self.smoothing = OneEuroFilter() if smoothing is None else smoothing
+
+    def reset(self):
+        super().reset()
+        self.smoothing.reset()
+
+    def apply(self, x, y, t):
+        x, y = self.smoothing.apply(x, y, t)
+        self.history.append((t, x, y))
+        if len(self.history) < 2:
+            return x, y
+        rows = self.history.last()
+        ts = rows[:, 0] - rows[:, 0].mean()
+        denominator = ts @ ts
+        if denominator == 0:
+            return x, y
+        vx = ts @ rows[:, 1] / denominator
+        vy = ts @ rows[:, 2] / denominator
+        return float(x + vx * self.lead), float(y + vy * self.lead)
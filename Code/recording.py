@@ -0,0 +1,252 @@
+# !/usr/bin/env python3
+# coding: utf-8
+# -*- coding: utf-8 -*-
+
+# Record and replay raw Wiimote sessions.
+#
+# A capture file starts with a 16 byte header (magic, record size) followed by fixed-size records:
+# a monotonic timestamp in nanoseconds relative to the start of the recording, the length of the
+# report and the raw L2CAP report including its transaction header (0xa1: input report from the
+# Wiimote, 0xa2/0x52: output report to the Wiimote). Fixed-size records allow memory-mapping the
+# whole file as one NumPy structured array.
+#
+# Usage:
+#   python3 recording.py record <btaddr> <file> [--seconds N]   record a session with a real Wiimote
+#   python3 recording.py synthesize <file> [--seconds N]        write an artificial session (no hardware)
+#   python3 recording.py info <file>                            print a summary of a capture
+
+import argparse
+import math
+import os
+import socket
+import struct
+import threading
+import time
+import numpy as np
+
+MAGIC = b'WIIREC01'
+HEADER = struct.Struct('<8sII')
+MAX_REPORT_LENGTH = 23
+RECORD = struct.Struct('<qB%ds' % MAX_REPORT_LENGTH)
+RECORD_DTYPE = np.dtype([('t', '<i8'), ('length', 'u1'), ('data', 'u1', (MAX_REPORT_LENGTH,))])
+INPUT_HEADER = 0xa1
+
+assert RECORD.size == RECORD_DTYPE.itemsize
+
+
+class CaptureWriter:
+    # Appends reports to a capture file. Timestamps are taken from time.monotonic_ns() unless given.
+    def __init__(self, path):
+        super().__init__()
+        self._file = open(path, "wb")
+        self._file.write(HEADER.pack(MAGIC, RECORD.size, 0))
+        self._start = time.monotonic_ns()
+        self._lock = threading.Lock()
+        self.count = 0
+
+    def write(self, report, timestamp_ns=None):
+        if timestamp_ns is None:
+            timestamp_ns = time.monotonic_ns() - self._start
+        report = bytes(report[:MAX_REPORT_LENGTH])
+        with self._lock:
+            self._file.write(RECORD.pack(timestamp_ns, len(report), report))
+            self.count += 1
+
+    def close(self):
+        with self._lock:
+            self._file.close()
+
+
+# Memory-maps a capture file. Returns a structured array with the fields 't', 'length' and 'data'.
+def load_capture(path):
+    with open(path, "rb") as f:
+        magic, record_size, _ = HEADER.unpack(f.read(HEADER.size))
+    if magic != MAGIC or record_size != RECORD.size:
+        raise ValueError("%s is not a Wiimote capture file" % path)
+    if os.path.getsize(path) == HEADER.size:
+        return np.zeros(0, dtype=RECORD_DTYPE)
+    return np.memmap(path, dtype=RECORD_DTYPE, mode='r', offset=HEADER.size)
+
+
+# Returns only the input reports (sent by the Wiimote) of a capture.
+def input_reports(capture):
+    return capture[capture['data'][:, 0] == INPUT_HEADER]
+
+
+# Returns the receive times (seconds) and the IR markers of all 0x33 reports (accelerometer + 12 bytes IR)
+# of a capture, the markers as an (N, 4, 3) array with x, y and size like VectorTransform.transform_batch() takes.
+def ir_frames(capture):
+    reports = input_reports(capture)
+    reports = reports[reports['data'][:, 1] == 0x33]
+    ir = reports['data'][:, 7:19].reshape(-1, 4, 3).astype(np.int64)
+    frames = np.empty_like(ir)
+    frames[:, :, 0] = ir[:, :, 0] | ((ir[:, :, 2] & 0x30) << 4)
+    frames[:, :, 1] = ir[:, :, 1] | ((ir[:, :, 2] & 0xc0) << 2)
+    frames[:, :, 2] = ir[:, :, 2] & 0x0f
+    return reports['t'] / 1e9, frames
+
+
+class RecordingTransport:
+    # Wraps another transport (e.g. wiimote.L2CAPTransport) and writes every report
+    # that passes through it into a capture file.
+    def __init__(self, transport, path):
+        super().__init__()
+        self._transport = transport
+        self.writer = CaptureWriter(path)
+
+    def fileno(self):
+        return self._transport.fileno()
+
+    def recv_into(self, buffer):
+        length = self._transport.recv_into(buffer)
+        if length:
+            self.writer.write(memoryview(buffer)[:length])
+        return length
+
+    def send(self, data):
+        self.writer.write(data)
+        self._transport.send(data)
+
+    def close(self):
+        self._transport.close()
+        self.writer.close()
+
+
+class ReplayTransport:
+    # Transport that plays back the input reports of a capture file instead of talking to a Wiimote.
+    # `speed` scales the recorded timing (2.0: twice as fast), None replays as fast as the
+    # receiver reads. Output reports sent by the driver are counted and discarded.
+    # Playback begins with start(), so callbacks can be registered first. When the capture
+    # is over the transport reports a disconnect and `finished` is set.
+    def __init__(self, path, speed=1.0, loops=1):
+        super().__init__()
+        self.capture = input_reports(load_capture(path))
+        self.speed = speed
+        self.loops = loops
+        self.sent = 0
+        self.replayed = 0
+        self.finished = threading.Event()
+        sock_type = getattr(socket, 'SOCK_SEQPACKET', socket.SOCK_DGRAM)
+        self._socket, self._feeder = socket.socketpair(socket.AF_UNIX, sock_type)
+        self._socket.setblocking(False)
+        self._stopped = False
+        self._thread = threading.Thread(target=self._replay, daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def fileno(self):
+        return self._socket.fileno()
+
+    def recv_into(self, buffer):
+        try:
+            return self._socket.recv_into(buffer)
+        except BlockingIOError:
+            return None
+        except OSError:
+            return 0
+
+    def send(self, data):
+        self.sent += 1
+
+    def close(self):
+        self._stopped = True
+        self._socket.close()
+        if self._thread.is_alive():
+            self.finished.wait(1)
+        else:
+            self._feeder.close()
+
+    # Feeds the reports into the socket. At max speed the blocking send() waits for the receiver.
+    def _replay(self):
+        times = self.capture['t']
+        lengths = self.capture['length']
+        data = self.capture['data']
+        try:
+            for _ in range(self.loops):
+                start = time.monotonic_ns()
+                first = int(times[0]) if len(times) > 0 else 0
+                for i in range(len(times)):
+                    if self._stopped:
+                        return
+                    if self.speed:
+                        due = start + (int(times[i]) - first) / self.speed
+                        delay = (due - time.monotonic_ns()) / 1e9
+                        if delay > 0:
+                            time.sleep(delay)
+                    self._feeder.send(data[i, :lengths[i]].tobytes())
+                    self.replayed += 1
+        except OSError:  # receiver went away
+            pass
+        finally:
+            self._feeder.close()  # the receiver sees a disconnect
+            self.finished.set()
+
+
+# Builds an input report 0x33 (buttons, accelerometer and four IR objects in extended mode).
+def build_report(buttons, acc, blobs):
+    report = [INPUT_HEADER, 0x33, buttons >> 8, buttons & 0xff]
+    report += [value >> 2 for value in acc]
+    for x, y, size in blobs:
+        report += [x & 0xff, y & 0xff, ((y >> 8) << 6) | ((x >> 8) << 4) | size]
+    return bytes(report)
+
+
+# Writes an artificial session: a pointer circling over the screen (four IR markers moving
+# together), the B button pressed every two seconds and a shake gesture every five seconds.
+def synthesize(path, seconds=10.0, rate=100):
+    writer = CaptureWriter(path)
+    for i in range(int(seconds * rate)):
+        t = i / rate
+        cx = 512 + 150 * math.cos(t)
+        cy = 384 + 100 * math.sin(t)
+        blobs = [(int(cx + dx), int(cy + dy), 3) for dx, dy in ((-200, -150), (200, -150), (200, 150), (-200, 150))]
+        shaking = (t % 5.0) > 4.0
+        amplitude = 200 if shaking else 4
+        acc = [int(512 + amplitude * math.sin(2 * math.pi * f * t)) for f in (7.0, 9.0, 11.0)]
+        buttons = 0x0004 if (t % 2.0) > 1.5 else 0x0000
+        writer.write(build_report(buttons, acc, blobs), int(t * 1e9))
+    writer.close()
+    return writer.count
+
+
+def record(btaddr, path, seconds):
+    import wiimote
+    model = wiimote.bluetooth.lookup_name(btaddr)
+    transport = RecordingTransport(wiimote.L2CAPTransport(btaddr, model), path)
+    mote = wiimote.WiiMote(btaddr, model, transport)
+    time.sleep(seconds)
+    mote.disconnect()
+    return transport.writer.count
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    sub = parser.add_subparsers(dest="command")
+    sub.required = True
+    rec = sub.add_parser("record")
+    rec.add_argument("btaddr")
+    rec.add_argument("file")
+    rec.add_argument("--seconds", type=float, default=30)
+    syn = sub.add_parser("synthesize")
+    syn.add_argument("file")
+    syn.add_argument("--seconds", type=float, default=10)
+    info = sub.add_parser("info")
+    info.add_argument("file")
+    args = parser.parse_args()
+    if args.command == "record":
+        print("recorded %d reports" % record(args.btaddr, args.file, args.seconds))
+    elif args.command == "synthesize":
+        print("wrote %d reports" % synthesize(args.file, args.seconds))
+    else:
+        capture = load_capture(args.file)
+        inputs = input_reports(capture)
+        duration = (capture['t'][-1] - capture['t'][0]) / 1e9 if len(capture) > 1 else 0
+        types = np.unique(inputs['data'][:, 1], return_counts=True)
+        print("%d reports (%d input) over %.1f s" % (len(capture), len(inputs), duration))
+        for rpt, count in zip(*types):
+            print("  report 0x%02x: %d" % (rpt, count))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,229 @@
+# !/usr/bin/env python3
+# coding: utf-8
+# -*- coding: utf-8 -*-
+
+# Usage:
+#   python3 telemetry.py check [--seconds N]   appends on one thread while others read windows and
+#                                              checks that every window is complete
+
+import argparse
+import sys
+import threading
+import time
+import numpy as np
+
+
+class RingBuffer:
+    # Fixed-capacity ring buffer for rows of shape `row_shape`.
+    # Rows are written one after another into an array with room for 2 * capacity rows. When it is full,
+    # the newest capacity rows are moved to the front in one block. Thus the last n rows are always
+    # one contiguous slice and can be returned as a view without copying.
+    # One thread may append while others read: only the end of the rows is published, after the new row
+    # (and a block move) has been written. The number of rows follows from it, min(end, capacity): the
+    # rows only move to the front once all capacity rows are in use.
+    def __init__(self, capacity, row_shape=(), dtype=np.float64):
+        super().__init__()
+        if capacity < 1:
+            raise ValueError("capacity needs to be at least 1")
+        self.capacity = capacity
+        self._data = np.zeros((2 * capacity,) + tuple(row_shape), dtype=dtype)
+        self._end = 0
+
+    def __len__(self):
+        return min(self._end, self.capacity)
+
+    def append(self, row):
+        end = self._end
+        if end == len(self._data):
+            end = self._compact(end)
+        self._data[end] = row
+        self._end = end + 1
+
+    def clear(self):
+        self._end = 0
+
+    # Returns a read-only view on the last n rows (all rows if n is None), oldest first.
+    # The view is overwritten as new rows arrive, copy it to keep the values.
+    def last(self, n=None):
+        end = self._end
+        return self._window(end, min(end, self.capacity), n)
+
+    def _window(self, end, count, n):
+        if n is None or n > count:
+            n = count
+        view = self._data[end - n:end]
+        view.flags.writeable = False
+        return view
+
+    # Moves the newest capacity - 1 rows to the front, returns the new write position. Readers still use
+    # the old end until the next row is published, the rows they see are not touched by the move.
+    def _compact(self, end):
+        keep = self.capacity - 1
+        self._data[:keep] = self._data[end - keep:end]
+        return keep
+
+
+class TelemetryStream:
+    # Columnar ring buffer for one sensor stream: a float timestamp column 't' plus one array per
+    # data column. `columns` maps column names to (row_shape, dtype). All columns share one write
+    # position and use the same block-move scheme as RingBuffer, so windows are zero-copy views.
+    # Samples are written through flat memoryviews of the arrays, which is several times faster than
+    # NumPy item assignment for single values. Rows with more than one value are copied at once if they
+    # are given as a buffer of the column's type (e.g. array.array), other sequences go through NumPy.
+    def __init__(self, capacity, columns):
+        super().__init__()
+        if capacity < 1:
+            raise ValueError("capacity needs to be at least 1")
+        self.capacity = capacity
+        self._names = ('t',) + tuple(columns)
+        self._arrays = [np.zeros(2 * capacity)]
+        for shape, dtype in columns.values():
+            self._arrays.append(np.zeros((2 * capacity,) + tuple(shape), dtype=dtype))
+        self._columns = tuple(self._arrays[1:])
+        self._times = memoryview(self._arrays[0])
+        # per data column: (flat memoryview, values per row, array)
+        self._writers = tuple((memoryview(array).cast('B').cast(array.dtype.char), array[0].size, array)
+                              for array in self._columns)
+        self._end = 0  # the number of samples is min(end, capacity), see RingBuffer
+
+    def __len__(self):
+        return min(self._end, self.capacity)
+
+    # Appends one sample. Values are given in the order of `columns`.
+    def append(self, timestamp, *values):
+        i = self._end
+        if i == 2 * self.capacity:
+            i = self._compact(i)
+        self._times[i] = timestamp
+        for (view, width, array), value in zip(self._writers, values):
+            if width == 1:
+                view[i] = value
+            else:
+                try:
+                    view[i * width:(i + 1) * width] = value
+                except (TypeError, ValueError):  # not a buffer of the column's type
+                    array[i] = value
+        # publish the sample only after all columns have been written
+        self._end = i + 1
+
+    def clear(self):
+        self._end = 0
+
+    # Returns a dict with zero-copy views of the last n samples of every column (including 't').
+    # The views are overwritten as new samples arrive, copy them to keep the values.
+    def last(self, n=None):
+        end = self._end
+        count = min(end, self.capacity)
+        if n is None or n > count:
+            n = count
+        return self._window(end, n)
+
+    # Returns a dict with zero-copy views of all samples with a timestamp >= `timestamp`.
+    def since(self, timestamp):
+        end = self._end
+        count = min(end, self.capacity)
+        times = self._arrays[0][end - count:end]
+        n = count - int(np.searchsorted(times, timestamp, side='left'))
+        return self._window(end, n)
+
+    def _window(self, end, n):
+        window = {}
+        for name, array in zip(self._names, self._arrays):
+            view = array[end - n:end]
+            view.flags.writeable = False
+            window[name] = view
+        return window
+
+    # Moves the newest capacity - 1 samples to the front, returns the new write position.
+    def _compact(self, end):
+        keep = self.capacity - 1
+        for array in self._arrays:
+            array[:keep] = array[end - keep:end]
+        return keep
+
+
+class WiimoteTelemetry:
+    # History of all sensor streams of one Wiimote with `capacity` samples per stream.
+    # accelerometer: 'x', 'y', 'z' (raw values 0-1023)
+    # ir: 'x', 'y', 'size' with one entry per camera slot (size 0: slot empty)
+    # buttons: 'mask' (see wiimote.Buttons.BUTTONS), one sample per change
+    def __init__(self, capacity=1024):
+        super().__init__()
+        axis = ((), np.int16)
+        slots = ((4,), np.int16)
+        self.accelerometer = TelemetryStream(capacity, {'x': axis, 'y': axis, 'z': axis})
+        self.ir = TelemetryStream(capacity, {'x': slots, 'y': slots, 'size': slots})
+        self.buttons = TelemetryStream(capacity, {'mask': ((), np.uint16)})
+
+    def clear(self):
+        for stream in (self.accelerometer, self.ir, self.buttons):
+            stream.clear()
+
+
+# Appends to a RingBuffer and a TelemetryStream for `seconds` while `readers` threads take windows of both.
+# Once the buffers are full every window has to hold `capacity` rows (the values in a window may already
+# be overwritten by newer rows, see last()). Returns the number of windows read and the broken ones.
+def check_concurrent(seconds=1.0, readers=2, capacity=16):
+    ring = RingBuffer(capacity)
+    stream = TelemetryStream(capacity, {'value': ((), np.int64)})
+    for i in range(capacity):
+        ring.append(i)
+        stream.append(i, i)
+    stop = threading.Event()
+    errors = []
+    windows = [0]
+
+    def read():
+        while not stop.is_set():
+            stream_window = stream.last(capacity)
+            for name, values in (("RingBuffer.last", ring.last(capacity)),
+                                 ("TelemetryStream.last", stream_window['value']),
+                                 ("TelemetryStream.last t", stream_window['t']),
+                                 ("TelemetryStream.since", stream.since(0)['value'])):
+                if len(values) != capacity:
+                    errors.append("%s: %d instead of %d rows" % (name, len(values), capacity))
+                windows[0] += 1
+
+    # switch threads as often as possible, so that reads also happen in the middle of an append
+    switch_interval = sys.getswitchinterval()
+    sys.setswitchinterval(1e-6)
+    threads = [threading.Thread(target=read, daemon=True) for _ in range(readers)]
+    try:
+        for thread in threads:
+            thread.start()
+        deadline = time.monotonic() + seconds
+        i = capacity
+        while time.monotonic() < deadline:
+            for _ in range(1000):
+                ring.append(i)
+                stream.append(i, i)
+                i += 1
+    finally:
+        stop.set()
+        for thread in threads:
+            thread.join()
+        sys.setswitchinterval(switch_interval)
+    return windows[0], errors
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    sub = parser.add_subparsers(dest="command")
+    sub.required = True
+    check = sub.add_parser("check", help="concurrent reader/writer check")
+    check.add_argument("--seconds", type=float, default=1.0, help="per capacity")
+    check.add_argument("--readers", type=int, default=2)
+    check.add_argument("--capacities", type=int, nargs="+", default=[1, 2, 16, 1024])
+    args = parser.parse_args()
+    failed = False
+    for capacity in args.capacities:
+        count, errors = check_concurrent(args.seconds, args.readers, capacity)
+        print("capacity %5d: %d windows read, %d broken" % (capacity, count, len(errors)))
+        for error in errors[:5]:
+            print("  " + error)
+        failed = failed or bool(errors)
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
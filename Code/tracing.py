@@ -0,0 +1,146 @@
+# !/usr/bin/env python3
+# coding: utf-8
+# -*- coding: utf-8 -*-
+
+# Structured tracing for the Wiimote driver.
+#
+# Raw reports are recorded per category into a binary ring buffer that keeps the last `capacity`
+# records, messages (errors) are kept next to them. Hot paths check the category bit first:
+#     if tracing.flags & tracing.RX:
+#         tracing.record(tracing.RX, report)
+# so with tracing disabled (flags == 0, the default) nothing is built or copied.
+# Categories can also be enabled with the environment variable WIIMOTE_TRACE, e.g.
+# WIIMOTE_TRACE=rx,tx or WIIMOTE_TRACE=all. While any category is enabled, errors reported with
+# error() dump the buffer into a file (at most every `ERROR_DUMP_INTERVAL` seconds).
+
+import collections
+import itertools
+import os
+import threading
+import time
+import numpy as np
+
+TX = 0x01  # output reports as they are sent
+RX = 0x02  # input reports as they are received
+MEMORY = 0x04  # memory read data and write acknowledgements
+IR = 0x08  # IR camera bytes of each report
+ACCEL = 0x10  # accelerometer and button bytes of each report
+ALL = TX | RX | MEMORY | IR | ACCEL
+
+CATEGORIES = collections.OrderedDict([('tx', TX), ('rx', RX), ('memory', MEMORY), ('ir', IR), ('accel', ACCEL)])
+
+MAX_RECORD_LENGTH = 23
+ERROR_DUMP_INTERVAL = 10.0
+
+# enabled categories, checked by the callers before calling record()
+flags = 0
+
+
+class TraceBuffer:
+    # Fixed-size binary ring buffer: a monotonic timestamp, the category, the length and up to
+    # MAX_RECORD_LENGTH bytes per record. Writers on different threads take their slot from an
+    # atomic counter, so record() needs no lock.
+    def __init__(self, capacity=8192, message_capacity=256):
+        super().__init__()
+        self.capacity = capacity
+        self._times = np.zeros(capacity)
+        self._categories = np.zeros(capacity, dtype=np.uint8)
+        self._lengths = np.zeros(capacity, dtype=np.uint8)
+        self._data = np.zeros((capacity, MAX_RECORD_LENGTH), dtype=np.uint8)
+        self._counter = itertools.count()
+        self.count = 0
+        self.messages = collections.deque(maxlen=message_capacity)  # (time, category, text)
+
+    def record(self, category, data, length=None):
+        if length is None:
+            length = len(data)
+        length = min(length, MAX_RECORD_LENGTH)
+        i = next(self._counter) % self.capacity
+        self._times[i] = time.monotonic()
+        self._categories[i] = category
+        self._lengths[i] = length
+        self._data[i, :length] = np.frombuffer(data, dtype=np.uint8, count=length)
+        self.count += 1
+
+    def message(self, category, text):
+        self.messages.append((time.monotonic(), category, text))
+
+    def clear(self):
+        self._counter = itertools.count()
+        self.count = 0
+        self.messages.clear()
+
+    # Returns all records, oldest first, as a list of (time, category, bytes).
+    def records(self):
+        n = min(self.count, self.capacity)
+        order = np.argsort(self._times[:n], kind='stable')
+        return [(self._times[i], int(self._categories[i]), self._data[i, :self._lengths[i]].tobytes())
+                for i in order]
+
+
+buffer = TraceBuffer()
+_last_error_dump = 0.0
+_dump_lock = threading.Lock()
+
+
+def category_name(category):
+    for name, bit in CATEGORIES.items():
+        if bit == category:
+            return name
+    return "-"
+
+
+# Enables categories given as bits or names ('tx', 'rx', 'memory', 'ir', 'accel', 'all').
+def enable(*categories):
+    global flags
+    flags |= _parse(categories)
+
+
+def disable(*categories):
+    global flags
+    flags &= ~_parse(categories) if categories else 0
+
+
+def _parse(categories):
+    bits = 0
+    for category in categories:
+        if isinstance(category, str):
+            category = ALL if category == 'all' else CATEGORIES[category]
+        bits |= category
+    return bits
+
+
+def record(category, data, length=None):
+    buffer.record(category, data, length)
+
+
+# Records a problem. Errors are always kept; while tracing is enabled they also dump the buffer.
+def error(category, text):
+    global _last_error_dump
+    buffer.message(category, "error: " + text)
+    if flags == 0:
+        return
+    with _dump_lock:
+        now = time.monotonic()
+        if now - _last_error_dump < ERROR_DUMP_INTERVAL:
+            return
+        _last_error_dump = now
+    dump()
+
+
+# Writes all records and messages in time order to a text file and returns its path.
+def dump(path=None):
+    if path is None:
+        path = "wiimote-trace-%s.txt" % time.strftime("%Y%m%d-%H%M%S")
+    lines = [(t, "%-6s %s" % (category_name(category), data.hex(" ")))
+             for t, category, data in buffer.records()]
+    lines += [(t, "%-6s %s" % (category_name(category), text)) for t, category, text in list(buffer.messages)]
+    lines.sort(key=lambda line: line[0])
+    with open(path, "w") as f:
+        for t, text in lines:
+            f.write("%.6f %s\n" % (t, text))
+    return path
+
+
+if os.environ.get("WIIMOTE_TRACE"):
+    enable(*os.environ["WIIMOTE_TRACE"].split(","))
@@ -4,78 +4,185 @@
 
 
 from operator import itemgetter
-from pylab import *
-from numpy import *
-from math import exp
+import time
+import numpy as np
+from pointerfilter import WeightedAverageFilter
 
 
 class VectorTransform:
-    def __init__(self):
+    # `pointer_filter` smooths the mapped points (see pointerfilter.py), by default a weighted average
+    # of the last 8 points.
+    def __init__(self, pointer_filter=None):
         super().__init__()
-        self.buffer = []
-        self.buffer_size = 8
-        self.weights = self.get_weights()
-
-    def transform(self, signals, x_size, y_size):
-        DEST_W = x_size
-        DEST_H = y_size
-        coords = self.filter_signals(signals)
-        vectors = self.get_ordered_vectors(coords)
-        sx1, sy1 = vectors[0]
-        sx2, sy2 = vectors[1]
-        sx3, sy3 = vectors[2]
-        sx4, sy4 = vectors[3]
-        l, m, t = self.get_factor_vector(sx1, sx2, sx3, sx4, sy1, sy2, sy3, sy4)
-        unit_to_source = matrix([[l * sx1, m * sx2, t * sx3],
-                                 [l * sy1, m * sy2, t * sy3],
-                                 [l, m, t]])
-
-        dx1, dy1 = 0, DEST_H
-        dx2, dy2 = DEST_W, DEST_H
-        dx3, dy3 = DEST_W, 0
-        dx4, dy4 = 0, 0
-        l, m, t = self.get_factor_vector(dx1, dx2, dx3, dx4, dy1, dy2, dy3, dy4)
-        unit_to_destination = matrix([[l * dx1, m * dx2, t * dx3],
-                                      [l * dy1, m * dy2, t * dy3],
-                                      [l, m, t]])
-
-        try:
-            source_to_unit = inv(unit_to_source)
-        except Exception:
-            return 0, 0
-        source_to_destination = unit_to_destination @ source_to_unit
-        x, y, z = [float(w) for w in (source_to_destination @ matrix([[512], [384], [1]]))]
-        x = x / z
-        y = y / z
-
-        # Calculate the weighted average of buffer
-        self.buffer.append((x, y))
-        self.buffer = self.buffer[-self.buffer_size:]
-        x_sum = 0
-        y_sum = 0
-        wsum = 0
-        for i in range(0, len(self.buffer)):
-            a, b = self.buffer[i]
-            weight = self.weights[i]
-            x_sum = x_sum + (a * self.weights[i])
-            y_sum = y_sum + (b * self.weights[i])
-            wsum = wsum + weight
-
-        return x_sum / wsum, y_sum / wsum
+        self.pointer_filter = WeightedAverageFilter(8) if pointer_filter is None else pointer_filter
+        self.tracker = MarkerTracker(self)
+        # markers are reported in whole camera pixels, so by default only unchanged frames are skipped
+        self.tolerance = 1.0
+        self._destination_size = None
+        self._destination = None
+        self._last_markers = None
+        self._last_point = None
 
-    def get_factor_vector(self, x1, x2, x3, x4, y1, y2, y3, y4):
-        source_points_123 = matrix([[x1, x2, x3],
-                                    [y1, y2, y3],
-                                    [1, 1, 1]])
-        source_point_4 = [[x4], [y4], [1]]
+    # Maps the center of the IR camera picture (512, 384) into a window of x_size * y_size pixels, using the
+    # four IR markers (corners of the display) as reference, and passes the result through pointer_filter.
+    # `report_time` is the time the frame was received (time.monotonic(), now if not given). The markers are
+    # followed by `tracker`, so frames with only two or three visible markers still give a position. Returns
+    # `default` if there is none (markers lost or not spanning a plane).
+    def transform(self, signals, x_size, y_size, report_time=None, default=(0, 0)):
+        vectors = self.tracker.track(signals)
+        if vectors is None:
+            return default
+        point = self.map_center(vectors, x_size, y_size)
+        if point is None:
+            return default
+        if report_time is None:
+            report_time = time.monotonic()
+        return self.pointer_filter.apply(point[0], point[1], report_time)
+
+    # Maps a whole IR sequence at once: `frames` is an (N, 4, 3) array with x, y and size of the four markers per
+    # frame (e.g. stacked from telemetry.WiimoteTelemetry.ir), `times` their receive times in seconds (100 frames
+    # per second if not given). Returns an (N, 2) array with the same filtered screen coordinates a new
+    # VectorTransform would return for the frames one by one (0, 0 for frames whose markers do not span a
+    # plane). All frames need four markers, which are ordered by position in every frame; that is the order the
+    # tracker of transform() keeps as long as the Wiimote is not rolled by 45 degrees or more.
+    # The state of this transform is not changed.
+    def transform_batch(self, frames, x_size, y_size, times=None):
+        frames = np.asarray(frames)
+        if frames.ndim != 3 or frames.shape[1:] != (4, 3):
+            raise ValueError("frames need to have the shape (N, 4, 3)")
+        times = np.arange(len(frames)) / 100 if times is None else np.asarray(times, dtype=np.float64)
+        if np.issubdtype(frames.dtype, np.integer):
+            frames = frames.astype(np.int64)  # integer math stays exact like with Python ints
+        count = len(frames)
+
+        # Marker order of get_ordered_vectors(): ascending by y (then x), the bottom pair ascending by x,
+        # the top pair descending by x. Sorting by size first (filter_signals) only affects identical points.
+        xs, ys = frames[:, :, 0], frames[:, :, 1]
+        if np.issubdtype(frames.dtype, np.integer) and count > 0 and xs.min() >= 0 and xs.max() < 1 << 20:
+            # one (y, x) key per marker, sorted with a 5 step sorting network for four values
+            keys = [ys[:, k] << 20 | xs[:, k] for k in range(4)]
+            for p, q in ((0, 1), (2, 3), (0, 2), (1, 3), (1, 2)):
+                keys[p], keys[q] = np.minimum(keys[p], keys[q]), np.maximum(keys[p], keys[q])
+            keys = np.stack(keys, axis=1)
+            xs, ys = keys & ((1 << 20) - 1), keys >> 20
+        else:
+            order = np.lexsort((xs, ys), axis=-1)
+            xs = np.take_along_axis(xs, order, axis=1)
+            ys = np.take_along_axis(ys, order, axis=1)
+        for first, second, swap in ((0, 1, xs[:, 0] > xs[:, 1]), (2, 3, xs[:, 2] < xs[:, 3])):
+            for values in (xs, ys):
+                a, b = values[:, first].copy(), values[:, second].copy()
+                values[:, first] = np.where(swap, b, a)
+                values[:, second] = np.where(swap, a, b)
+        sx1, sx2, sx3, sx4 = xs.T
+        sy1, sy2, sy3, sy4 = ys.T
+
+        # the same operations as get_factor_vector(), get_basis() and map_center(), one frame per element
+        with np.errstate(divide='ignore', invalid='ignore'):
+            det = sx1 * (sy2 - sy3) - sx2 * (sy1 - sy3) + sx3 * (sy1 - sy2)
+            l = (sx4 * (sy2 - sy3) - sx2 * (sy4 - sy3) + sx3 * (sy4 - sy2)) / det
+            m = (sx1 * (sy4 - sy3) - sx4 * (sy1 - sy3) + sx3 * (sy1 - sy4)) / det
+            t = (sx1 * (sy2 - sy4) - sx2 * (sy1 - sy4) + sx4 * (sy1 - sy2)) / det
+            a, b, c = l * sx1, m * sx2, t * sx3
+            d, e, f = l * sy1, m * sy2, t * sy3
+            g, h, i = l, m, t
+            A, B, C = e * i - f * h, c * h - b * i, b * f - c * e
+            D, E, F = f * g - d * i, a * i - c * g, c * d - a * f
+            G, H, I = d * h - e * g, b * g - a * h, a * e - b * d
+            valid = (det != 0) & (a * A + b * D + c * G != 0)
+            u = A * 512 + B * 384 + C
+            v = D * 512 + E * 384 + F
+            w = G * 512 + H * 384 + I
+            destination = self.get_basis(0, y_size, x_size, y_size, x_size, 0, 0, 0)
+            if destination is None:
+                return np.zeros((count, 2))
+            a, b, c, d, e, f, g, h, i = destination
+            x = a * u + b * v + c * w
+            y = d * u + e * v + f * w
+            z = g * u + h * v + i * w
+            px, py = x / z, y / z
+
+        # frames whose markers moved less than `tolerance` since the last computed frame reuse its point
+        if self.tolerance > 1 or not np.issubdtype(frames.dtype, np.integer):
+            self._reuse_points(xs, ys, valid, px, py)
+        # with whole pixels and tolerance <= 1 only identical frames are reused, which give the same point anyway
+
+        # the filter only sees valid frames, in order like with transform()
+        result = np.zeros((count, 2))
+        result[valid] = self.pointer_filter.apply_batch(times[valid], px[valid], py[valid])
+        return result
 
-        try:
-            scale_to_source = solve(source_points_123, source_point_4)
-        except Exception:
-            print("error scale_to_source solve")
-            return 0, 0, 0
+    # Sequential part of transform_batch(): which frames transform() would skip because of `tolerance`.
+    def _reuse_points(self, xs, ys, valid, px, py):
+        anchor = None
+        rows = np.concatenate((xs, ys), axis=1).tolist()
+        for k, markers in enumerate(rows):
+            if anchor is not None and max(abs(p - q) for p, q in zip(markers, rows[anchor])) < self.tolerance:
+                px[k], py[k] = px[anchor], py[anchor]
+                valid[k] = True
+            elif valid[k]:
+                anchor = k
 
-        return [float(x) for x in scale_to_source]
+    # Returns the screen position of the camera center for the ordered markers or None if they do not span a
+    # plane. The destination basis only depends on the window size and is cached. While no marker moved by
+    # `tolerance` or more since the last frame, the last position is reused.
+    def map_center(self, vectors, x_size, y_size):
+        (sx1, sy1), (sx2, sy2), (sx3, sy3), (sx4, sy4) = vectors
+        last = self._last_markers
+        if last is not None and last[0] == (x_size, y_size) and \
+           max(abs(sx1 - last[1]), abs(sy1 - last[2]), abs(sx2 - last[3]), abs(sy2 - last[4]),
+               abs(sx3 - last[5]), abs(sy3 - last[6]), abs(sx4 - last[7]), abs(sy4 - last[8])) < self.tolerance:
+            return self._last_point
+
+        if self._destination_size != (x_size, y_size):
+            self._destination = self.get_basis(0, y_size, x_size, y_size, x_size, 0, 0, 0)
+            self._destination_size = (x_size, y_size)
+        destination = self._destination
+        source = self.get_basis(sx1, sy1, sx2, sy2, sx3, sy3, sx4, sy4)
+        if source is None or destination is None:
+            return None
+
+        # source_to_unit = adj(unit_to_source) / det(unit_to_source). The determinant cancels out in
+        # the perspective division, so only the adjugate is applied to the camera center.
+        a, b, c, d, e, f, g, h, i = source
+        A, B, C = e * i - f * h, c * h - b * i, b * f - c * e
+        D, E, F = f * g - d * i, a * i - c * g, c * d - a * f
+        G, H, I = d * h - e * g, b * g - a * h, a * e - b * d
+        if a * A + b * D + c * G == 0:  # no inverse
+            return None
+        u = A * 512 + B * 384 + C
+        v = D * 512 + E * 384 + F
+        w = G * 512 + H * 384 + I
+        a, b, c, d, e, f, g, h, i = destination
+        x = a * u + b * v + c * w
+        y = d * u + e * v + f * w
+        z = g * u + h * v + i * w
+        point = (x / z, y / z)
+
+        self._last_markers = ((x_size, y_size), sx1, sy1, sx2, sy2, sx3, sy3, sx4, sy4)
+        self._last_point = point
+        return point
+
+    # Returns the 3x3 matrix (row by row as a 9-tuple) that maps the unit points to the four given points,
+    # or None if the first three points are collinear.
+    def get_basis(self, x1, y1, x2, y2, x3, y3, x4, y4):
+        factors = self.get_factor_vector(x1, x2, x3, x4, y1, y2, y3, y4)
+        if factors is None:
+            return None
+        l, m, t = factors
+        return (l * x1, m * x2, t * x3,
+                l * y1, m * y2, t * y3,
+                l, m, t)
+
+    # Solves [[x1, x2, x3], [y1, y2, y3], [1, 1, 1]] * (l, m, t) = (x4, y4, 1) with Cramer's rule.
+    def get_factor_vector(self, x1, x2, x3, x4, y1, y2, y3, y4):
+        det = x1 * (y2 - y3) - x2 * (y1 - y3) + x3 * (y1 - y2)
+        if det == 0:
+            return None
+        l = (x4 * (y2 - y3) - x2 * (y4 - y3) + x3 * (y4 - y2)) / det
+        m = (x1 * (y4 - y3) - x4 * (y1 - y3) + x3 * (y1 - y4)) / det
+        t = (x1 * (y2 - y4) - x2 * (y1 - y4) + x4 * (y1 - y2)) / det
+        return [l, m, t]
 
     # Coordinates first get ordered ascending by y value. From this follows that the first to entries have to be
     # the coordinates at the bottom and the third and fourth at the top. Depending on their x values they have to
@@ -97,20 +204,6 @@ class VectorTransform:
             sorted_y[2] = x2, y2
         return sorted_y
 
-    # Depending on buffer_size automatically fills a list containing weights for weighted average calculation.
-    # The weights get calculated from a flattened exponential function.
-    def get_weights(self):
-        weights = []
-        wsum = 0
-        for i in range(0, self.buffer_size):
-            weights.append(exp(i * 0.5))
-            wsum += weights[i]
-
-        for i in range(0, len(weights)):
-            weights[i] = weights[i] / wsum
-
-        return weights
-
     def filter_signals(self, raw_signals):
         # Sort all ir signals ascending by size
         # Source: https://stackoverflow.com/questions/72899/how-do-i-sort-a-list-of-dictionaries-by-values-of-
@@ -120,3 +213,108 @@ class VectorTransform:
         for sig in signals:
             coords.append((sig["x"], sig["y"]))
         return coords
+
+
+class MarkerTracker:
+    # Follows the four markers from frame to frame by the camera slot ('id') each one is reported in, so their
+    # order (the one of VectorTransform.get_ordered_vectors()) only has to be solved again when tracking breaks:
+    # when fewer than two markers are visible, or a marker is further than `max_jump` camera pixels from where
+    # its corner was in the last frame and no free corner is that close. Missing markers are filled in from
+    # the last positions of all four corners (the last homography), moved along with the visible ones.
+    def __init__(self, transform, max_jump=100):
+        super().__init__()
+        self.transform = transform
+        self.max_jump = max_jump
+        self._slots = {}  # camera slot -> corner
+        self._corners = None  # last positions of the four corners (measured or filled in)
+        self.resolved = 0  # frames whose order had to be solved from scratch
+        self.filled = 0  # frames with filled in markers
+
+    def reset(self):
+        self._slots = {}
+        self._corners = None
+
+    # Returns the positions of the four corners for the visible markers in `signals` or None.
+    def track(self, signals):
+        # empty slots are reported with all bits set
+        visible = [signal for signal in signals if signal['size'] != 0 and signal['y'] < 1023]
+        if self._corners is not None and len(visible) >= 2:
+            corners = self._follow(visible)
+            if corners is not None:
+                return corners
+        self.reset()
+        if len(visible) < 4:
+            return None
+        return self._resolve(visible)
+
+    def _follow(self, visible):
+        last = self._corners
+        max_jump = self.max_jump * self.max_jump
+        slots = self._slots
+        assigned = [None, None, None, None]
+        for signal in visible:
+            x, y, slot = signal['x'], signal['y'], signal['id']
+            corner = slots.get(slot)
+            if corner is not None and assigned[corner] is None:
+                lx, ly = last[corner]
+                if (x - lx) * (x - lx) + (y - ly) * (y - ly) <= max_jump:
+                    assigned[corner] = (x, y)
+                    continue
+            # new or jumping marker: the nearest free corner
+            distance, corner = min(((x - lx) ** 2 + (y - ly) ** 2, k)
+                                   for k, (lx, ly) in enumerate(last) if assigned[k] is None)
+            if distance > max_jump:
+                return None
+            assigned[corner] = (x, y)
+            if slots is self._slots:
+                slots = dict(slots)
+            for other in [other for other, k in slots.items() if k == corner]:
+                del slots[other]
+            slots[slot] = corner
+
+        if None in assigned:
+            seen = [k for k in range(4) if assigned[k] is not None]
+            missing = [k for k in range(4) if assigned[k] is None]
+            if not self._fill(assigned, seen, missing):
+                return None
+            self.filled += 1
+        self._slots = slots
+        self._corners = assigned
+        return assigned
+
+    # Moves the missing corners like the visible ones moved since the last frame: with three visible markers
+    # by their barycentric coordinates (an affine map), with two by a similarity transform.
+    def _fill(self, assigned, seen, missing):
+        last = self._corners
+        if len(seen) == 3:
+            (ax, ay), (bx, by), (cx, cy) = (last[k] for k in seen)
+            (px, py), (qx, qy), (rx, ry) = (assigned[k] for k in seen)
+            for k in missing:
+                factors = self.transform.get_factor_vector(ax, bx, cx, last[k][0], ay, by, cy, last[k][1])
+                if factors is None:
+                    return False
+                l, m, t = factors
+                assigned[k] = (l * px + m * qx + t * rx, l * py + m * qy + t * ry)
+            return True
+        a, b = (complex(*last[k]) for k in seen)
+        p, q = (complex(*assigned[k]) for k in seen)
+        if a == b:
+            return False
+        scale = (q - p) / (b - a)
+        for k in missing:
+            z = p + scale * (complex(*last[k]) - a)
+            assigned[k] = (z.real, z.imag)
+        return True
+
+    def _resolve(self, visible):
+        corners = self.transform.get_ordered_vectors(self.transform.filter_signals(visible))
+        unused = list(visible)
+        for k, (x, y) in enumerate(corners):
+            for signal in unused:
+                if signal['x'] == x and signal['y'] == y:
+                    self._slots[signal['id']] = k
+                    unused.remove(signal)
+                    break
+        self._corners = corners
+        self.resolved += 1
+        return corners
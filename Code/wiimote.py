@@ -33,9 +33,23 @@
 
 # based on the awesome documentation at http://wiibrew.org/wiki/Wiimote
 
+import array
+import asyncio
 import bluetooth
+import collections
+import errno
+import os
+import selectors
+import socket
+import sys
 import threading
 import time
+import traceback
+from concurrent.futures import CancelledError, Future
+from telemetry import WiimoteTelemetry
+import audio
+import latency
+import tracing
 
 # ################### nanosleep ########################### #
 # from https://github.com/graycatlabs/PyBBIO/blob/master/tests/sleep_test.py
@@ -51,25 +65,50 @@ class Timespec(ctypes.Structure):
 
 libc.nanosleep.argtypes = [ctypes.POINTER(Timespec),
                            ctypes.POINTER(Timespec)]
-nanosleep_req = Timespec()
-nanosleep_rem = Timespec()
 
 
 def nsleep(us):
-    """ Delay microseconds with libc nanosleep() using ctypes. """
+    """ Delay microseconds with libc nanosleep() using ctypes.
+    The timespecs are allocated per call, several speakers may sleep at once. """
     if (us >= 1000000):
-        sec = us/1000000
+        sec = int(us // 1000000)
         us %= 1000000
     else:
         sec = 0
-    nanosleep_req.tv_sec = sec
-    nanosleep_req.tv_nsec = int(us * 1000)
-    libc.nanosleep(nanosleep_req, nanosleep_rem)
+    libc.nanosleep(Timespec(sec, int(us * 1000)), Timespec())
+
+
+class _SwitchInterval(object):
+    """
+    Lowers the interpreter's thread switch interval (sys.setswitchinterval())
+    while at least one caller holds it. A thread that wakes up from nsleep()
+    waits for the GIL until a busy thread hands it over, by default up to 5 ms.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._users = 0
+        self._saved = None
+
+    def acquire(self, interval):
+        with self._lock:
+            if self._users == 0:
+                self._saved = sys.getswitchinterval()
+                sys.setswitchinterval(min(interval, self._saved))
+            self._users += 1
+
+    def release(self):
+        with self._lock:
+            self._users -= 1
+            if self._users == 0:
+                sys.setswitchinterval(self._saved)
+
+
+_switch_interval = _SwitchInterval()
 
 # ########################################################### #
 
 VERSION = (0, 4)
-DEBUG = False
 KNOWN_DEVICES = ['Nintendo RVL-CNT-01', 'Nintendo RVL-CNT-01-TR']
 
 
@@ -87,15 +126,35 @@ def find():
     return wiimotes
 
 
-def connect(btaddr, model=None):
+def probe(btaddr, timeout=2.0):
+    """
+    Checks whether the Wiimote at *btaddr* is in reach and accepts connections
+    by opening (and closing) its L2CAP control channel. No SDP lookup is made.
+    """
+    sock = None
+    try:
+        sock = bluetooth.BluetoothSocket(bluetooth.L2CAP)
+        sock.settimeout(timeout)
+        sock.connect((btaddr, 17))
+        return True
+    except (bluetooth.BluetoothError, OSError):
+        return False
+    finally:
+        if sock is not None:
+            sock.close()
+
+
+def connect(btaddr, model=None, reactor=None, telemetry_capacity=1024):
     """
     Establishes a connection to the Wiimote at *btaddr* and returns a Wiimote
-    object. If no *model* is specified, the model is determined automatically.
+    object. If no *model* is specified, the model is determined automatically
+    (this takes a Bluetooth name request; pass a known model to skip it).
+    Reports are received on *reactor* (default: `shared_reactor()`).
     """
     if model is None:
         model = bluetooth.lookup_name(btaddr)
     if model in KNOWN_DEVICES:
-        return WiiMote(btaddr, model)
+        return WiiMote(btaddr, model, reactor=reactor, telemetry_capacity=telemetry_capacity)
     else:
         raise Exception("Wiimote model '%s' unknown!" % (model))
 
@@ -143,13 +202,239 @@ def _add_padding(byte_list, intended_length, padding_byte=0x00):
     return byte_list
 
 
-def _debug(msg):
+
+# Delivery policies for sensor callbacks, see `Subscription`
+DIRECT = 'direct'
+LOSSLESS = 'lossless'
+LATEST = 'latest'
+
+
+class Subscription(object):
+    """
+    Delivers the payloads of one sensor stream to one callback function.
+    Depending on `policy` the callback runs on its own worker thread, so that
+    a slow callback never holds up the Bluetooth receive loop:
+    `LOSSLESS`: payloads are queued in order and never dropped (e.g. button
+    changes: a lost release would leave a button held). The queue grows while
+    the consumer is behind, the longest backlog is kept in `max_pending`.
+    Streams that a slow callback can fall behind for good (accelerometer, IR)
+    should use `LATEST`.
+    `LATEST`: only the most recent payload is kept. Replaced payloads are
+    counted in `coalesced`.
+    `DIRECT`: the callback is called on the receiving thread (no queue).
+    The receive time of each payload's report is passed along with it and can
+    be read in the callback with `latency.current_report_time()`.
+    """
+
+    def __init__(self, callback, policy=LOSSLESS, raw=False):
+        if policy not in (DIRECT, LOSSLESS, LATEST):
+            raise ValueError("unknown delivery policy '%s'" % (policy))
+        self.callback = callback
+        self.policy = policy
+        self.raw = raw
+        self.delivered = 0
+        self.coalesced = 0
+        self.max_pending = 0
+        self._queue = collections.deque()
+        self._times = collections.deque()  # receive time of each queued payload
+        self._cond = threading.Condition()
+        self._active = True
+        if policy != DIRECT:
+            self._thread = threading.Thread(target=self._run, daemon=True)
+            self._thread.start()
+
+    def publish(self, payload, report_time=None):
+        if self.policy == DIRECT:
+            self._deliver(payload, report_time)
+            return
+        with self._cond:
+            if self.policy == LATEST and self._queue:
+                self._queue.popleft()
+                self._times.popleft()
+                self.coalesced += 1
+            self._queue.append(payload)
+            self._times.append(report_time)
+            if len(self._queue) > self.max_pending:
+                self.max_pending = len(self._queue)
+            self._cond.notify()
+
+    def close(self):
+        """
+        Stops the worker thread. Payloads still queued are discarded.
+        """
+        with self._cond:
+            self._active = False
+            self._cond.notify()
+
+    def get_stats(self):
+        return {'policy': self.policy,
+                'delivered': self.delivered,
+                'coalesced': self.coalesced,
+                'pending': len(self._queue),
+                'max_pending': self.max_pending}
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while self._active and not self._queue:
+                    self._cond.wait()
+                if not self._active:
+                    return
+                payload = self._queue.popleft()
+                report_time = self._times.popleft()
+            self._deliver(payload, report_time)
+
+    def _deliver(self, payload, report_time):
+        latency.set_current_report_time(report_time)
+        if latency.monitor.enabled:
+            latency.monitor.mark(latency.DISPATCH, report_time)
+        try:
+            self.callback(payload)
+        except Exception:
+            # a broken callback must neither stop the worker nor the receive loop
+            traceback.print_exc()
+        self.delivered += 1
+
+
+class Dispatcher(object):
+    """
+    Fans out the payloads of one sensor stream to all subscribed callbacks.
+    New subscriptions use `default_policy` unless another policy is given.
+    Raw subscriptions receive the sensor's live state object. All others get
+    the list/dict payload built by `compat_payload()`, which is only called
+    if such a subscription exists.
+    """
+
+    def __init__(self, default_policy, compat_payload):
+        self.default_policy = default_policy
+        self._compat_payload = compat_payload
+        self._subscriptions = []
+
+    def __len__(self):
+        return len(self._subscriptions)
+
+    def subscribe(self, func, policy=None, raw=False):
+        subscription = Subscription(func, policy or self.default_policy, raw=raw)
+        # copy on write: publish() iterates without taking a lock
+        self._subscriptions = self._subscriptions + [subscription]
+        return subscription
+
+    def unsubscribe(self, func):
+        remaining = []
+        for subscription in self._subscriptions:
+            if subscription.callback == func:
+                subscription.close()
+            else:
+                remaining.append(subscription)
+        self._subscriptions = remaining
+
+    def publish(self, state, report_time=None):
+        """
+        Passes the decoded *state* of the report received at *report_time*
+        (time.monotonic()) to all subscriptions.
+        """
+        if latency.monitor.enabled:
+            latency.monitor.mark(latency.DECODE, report_time)
+        payload = None
+        for subscription in self._subscriptions:
+            if subscription.raw:
+                subscription.publish(state, report_time)
+            else:
+                if payload is None:  # shared by all compat subscriptions, as before
+                    payload = self._compat_payload()
+                subscription.publish(payload, report_time)
+
+    def close(self):
+        for subscription in self._subscriptions:
+            subscription.close()
+        self._subscriptions = []
+
+    def get_stats(self):
+        return [subscription.get_stats() for subscription in self._subscriptions]
+
+
+class AccelerometerState(object):
     """
-    Internal debugging function, prints out parameters on stdout
-    if global var `DEBUG` is True
+    Preallocated XYZ accelerometer values (0-1023) that get updated in place.
+    Supports indexing like the list it replaces.
     """
-    if DEBUG:
-        print("DEBUG: " + str(msg))
+
+    __slots__ = ('x', 'y', 'z')
+
+    def __init__(self, x=0, y=0, z=0):
+        self.x = x
+        self.y = y
+        self.z = z
+
+    def __len__(self):
+        return 3
+
+    def __getitem__(self, axis):
+        if axis == 0:
+            return self.x
+        elif axis == 1:
+            return self.y
+        elif axis == 2:
+            return self.z
+        raise IndexError("list index %d out of range" % (axis))
+
+    def __repr__(self):
+        return repr(self.as_list())
+
+    def as_list(self):
+        return [self.x, self.y, self.z]
+
+    def copy(self):
+        return AccelerometerState(self.x, self.y, self.z)
+
+
+class ButtonState(object):
+    """
+    Button state as a bitmask (see `Buttons.BUTTONS`) and the bits that
+    changed with the last report.
+    """
+
+    __slots__ = ('mask', 'changed')
+
+    def __init__(self, mask=0, changed=0):
+        self.mask = mask
+        self.changed = changed
+
+    def __repr__(self):
+        return "ButtonState(mask=0x%04x, changed=0x%04x)" % (self.mask, self.changed)
+
+    def is_pressed(self, btn):
+        return bool(self.mask & Buttons.BUTTONS[btn])
+
+    def copy(self):
+        return ButtonState(self.mask, self.changed)
+
+
+class IRBlob(object):
+    """
+    One of the four IR objects tracked by the camera. `size` is 0 if the
+    slot is empty. Supports item access (blob['x']) like the dicts it replaces.
+    """
+
+    __slots__ = ('id', 'x', 'y', 'size')
+
+    def __init__(self, id, x=0, y=0, size=0):
+        self.id = id
+        self.x = x
+        self.y = y
+        self.size = size
+
+    def __getitem__(self, key):
+        return getattr(self, key)
+
+    def __repr__(self):
+        return repr(self.as_dict())
+
+    def as_dict(self):
+        return {'id': self.id, 'x': self.x, 'y': self.y, 'size': self.size}
+
+    def copy(self):
+        return IRBlob(self.id, self.x, self.y, self.size)
 
 
 class Accelerometer(object):
@@ -160,10 +445,10 @@ class Accelerometer(object):
     SUPPORTED_REPORTS = [0x31, 0x33]
 
     def __init__(self, wiimote):
-        self._state = [0.0, 0.0, 0.0]
+        self._state = AccelerometerState()
         self._wiimote = wiimote
         self._com = wiimote._com
-        self._callbacks = []
+        self._dispatcher = Dispatcher(LATEST, self._state.as_list)
 
     def __len__(self):
         return len(self._state)
@@ -172,34 +457,35 @@ class Accelerometer(object):
         return repr(self._state)
 
     def __getitem__(self, axis):
-        if 0 <= axis <= 2:
-            return self._state[axis]
-        else:
-            raise IndexError("list index %d out of range" % (axis))
+        return self._state[axis]
 
-    def register_callback(self, func):
+    def register_callback(self, func, policy=LATEST, raw=False):
         """
         Register a callback function `func` that gets called every time
         when new accelerometer values are transmitted from the Wiimote.
         A list with XYZ accelerometer values between 0 and 1023 is passed
         to the callback function.
+        By default the callback runs on its own thread and only receives the
+        latest values if it is slower than the Wiimote (see `Subscription`).
+        With `raw` set, the live `AccelerometerState` is passed instead of a
+        new list. It keeps changing, so copy() it to hold on to the values.
         """
-        self._callbacks.append(func)
+        self._dispatcher.subscribe(func, policy, raw)
+        self._com.refresh_report_mode()
 
     def unregister_callback(self, func):
         """
         Unregister a callback function `func` that has been previously registered.
         The function will no longer get called on new accelerometer data from the Wiimote.
         """
-        if func in self._callbacks:
-            self._callbacks.remove(func)
+        self._dispatcher.unsubscribe(func)
+        self._com.refresh_report_mode()
 
     def _notify_callbacks(self):
         """
         Call all registered callback functions with state (x,y,z values) as parameter.
         """
-        for callback in self._callbacks:
-            callback(self._state)
+        self._dispatcher.publish(self._state, self._com.report_time)
 
     def handle_report(self, report):
         """
@@ -208,11 +494,15 @@ class Accelerometer(object):
         """
         if report[0] in [0x3e, 0x3f]:  # interleaved modes
             raise NotImplementedError("Data reporting mode 0x3e/0x3f not supported")
-        x_msb, y_msb, z_msb = report[3:6]
-        x = (x_msb << 2) + ((report[1] & 0b01100000) >> 5)
-        y = (y_msb << 2) + ((report[2] & 0b00100000) >> 4)
-        z = (z_msb << 2) + ((report[2] & 0b01000000) >> 5)
-        self._state = [x, y, z]
+        if tracing.flags & tracing.ACCEL:
+            tracing.record(tracing.ACCEL, report, 6)
+        state = self._state
+        state.x = (report[3] << 2) + ((report[1] & 0b01100000) >> 5)
+        state.y = (report[4] << 2) + ((report[2] & 0b00100000) >> 4)
+        state.z = (report[5] << 2) + ((report[2] & 0b01000000) >> 5)
+        telemetry = self._wiimote.telemetry
+        if telemetry is not None:
+            telemetry.accelerometer.append(self._com.report_time, state.x, state.y, state.z)
         self._notify_callbacks()
 
 
@@ -232,70 +522,81 @@ class Buttons(object):
                'Right': 0x0200,
                'Two': 0x0001,
                'Up': 0x0800, }
+    ALL_BUTTONS = 0x1f9f
 
     def __init__(self, wiimote):
         self._wiimote = wiimote
         self._com = wiimote._com
-        self._state = {}
-        for button in list(Buttons.BUTTONS.keys()):
-            self._state[button] = False
-        self._callbacks = []
+        self._state = ButtonState()
+        self._dispatcher = Dispatcher(LOSSLESS, self._diff)
 
     def __len__(self):
-        return len(self._state)
+        return len(Buttons.BUTTONS)
 
     def __repr__(self):
-        return repr(self._state)
+        return repr(self.get_state())
 
     def __getitem__(self, btn):
-        if btn in self._state:
-            return self._state[btn]
+        if btn in Buttons.BUTTONS:
+            return bool(self._state.mask & Buttons.BUTTONS[btn])
         else:
             raise KeyError(str(btn))
 
-    def register_callback(self, func):
+    def get_state(self):
+        """
+        Returns a dict with the pressed state of every button.
+        """
+        return {btn: bool(self._state.mask & mask) for btn, mask in Buttons.BUTTONS.items()}
+
+    def register_callback(self, func, policy=LOSSLESS, raw=False):
         """
         Register a callback function `func` that gets called every time
-        when new button states are transmitted from the Wiimote.
+        the state of a button changes.
         A list of all _changed_ buttons is passed as parameter to this function.
+        By default the callback runs on its own thread and receives every
+        button report in order (see `Subscription`).
+        With `raw` set, the live `ButtonState` is passed instead of a list.
+        It keeps changing, so copy() it to hold on to the values.
         """
-        self._callbacks.append(func)
+        self._dispatcher.subscribe(func, policy, raw)
 
     def unregister_callback(self, func):
         """
         Unregister a callback function `func` that has been previously registered.
         The function will no longer get called on changed button states.
         """
-        if func in self._callbacks:
-            self._callbacks.remove(func)
+        self._dispatcher.unsubscribe(func)
 
-    def _notify_callbacks(self, diff):
+    def _notify_callbacks(self):
         """
         Call all registered callback functions with a list of buttons whose state
         has changed as parameter.
         """
-        for callback in self._callbacks:
-            callback(diff)
+        self._dispatcher.publish(self._state, self._com.report_time)
 
     def handle_report(self, report):
         """
         Extract button data from a Wiimote report.
         Usually gets called by the Wiimote CommunicationHandler object.
         """
-        btn_bytes = (report[1] << 8) + report[2]
-        new_state = {}
-        for btn, mask in list(Buttons.BUTTONS.items()):
-            new_state[btn] = bool(mask & btn_bytes)
-        diff = self._update_state(new_state)
-        self._notify_callbacks(diff)
-
-    def _update_state(self, new_state):
-        diff = []
-        for btn, state in list(new_state.items()):
-            if self._state[btn] != state:
-                diff.append((btn, state))
-                self._state[btn] = state
-        return diff
+        state = self._state
+        btn_bytes = ((report[1] << 8) + report[2]) & Buttons.ALL_BUTTONS
+        changed = btn_bytes ^ state.mask
+        if changed:  # keeps the lossless queue free for actual button changes
+            state.mask = btn_bytes
+            state.changed = changed
+            telemetry = self._wiimote.telemetry
+            if telemetry is not None:
+                telemetry.buttons.append(self._com.report_time, btn_bytes)
+            self._notify_callbacks()
+
+    def _diff(self):
+        """
+        List of (button, is_pressed) tuples for all buttons changed by the last report.
+        """
+        state = self._state
+        return [(btn, bool(state.mask & mask))
+                for btn, mask in Buttons.BUTTONS.items() if state.changed & mask]
 
 
 class LEDs(object):
@@ -370,48 +671,146 @@ class Rumbler(object):
 class Speaker(object):
     """
     Represents the speaker of the Wiimote.
+    Clips (see audio.py) are streamed by a scheduler thread: their prepared
+    reports are sent against a monotonic deadline, so `play()` never blocks
+    the caller and the pace does not drift. The thread writes each report to
+    the transport itself when it is due instead of waiting for the reactor
+    (unless other output reports are waiting, `queued` counts those).
+    While a clip streams the interpreter switches threads every
+    `switch_interval` seconds, so that the thread gets the GIL back in time
+    when other Python threads are busy (None: leave the interval alone).
+    Reports written more than a millisecond after their deadline are counted
+    in `late` and the largest delay is kept in `max_lateness`.
     """
+
+    RPT_SPKR_ON = 0x14
+    RPT_SPKR_PLAY = 0x18
+    RPT_SPKR_MUTE = 0x19
+    ON = 0x04
+    OFF = 0x00
+    switch_interval = 0.0005
+
+    # the beep the speaker has always played: 20 reports of one 10 ms wave, 8-bit PCM at 2000 Hz
+    BEEP = audio.Clip(bytes([255-128, 255-167, 255-202, 255-231, 255-249, 255-255, 255-249, 255-231, 255-202,
+                             255-167, 255-128, 88, 53, 24, 6, 0, 6, 24, 53, 88]) * 20)
+
     def __init__(self, wiimote):
-        self._playing = False
         self.wiimote = wiimote
         self._com = wiimote._com
+        self._queue = collections.deque()  # (clip, future)
+        self._cond = threading.Condition()
+        self._thread = None
+        self._config = None  # configuration the speaker currently has
+        self._stop_current = False
+        self.sent = 0
+        self.queued = 0
+        self.late = 0
+        self.max_lateness = 0.0
 
     def beep(self):
         """
-        Play a short beep through the speaker
+        Play a short beep through the speaker. Ignored while a clip is playing.
+        """
+        if self.is_playing():
+            return None
+        return self.play(self.BEEP)
+
+    def play(self, clip):
+        """
+        Queues *clip* (an `audio.Clip`) and returns immediately.
+        Returns a Future that is done when the clip has been sent.
+        """
+        future = Future()
+        with self._cond:
+            self._queue.append((clip, future))
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, daemon=True)
+                self._thread.start()
+            self._cond.notify()
+        return future
+
+    def stop(self):
+        """
+        Stops the current clip and drops all queued ones. Their Futures are
+        cancelled, the one of the current clip raises CancelledError.
         """
-        if self._playing:
+        with self._cond:
+            for _, future in self._queue:
+                future.cancel()
+            self._queue.clear()
+            self._stop_current = True
+
+    def is_playing(self):
+        return self._thread is not None
+
+    def _run(self):
+        while True:
+            with self._cond:
+                if not self._queue:
+                    self._com._send(self.RPT_SPKR_ON, self.OFF)
+                    self._config = None
+                    self._thread = None
+                    return
+                clip, future = self._queue.popleft()
+                self._stop_current = False
+            if not future.set_running_or_notify_cancel():
+                continue
+            try:
+                self._configure(clip)
+                if self._paced_stream(clip):
+                    future.set_result(clip)
+                else:  # a running Future can not be cancelled any more
+                    future.set_exception(CancelledError("the clip was stopped"))
+            except Exception as e:
+                future.set_exception(e)
+
+    def _configure(self, clip):
+        config = clip.config()
+        if config == self._config:
             return
-        self._playing = True
-        RPT_SPKR_ON = 0x14
-        RPT_SPKR_MUTE = 0x19
-        RPT_SPKR_PLAY = 0x18
-        ON = 0x04
-        OFF = 0x00
-        self._com._send(RPT_SPKR_ON, ON)
-        self._com._send(RPT_SPKR_MUTE, ON)
-        # Write 0x01 to register 0xa20009
-        self.wiimote.memory.write(0xa20009, [0x01])
-        # Write 0x08 to register 0xa20001
-        self.wiimote.memory.write(0xa20001, [0x08])
-        # set up for 8-Bit PCM, 1000 Hz, see http://wiibrew.org/wiki/Wiimote#Speaker
-        self.wiimote.memory.write(0xa20001, [0x00, 0x40, 0x70, 0x17, 0x30, 0x00, 0x00])
-        self.wiimote.memory.write(0xa20008, [0x01])
-        self._com._send(RPT_SPKR_MUTE, OFF)
-        time.sleep(0.05)
-        num_samples = 20
-        # samples = [0, 30, 60, 90, 120, 90, 60, 30, 0, 255-30, 255-60, 255-90, 255-120, 255-90, 255-60, 255-30, 0, 0, 0, 0]
-        # samples = [0, 120, 240, 0, 120, 240, 0, 120, 240, 0, 120, 240, 0, 120, 240, 0, 120, 240, 0, 0]
-        # samples = [128,167,202,231,249,255,249,231,202,167,128,88,53,24,6,0,6,24,53,88,]
-        # samples = [0, 30, 60, 90, 120, 150, 180, 210, 240, 210, 180, 150, 120, 90, 60, 30, 0, 0, 0, 0]
-        samples = [255-128, 255-167, 255-202, 255-231, 255-249, 255-255, 255-249, 255-231, 255-202, 255-167, 255-128, 88, 53, 24, 6, 0, 6, 24, 53, 88, ]
-        for _ in range(20):
-            self._com._send(RPT_SPKR_PLAY, num_samples << 3, samples)
-            time.sleep(0.01)
-            # currently, timing does not seem to be the reason why  audio sounds awful - stay with time.sleep()
-            # nsleep(9000)
-        self._com._send(RPT_SPKR_ON, OFF)
-        self._playing = False
+        self._com._send(self.RPT_SPKR_ON, self.ON)
+        self._com._send(self.RPT_SPKR_MUTE, self.ON)
+        memory = self.wiimote.memory
+        memory.write(0xa20009, [0x01])
+        memory.write(0xa20001, [0x08])
+        memory.write(0xa20001, config)
+        configured = memory.write(0xa20008, [0x01])
+        self._com._send(self.RPT_SPKR_MUTE, self.OFF)
+        try:
+            configured.result(memory.timeout)
+        except Exception:
+            # play anyway, the speaker may still have been configured
+            pass
+        self._config = config
+
+    def _paced_stream(self, clip):
+        if self.switch_interval is None:
+            return self._stream(clip)
+        _switch_interval.acquire(self.switch_interval)
+        try:
+            return self._stream(clip)
+        finally:
+            _switch_interval.release()
+
+    # Returns False if the clip was stopped before all of it was sent.
+    def _stream(self, clip):
+        deadline = time.monotonic()
+        for payload in clip.payloads:
+            if self._stop_current:
+                return False
+            if not self._com._send_report_now(self.RPT_SPKR_PLAY, payload):
+                self.queued += 1
+            lateness = time.monotonic() - deadline  # when it was written (or queued)
+            self.sent += 1
+            if lateness > 0.001:
+                self.late += 1
+            if lateness > self.max_lateness:
+                self.max_lateness = lateness
+            deadline += clip.interval
+            delay = deadline - time.monotonic()
+            if delay > 0:
+                nsleep(delay * 1000000)
+        return True
 
 
 class IRCam(object):
@@ -438,21 +837,27 @@ class IRCam(object):
     def __init__(self, wiimote):
         self.wiimote = wiimote
         self._com = wiimote._com
-        self._state = []
-        self._callbacks = []
+        # one preallocated record per camera slot, updated in place
+        self._blobs = [IRBlob(slot) for slot in range(4)]
+        # the same values as columns for the telemetry store
+        self._xs = array.array('h', [0, 0, 0, 0])  # copied into telemetry.ir in one piece
+        self._ys = array.array('h', [0, 0, 0, 0])
+        self._sizes = array.array('h', [0, 0, 0, 0])
+        self._dispatcher = Dispatcher(LATEST, self.get_state)
         self._mode = self.MODE_EXTENDED
         self._sensitivity = 3
         self.set_mode_sensitivity(self._mode, self._sensitivity)
 
     def __len__(self):
-        return len(self._state)
+        return len(self.get_state())
 
     def __repr__(self):
-        return repr(self._state)
+        return repr(self.get_state())
 
     def __getitem__(self, slot):
-        if 0 <= slot < len(self._state):
-            return self._state[slot]
+        state = self.get_state()
+        if 0 <= slot < len(state):
+            return state[slot]
         else:
             raise IndexError("list index out of range")
 
@@ -464,6 +869,7 @@ class IRCam(object):
         Default mode: MODE_EXTENDED
         Default sensitivity: 3
         See WiiBrew documentation.
+        Returns a Future that is done when the camera has been configured.
         """
         if sensitivity > len(self.SENSITIVITY_BLOCKS) - 1 or \
            (mode not in [self.MODE_BASIC, self.MODE_EXTENDED, self.MODE_FULL]):
@@ -473,17 +879,27 @@ class IRCam(object):
         self._com.set_report_mode(0x33)  # todo: adjust for other modes!!
         self._com._send(0x13, 0x04)
         self._com._send(0x1a, 0x04)
+        # writes are pipelined and executed in order, so only the last one needs to be waited for
         self.wiimote.memory.write(0xb00030, 0x08, eeprom=False)
         self.wiimote.memory.write(0xb00000, self.SENSITIVITY_BLOCKS[mode][0], eeprom=False)
         self.wiimote.memory.write(0xb0001a, self.SENSITIVITY_BLOCKS[mode][1], eeprom=False)
         self.wiimote.memory.write(0xb00033, mode, eeprom=False)
-        self.wiimote.memory.write(0xb00030, 0x08, eeprom=False)
+        return self.wiimote.memory.write(0xb00030, 0x08, eeprom=False)
 
     def disable(self):
         pass
 
     def get_state(self):
-        return self._state
+        """
+        Returns a list with one {'id', 'x', 'y', 'size'} dict per visible IR object.
+        """
+        return [blob.as_dict() for blob in self._blobs if blob.size != 0]
+
+    def get_blobs(self):
+        """
+        Returns the four live `IRBlob` records (size 0: slot empty).
+        """
+        return self._blobs
 
     def set_sensitivity(self, sensitivity):
         self.set_mode_sensitivity(self._mode, sensitivity)
@@ -491,100 +907,779 @@ class IRCam(object):
     def set_mode(self, mode):
         self.set_mode_sensitivity(mode, self._sensitivity)
 
-    def register_callback(self, func):
-        self._callbacks.append(func)
+    def register_callback(self, func, policy=LATEST, raw=False):
+        """
+        Register a callback function `func` that gets called with a list of
+        {'id', 'x', 'y', 'size'} dicts for all visible IR objects on every report.
+        With `raw` set, the four live `IRBlob` records are passed instead.
+        """
+        self._dispatcher.subscribe(func, policy, raw)
+        self._com.refresh_report_mode()
 
     def unregister_callback(self, func):
-        if func in self._callbacks:
-            self._callbacks.remove(func)
+        self._dispatcher.unsubscribe(func)
+        self._com.refresh_report_mode()
 
     def _notify_callbacks(self):
-        for callback in self._callbacks:
-            callback(self._state)
+        self._dispatcher.publish(self._blobs, self._com.report_time)
 
     def handle_report(self, report):
         assert(report[0] in self.SUPPORTED_REPORTS)
         # only extended mode for now!
-        ir_data = report[6:]
-        self._state = []
-        for ir_obj in range(4):
-            data = ir_data[ir_obj*3:(ir_obj+1)*3]
-            x = data[0] + ((data[2] & 0b00110000) << 4)
-            y = data[1] + ((data[2] & 0b11000000) << 2)
-            size = data[2] & 0b00001111
-            if size != 0:
-                self._state.append({'id': ir_obj, 'x': x, 'y': y, 'size': size})
+        if tracing.flags & tracing.IR:
+            tracing.record(tracing.IR, report[6:18])
+        xs, ys, sizes = self._xs, self._ys, self._sizes
+        offset = 6
+        for slot, blob in enumerate(self._blobs):
+            flags = report[offset + 2]
+            xs[slot] = blob.x = report[offset] + ((flags & 0b00110000) << 4)
+            ys[slot] = blob.y = report[offset + 1] + ((flags & 0b11000000) << 2)
+            sizes[slot] = blob.size = flags & 0b00001111
+            offset += 3
+        telemetry = self.wiimote.telemetry
+        if telemetry is not None:
+            telemetry.ir.append(self._com.report_time, xs, ys, sizes)
         self._notify_callbacks()
 
 
+class _MemoryRequest(object):
+    """
+    A read or a single (at most 16 byte) write chunk handled by `Memory`.
+    """
+
+    __slots__ = ('future', 'payload', 'amount', 'received', 'deadline')
+
+    def __init__(self, future, payload, amount):
+        self.future = future
+        self.payload = payload  # output report arguments for CommunicationHandler._send()
+        self.amount = amount
+        self.received = []
+        self.deadline = None
+
+
 class Memory(object):
+    """
+    Reads and writes the memory and registers of the Wiimote.
+    All requests return a `concurrent.futures.Future` immediately and are
+    answered from the receive loop:
+    writes are split into 16-byte chunks and up to `max_writes_in_flight`
+    chunks are sent before their acknowledgements arrive. The Wiimote handles
+    one read at a time, so reads are queued and sent one after another.
+    Requests that are not answered within `timeout` seconds fail with a TimeoutError.
+    """
 
     RPT_READ = 0x17
     RPT_WRITE = 0x16
+    RPT_READ_DATA = 0x21
+    RPT_ACK = 0x22
 
-    SUPPORTED_REPORTS = [0x21]
+    SUPPORTED_REPORTS = [0x21, 0x22]
 
     MAX_ADDRESS = 0x16FF
+    MAX_CHUNK = 16
 
-    def __init__(self, wiimote):
+    def __init__(self, wiimote, max_writes_in_flight=4, timeout=1.0):
         self.wiimote = wiimote
         self._com = wiimote._com
-        self._request_in_progress = False
-        self._bytes_requested = 0
-        self._reply_buffer = []
+        self.max_writes_in_flight = max_writes_in_flight
+        self.timeout = timeout
+        self._lock = threading.Lock()
+        self._queued_reads = collections.deque()
+        self._current_read = None
+        self._queued_writes = collections.deque()
+        self._writes_in_flight = collections.deque()
+        self._watchdog = None
 
     def write(self, address, data, eeprom=False):
-        address_bytes = _val_to_byte_list(address, 3, big_endian=True)
+        """
+        Writes *data* (a byte value or a nested list of byte values) to *address*.
+        Returns a Future that is done when the Wiimote acknowledged all chunks.
+        There is no need to wait for it: writes are always executed in order.
+        """
         bytes_to_send = _flatten(data)
         amount = len(bytes_to_send)
-        if eeprom and address + amount > Memory.MAX_ADDRESS:
-            raise ValueError("EEPROM address needs to be between 0x0000 and 0x16FF")
-        if address < 0:
-            raise ValueError("Memory address needs to be greater than 0x0000")
-        # to do: send larger blocks in multiple 16-byte requests instead of failing
-        if amount > 16:
-            raise ValueError("A maximum of 16 bytes can be sent per function call")
-        amount_byte = _val_to_byte_list(amount, 1, big_endian=True)
-        bytes_to_send = _add_padding(bytes_to_send, 16)
+        self._check_address(address, amount, eeprom)
+        control_or_eeprom = 0x00 if eeprom else 0x04
+        chunk_futures = []
+        with self._lock:
+            for offset in range(0, amount, Memory.MAX_CHUNK):
+                chunk = bytes_to_send[offset:offset + Memory.MAX_CHUNK]
+                address_bytes = _val_to_byte_list(address + offset, 3, big_endian=True)
+                amount_byte = _val_to_byte_list(len(chunk), 1, big_endian=True)
+                payload = (Memory.RPT_WRITE, control_or_eeprom, address_bytes, amount_byte,
+                           _add_padding(chunk, Memory.MAX_CHUNK))
+                future = Future()
+                chunk_futures.append(future)
+                self._queued_writes.append(_MemoryRequest(future, payload, len(chunk)))
+            self._send_next_writes()
+        if len(chunk_futures) == 1:
+            return chunk_futures[0]
+        return _gather(chunk_futures)
+
+    def read_async(self, address, amount, eeprom=False):
+        """
+        Requests *amount* bytes starting at *address*.
+        Returns a Future whose result is the list of bytes read.
+        """
+        self._check_address(address, amount, eeprom)
+        address_bytes = _val_to_byte_list(address, 3, big_endian=True)
+        amount_bytes = _val_to_byte_list(amount, 2, big_endian=True)
         control_or_eeprom = 0x00 if eeprom else 0x04
-        self._com._send(Memory.RPT_WRITE, control_or_eeprom, address_bytes, amount_byte, bytes_to_send)
+        future = Future()
+        payload = (Memory.RPT_READ, control_or_eeprom, address_bytes, amount_bytes)
+        with self._lock:
+            self._queued_reads.append(_MemoryRequest(future, payload, amount))
+            self._send_next_read()
+        return future
+
+    def read(self, address, amount, eeprom=False, timeout=None):
+        """
+        Reads *amount* bytes starting at *address* and blocks until they arrived.
+        Must not be called from the receive loop (e.g. from a DIRECT callback).
+        """
+        future = self.read_async(address, amount, eeprom)
+        return future.result(self._wait_time(timeout))
+
+    async def aread(self, address, amount, eeprom=False):
+        """
+        asyncio variant of `read()`.
+        """
+        return await asyncio.wrap_future(self.read_async(address, amount, eeprom))
+
+    async def awrite(self, address, data, eeprom=False):
+        """
+        asyncio variant of `write()` that returns once the write was acknowledged.
+        """
+        return await asyncio.wrap_future(self.write(address, data, eeprom))
+
+    def _wait_time(self, timeout):
+        # Queued requests wait for the ones before them, so allow some slack on top of the request timeout
+        return timeout if timeout is not None else self.timeout * 4
 
-    def read(self, address, amount, eeprom=False):
-        if self._request_in_progress:
-            raise RuntimeError("Memory read already in progress.")
+    def _check_address(self, address, amount, eeprom):
         if eeprom and address + amount > Memory.MAX_ADDRESS:
             raise ValueError("EEPROM address needs to be between 0x0000 and 0x16FF")
         if address < 0:
             raise ValueError("Memory address needs to be greater than 0x0000")
-        self._bytes_remaining = amount
-        address_bytes = _val_to_byte_list(address, 3, big_endian=True)
-        amount_bytes = _val_to_byte_list(amount, 2, big_endian=True)
-        control_or_eeprom = 0x00 if eeprom else 0x04
-        self._request_in_progress = True
-        self._reply_buffer = []
-        self._com._send(Memory.RPT_READ, control_or_eeprom, address_bytes, amount_bytes)
-        # now wait until handle() has filled our reply buffer
-        while self._request_in_progress:
-            time.sleep(0.01)
-        return self._reply_buffer
+
+    # The following methods have to be called with self._lock held.
+    # Sending while holding the lock keeps requests in order across threads.
+
+    def _send_next_read(self):
+        if self._current_read is None and self._queued_reads:
+            self._current_read = self._queued_reads.popleft()
+            self._send_request(self._current_read)
+
+    def _send_next_writes(self):
+        while self._queued_writes and len(self._writes_in_flight) < self.max_writes_in_flight:
+            request = self._queued_writes.popleft()
+            self._writes_in_flight.append(request)
+            self._send_request(request)
+
+    def _send_request(self, request):
+        request.deadline = time.monotonic() + self.timeout
+        self._com._send(*request.payload)
+        self._arm_watchdog()
+
+    def _arm_watchdog(self):
+        if self._watchdog is None:
+            self._watchdog = threading.Timer(self.timeout, self._expire)
+            self._watchdog.daemon = True
+            self._watchdog.start()
+
+    def _expire(self):
+        """
+        Fails all requests that have been sent but not answered in time.
+        """
+        now = time.monotonic()
+        expired = []
+        with self._lock:
+            self._watchdog = None
+            if self._current_read is not None and self._current_read.deadline <= now:
+                expired.append(self._current_read)
+                self._current_read = None
+            while self._writes_in_flight and self._writes_in_flight[0].deadline <= now:
+                expired.append(self._writes_in_flight.popleft())
+            self._send_next_read()
+            self._send_next_writes()
+            if self._current_read is not None or self._writes_in_flight:
+                self._arm_watchdog()
+        if expired:
+            tracing.error(tracing.MEMORY, "%d memory request(s) timed out" % len(expired))
+        for request in expired:
+            request.future.set_exception(TimeoutError("Wiimote did not answer memory request in time"))
 
     def handle_report(self, report):
-        if report[0] not in Memory.SUPPORTED_REPORTS:  # interleaved modes
+        if tracing.flags & tracing.MEMORY:
+            tracing.record(tracing.MEMORY, report)
+        if report[0] == Memory.RPT_READ_DATA:
+            self._handle_read_data(report)
+        elif report[0] == Memory.RPT_ACK:
+            self._handle_ack(report)
+        else:
             raise NotImplementedError("can not handle this report")
+
+    def _handle_read_data(self, report):
         error = (report[3] & 0x0f)
-        if error != 0:
-            raise RuntimeError("Error condition %x received during memory read!" % error)
         num_bytes_received = ((report[3] >> 4) & 0x0f) + 1
-        data_bytes = report[6:][:num_bytes_received]
-        self._reply_buffer += data_bytes
-        self._bytes_remaining -= num_bytes_received
-        if self._bytes_remaining < 0:
-            raise RuntimeError("Memory read received more data than requested!")
-        elif self._bytes_remaining == 0:
-            self._request_in_progress = False
+        result = None
+        with self._lock:
+            request = self._current_read
+            if request is None:  # late answer to a request that timed out
+                return
+            if error != 0:
+                result = RuntimeError("Error condition %x received during memory read!" % error)
+            else:
+                request.received += report[6:6 + num_bytes_received]
+                if len(request.received) > request.amount:
+                    result = RuntimeError("Memory read received more data than requested!")
+                elif len(request.received) == request.amount:
+                    result = request.received
+            if result is None:  # more data to come
+                return
+            self._current_read = None
+            self._send_next_read()
+        if isinstance(result, Exception):
+            tracing.error(tracing.MEMORY, str(result))
+            request.future.set_exception(result)
+        else:
+            request.future.set_result(result)
+
+    def _handle_ack(self, report):
+        if report[3] != Memory.RPT_WRITE:  # acknowledges some other output report
+            return
+        error = report[4]
+        with self._lock:
+            if not self._writes_in_flight:
+                return
+            request = self._writes_in_flight.popleft()
+            self._send_next_writes()
+        if error != 0:
+            message = "Error condition %x received during memory write!" % error
+            tracing.error(tracing.MEMORY, message)
+            request.future.set_exception(RuntimeError(message))
+        else:
+            request.future.set_result(request.amount)
+
+
+def _gather(futures):
+    """
+    Returns a Future that is done when all *futures* are done. It fails with the first error.
+    """
+    combined = Future()
+    remaining = [len(futures)]
+    lock = threading.Lock()
+
+    def on_done(future):
+        with lock:
+            remaining[0] -= 1
+            if combined.done():
+                return
+            if future.exception() is not None:
+                combined.set_exception(future.exception())
+            elif remaining[0] == 0:
+                combined.set_result(sum(f.result() for f in futures))
+
+    for future in futures:
+        future.add_done_callback(on_done)
+    return combined
+
+
+def _would_block(error):
+    """
+    Returns True if `error` only signals that a non-blocking socket has no data.
+    PyBluez wraps EAGAIN into a BluetoothError whose errno is not always set.
+    """
+    if isinstance(error, BlockingIOError):
+        return True
+    code = getattr(error, 'errno', None)
+    if code is None and len(error.args) > 0:
+        code = error.args[0]
+        if isinstance(code, str):
+            return "temporarily unavailable" in code
+    return code in (errno.EAGAIN, errno.EWOULDBLOCK)
 
 
-class CommunicationHandler(threading.Thread):
+class L2CAPTransport(object):
+    """
+    Transport over the two Bluetooth L2CAP channels of a Wiimote
+    (control channel on PSM 17, data channel on PSM 19).
+    Input reports are read from the data channel. Output reports are sent
+    through the channel the given *model* expects.
+    The data socket is non-blocking: `recv()` returns None if nothing is waiting.
+    """
+
+    def __init__(self, btaddr, model):
+        self._controlsocket = bluetooth.BluetoothSocket(bluetooth.L2CAP)
+        self._controlsocket.connect((btaddr, 17))
+        self._datasocket = bluetooth.BluetoothSocket(bluetooth.L2CAP)
+        self._datasocket.connect((btaddr, 19))
+        if model == 'Nintendo RVL-CNT-01':
+            self._sendsocket = self._controlsocket
+        elif model == 'Nintendo RVL-CNT-01-TR':
+            self._sendsocket = self._datasocket
+        else:
+            raise Exception("unknown model")
+        self._datasocket.setblocking(False)
+        # not every PyBluez version offers recv_into()
+        self._recv_into = getattr(self._datasocket, 'recv_into', None)
+
+    def fileno(self):
+        return self._datasocket.fileno()
+
+    def recv_into(self, buffer):
+        """
+        Reads the next report waiting in the data socket into `buffer`.
+        Returns the number of bytes read, None if no report is waiting
+        and 0 if the Wiimote disconnected.
+        """
+        try:
+            if self._recv_into is not None:
+                return self._recv_into(buffer)
+            data = self._datasocket.recv(len(buffer))
+            buffer[:len(data)] = data
+            return len(data)
+        except (bluetooth.BluetoothError, OSError) as e:
+            if _would_block(e):
+                return None
+            tracing.error(tracing.RX, "BluetoothError while reading data: " + str(e))
+            return 0
+
+    def send(self, data):
+        self._sendsocket.send(data)
+
+    def close(self):
+        self._datasocket.close()
+        self._controlsocket.close()
+
+
+class SocketPairTransport(object):
+    """
+    Local stand-in for `L2CAPTransport` built from a connected socket pair.
+    `peer` is the "Wiimote" end: input reports (including the 0xa1 header byte)
+    written to it arrive in the `CommunicationHandler`, output reports sent by
+    the handler can be read from it.
+    Used for tests and benchmarks without Bluetooth hardware.
+    """
+
+    def __init__(self):
+        # SEQPACKET keeps report boundaries intact just like L2CAP
+        sock_type = getattr(socket, 'SOCK_SEQPACKET', socket.SOCK_DGRAM)
+        self._socket, self.peer = socket.socketpair(socket.AF_UNIX, sock_type)
+        self._socket.setblocking(False)
+
+    def fileno(self):
+        return self._socket.fileno()
+
+    def recv_into(self, buffer):
+        try:
+            return self._socket.recv_into(buffer)
+        except BlockingIOError:
+            return None
+        except OSError:
+            return 0
+
+    def send(self, data):
+        self._socket.send(data)
+
+    def close(self):
+        self._socket.close()
+        self.peer.close()
+
+
+class DeviceStats(object):
+    """
+    Receive statistics of one Wiimote: number of reports, gaps in the report
+    stream (intervals longer than `gap_threshold` seconds) and the time spent
+    decoding and dispatching the reports. Only every `timing_interval`-th
+    report is timed (`timed_reports`), so the mean and maximum decode times
+    are sampled; timing every report would add about 0.5 us to each.
+    """
+
+    __slots__ = ('gap_threshold', 'timing_interval', 'reports', 'timed_reports', 'gaps', 'max_interval',
+                 'decode_time', 'max_decode_time', 'first_report', 'last_report', 'type_reports',
+                 'type_timed_reports', 'type_decode_time')
+
+    def __init__(self, gap_threshold=0.02, timing_interval=8):
+        self.gap_threshold = gap_threshold
+        self.timing_interval = timing_interval
+        self.reset()
+
+    def reset(self):
+        self.reports = 0
+        self.timed_reports = 0
+        self.gaps = 0
+        self.max_interval = 0.0
+        self.decode_time = 0.0
+        self.max_decode_time = 0.0
+        self.first_report = None
+        self.last_report = None
+        # per report type (= report mode for data reports), indexed by report id
+        self.type_reports = [0] * 256
+        self.type_timed_reports = [0] * 256
+        self.type_decode_time = [0.0] * 256
+
+    def record(self, report_time, report_type=None):
+        if self.last_report is None:
+            self.first_report = report_time
+        else:
+            interval = report_time - self.last_report
+            if interval > self.gap_threshold:
+                self.gaps += 1
+            if interval > self.max_interval:
+                self.max_interval = interval
+        self.last_report = report_time
+        self.reports += 1
+        if report_type is not None:
+            self.type_reports[report_type] += 1
+
+    def record_decode(self, decode_time, report_type=None):
+        self.timed_reports += 1
+        self.decode_time += decode_time
+        if decode_time > self.max_decode_time:
+            self.max_decode_time = decode_time
+        if report_type is not None:
+            self.type_timed_reports[report_type] += 1
+            self.type_decode_time[report_type] += decode_time
+
+    def as_dict(self):
+        duration = (self.last_report - self.first_report) if self.reports > 1 else 0.0
+        return {'reports': self.reports,
+                'reports_per_second': (self.reports - 1) / duration if duration > 0 else 0.0,
+                'gaps': self.gaps,
+                'max_interval': self.max_interval,
+                'timed_reports': self.timed_reports,
+                'mean_decode_time': self.decode_time / self.timed_reports if self.timed_reports else 0.0,
+                'max_decode_time': self.max_decode_time,
+                'report_types': {rpt: {'reports': count,
+                                       'mean_decode_time': (self.type_decode_time[rpt] / self.type_timed_reports[rpt]
+                                                            if self.type_timed_reports[rpt] else 0.0)}
+                                 for rpt, count in enumerate(self.type_reports) if count}}
+
+
+class OutboundQueue(object):
+    """
+    Output reports waiting to be sent to one Wiimote.
+    All reports are sent from the reactor thread in the order they were queued,
+    on average at most `send_rate` reports per second so that the Wiimote's
+    input buffer is never overrun (a token bucket: up to `burst` reports may
+    be sent back to back after a pause). Memory writes (0x16) and speaker data (0x18) do not count
+    against the limit: writes are acknowledged and flow-controlled by
+    `Memory.max_writes_in_flight`, speaker data is paced by the `Speaker`.
+    Pure state reports (LEDs, report mode, status request/rumble) that are
+    still waiting are replaced by newer ones instead of being queued twice.
+    """
+
+    COALESCED_REPORTS = (0x11, 0x12, 0x15)
+    UNTHROTTLED_REPORTS = (0x16, 0x18)
+
+    def __init__(self, send_rate=200, burst=8):
+        self.min_interval = 1.0 / send_rate if send_rate else 0.0
+        self.burst = burst
+        self._queue = collections.deque()  # entries: [report id, data, time queued]
+        self._waiting = {}  # report id -> queued entry of coalesced report types
+        self._lock = threading.Lock()
+        self._tokens = float(burst)
+        self._refilled = time.monotonic()
+        self.sent = 0
+        self.coalesced = 0
+        self.max_depth = 0
+        self.send_latency = 0.0
+        self.max_send_latency = 0.0
+
+    def __len__(self):
+        return len(self._queue)
+
+    def put(self, data):
+        """
+        Queues the encoded output report *data*. Returns True if the queue was empty before.
+        """
+        report_id = data[1]
+        with self._lock:
+            entry = self._waiting.get(report_id)
+            if entry is not None:
+                entry[1] = data  # keeps its place in the queue
+                self.coalesced += 1
+                return False
+            was_empty = not self._queue
+            entry = [report_id, data, time.monotonic()]
+            self._queue.append(entry)
+            if report_id in OutboundQueue.COALESCED_REPORTS:
+                self._waiting[report_id] = entry
+            if len(self._queue) > self.max_depth:
+                self.max_depth = len(self._queue)
+            return was_empty
+
+    def send_now(self, transport, data, rumble):
+        """
+        Sends the encoded output report *data* from the calling thread if no
+        other report is waiting (so the order is kept), without a rate limit.
+        Returns False if it has to be queued with `put()` instead.
+        """
+        with self._lock:
+            if self._queue:
+                return False
+            data[2] = (data[2] & 0xfe) | rumble
+            try:
+                transport.send(data)
+            except (bluetooth.BluetoothError, OSError) as e:
+                if _would_block(e):
+                    return False
+                raise
+            if tracing.flags & tracing.TX:
+                tracing.record(tracing.TX, data)
+            self.sent += 1
+            return True
+
+    def flush(self, transport, rumble, now):
+        """
+        Sends as many reports as the rate limit allows. *rumble* is the current
+        state of the rumble motor (bit 0 of every output report).
+        Returns the time the next report is due or None if the queue is empty.
+        """
+        with self._lock:
+            while self._queue:
+                entry = self._queue[0]
+                throttled = entry[0] not in OutboundQueue.UNTHROTTLED_REPORTS
+                if throttled and self.min_interval:
+                    self._tokens = min(self.burst, self._tokens + (now - self._refilled) / self.min_interval)
+                    self._refilled = now
+                    if self._tokens < 1.0:
+                        return now + (1.0 - self._tokens) * self.min_interval
+                data = entry[1]
+                data[2] = (data[2] & 0xfe) | rumble
+                try:
+                    transport.send(data)
+                except (bluetooth.BluetoothError, OSError) as e:
+                    if _would_block(e):  # socket buffer full, try again later
+                        return now + max(self.min_interval, 0.001)
+                    raise
+                if tracing.flags & tracing.TX:
+                    tracing.record(tracing.TX, data)
+                self._queue.popleft()
+                if self._waiting.get(entry[0]) is entry:
+                    del self._waiting[entry[0]]
+                if throttled:
+                    self._tokens -= 1.0
+                latency = now - entry[2]
+                self.sent += 1
+                self.send_latency += latency
+                if latency > self.max_send_latency:
+                    self.max_send_latency = latency
+            return None
+
+    def clear(self):
+        with self._lock:
+            self._queue.clear()
+            self._waiting.clear()
+
+    def as_dict(self):
+        return {'send_queue_depth': len(self._queue),
+                'max_send_queue_depth': self.max_depth,
+                'sent': self.sent,
+                'coalesced_sends': self.coalesced,
+                'mean_send_latency': self.send_latency / self.sent if self.sent else 0.0,
+                'max_send_latency': self.max_send_latency}
+
+
+class Reactor(threading.Thread):
+    """
+    A single I/O loop for any number of Wiimotes.
+    It waits until one of the registered data sockets (or its wakeup pipe)
+    becomes readable and lets the owning `CommunicationHandler` handle every
+    report waiting in that socket at once. Nothing sleeps between reports.
+    Output reports queued by any thread are sent from this loop as well.
+    A handler that raises an exception is reported through `tracing` and
+    removed, the other handlers keep running.
+    With `stop_when_idle` the loop ends as soon as its last handler is removed.
+    A stopped reactor cannot be started again.
+    """
+
+    def __init__(self, stop_when_idle=False):
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.running = False
+        self.stopped = False  # stop() was called or the loop ended, set under _lock
+        self.finished = False
+        self._closed = False  # wakeup pipe closed, set under _lock
+        self._stop_when_idle = stop_when_idle
+        self._selector = selectors.DefaultSelector()
+        # writing to the wakeup pipe interrupts a waiting receive loop
+        self._wakeup_r, self._wakeup_w = os.pipe()
+        os.set_blocking(self._wakeup_r, False)
+        os.set_blocking(self._wakeup_w, False)
+        self._selector.register(self._wakeup_r, selectors.EVENT_READ, None)
+        self._lock = threading.Lock()
+        self._handlers = []
+        self._added = []
+        self._removed = []
+
+    def register(self, handler):
+        """
+        Starts receiving reports for *handler*. Starts the loop if necessary.
+        Raises RuntimeError if the reactor has already stopped.
+        """
+        with self._lock:
+            if self.stopped:
+                raise RuntimeError("the reactor has stopped, handlers need a new one")
+            self._added.append(handler)
+            if not self.running:
+                self.running = True
+                self.start()
+        self._wakeup()
+
+    def unregister(self, handler):
+        """
+        Stops receiving reports for *handler*. Its transport gets closed by the loop.
+        """
+        with self._lock:
+            self._removed.append(handler)
+        self._wakeup()
+
+    def stop(self):
+        with self._lock:
+            self.stopped = True
+            self.running = False
+        self._wakeup()
+
+    def notify_output(self):
+        """
+        Wakes the loop to send newly queued output reports.
+        """
+        self._wakeup()
+
+    def get_handlers(self):
+        return list(self._handlers)
+
+    def get_stats(self):
+        """
+        Returns the statistics of all handled Wiimotes by Bluetooth address.
+        """
+        return {handler.btaddr: handler.get_stats() for handler in self._handlers}
+
+    def run(self):
+        try:
+            self._apply_changes()
+            while self.running:
+                for key, _ in self._selector.select(self._send_output()):
+                    handler = key.data
+                    if handler is None:
+                        self._clear_wakeup()
+                        continue
+                    try:
+                        handler._receive_pending()
+                    except Exception:
+                        self._fail(handler, tracing.RX, "handling reports")
+                        continue
+                    if not handler.running:  # disconnected
+                        self._remove(handler)
+                self._apply_changes()
+                if self._stop_when_idle and not self._handlers:
+                    with self._lock:
+                        if not self._added:
+                            self.stopped = True
+                            self.running = False
+        finally:
+            with self._lock:
+                self.stopped = True
+                self.running = False
+                self._closed = True
+            for handler in list(self._handlers):
+                self._remove(handler)
+            self._selector.close()
+            os.close(self._wakeup_r)
+            os.close(self._wakeup_w)
+            self.finished = True
+
+    def _send_output(self):
+        """
+        Sends due output reports of all handlers (and lets their report mode
+        policies switch modes). Returns the time in seconds until the next
+        report or policy check is due or None if nothing is waiting.
+        """
+        now = time.monotonic()
+        next_due = None
+        for handler in list(self._handlers):
+            try:
+                due = handler._poll(now)
+            except Exception:
+                self._fail(handler, tracing.TX, "sending output reports")
+                continue
+            if not handler.running:  # disconnected
+                self._remove(handler)
+            elif due is not None and (next_due is None or due < next_due):
+                next_due = due
+        return None if next_due is None else max(0.0, next_due - now)
+
+    def _apply_changes(self):
+        with self._lock:
+            added, self._added = self._added, []
+            removed, self._removed = self._removed, []
+        for handler in added:
+            try:
+                self._selector.register(handler._transport, selectors.EVENT_READ, handler)
+            except (OSError, ValueError, KeyError) as e:
+                tracing.error(tracing.RX, "%s: could not register transport: %s" % (handler.btaddr, e))
+                handler._dispose()
+                continue
+            self._handlers.append(handler)
+        for handler in removed:
+            self._remove(handler)
+
+    def _remove(self, handler):
+        if handler in self._handlers:
+            self._handlers.remove(handler)
+            try:
+                self._selector.unregister(handler._transport)
+            except (KeyError, ValueError, OSError):  # transport already broken
+                pass
+            try:
+                handler._dispose()
+            except Exception as e:
+                tracing.error(tracing.RX, "%s: could not close transport: %s" % (handler.btaddr, e))
+
+    def _fail(self, handler, category, action):
+        """
+        Removes *handler* after an unexpected exception while *action*.
+        """
+        tracing.error(category, "%s: exception while %s, disconnected:\n%s" %
+                      (handler.btaddr, action, traceback.format_exc()))
+        handler.running = False
+        self._remove(handler)
+
+    def _wakeup(self):
+        with self._lock:
+            if self._closed:  # the descriptor may already belong to another file
+                return
+            try:
+                os.write(self._wakeup_w, b'\x00')
+            except OSError:  # pipe full - loop wakes up anyway
+                pass
+
+    def _clear_wakeup(self):
+        try:
+            while os.read(self._wakeup_r, 64):
+                pass
+        except BlockingIOError:
+            pass
+
+
+_shared_reactor = None
+_shared_reactor_lock = threading.Lock()
+
+
+def shared_reactor():
+    """
+    Returns the `Reactor` used by all Wiimotes that are not given their own one.
+    """
+    global _shared_reactor
+    with _shared_reactor_lock:
+        if _shared_reactor is None or _shared_reactor.stopped:
+            _shared_reactor = Reactor()
+        return _shared_reactor
+
+
+class CommunicationHandler(object):
 
     MODE_DEFAULT = 0x30
     MODE_ACC = 0x31
@@ -592,77 +1687,185 @@ class CommunicationHandler(threading.Thread):
 
     RPT_STATUS_REQ = 0x15
 
-    def __init__(self, wiimote):
-        threading.Thread.__init__(self)
-        self.daemon = True
+    def __init__(self, wiimote, transport=None, reactor=None, send_rate=200):
         self.rumble = False  # rumble always
+        self.running = False
         self.wiimote = wiimote
         self.btaddr = wiimote.btaddr
         self.model = wiimote.model
         self.reporting_mode = self.MODE_DEFAULT
-        self._controlsocket = bluetooth.BluetoothSocket(bluetooth.L2CAP)
-        self._controlsocket.connect((self.btaddr, 17))
-        self._datasocket = bluetooth.BluetoothSocket(bluetooth.L2CAP)
-        self._datasocket.connect((self.btaddr, 19))
+        self.report_time = 0.0  # time.monotonic() when the current report was received
+        self.stats = DeviceStats()
+        self._untimed_reports = 0  # reports left until the next one is timed
+        self._outbound = OutboundQueue(send_rate)
+        self.mode_policy = None  # see ReportModePolicy
         if self.model == 'Nintendo RVL-CNT-01':
-            self._sendsocket = self._controlsocket
             self._CMD_SET_REPORT = 0x52
         elif self.model == 'Nintendo RVL-CNT-01-TR':
-            self._sendsocket = self._datasocket
             self._CMD_SET_REPORT = 0xa2
         else:
             raise Exception("unknown model")
-        try:
-            self._datasocket.settimeout(1)
-        except NotImplementedError:
-            print("socket timeout not implemented with this bluetooth module")
+        if transport is None:
+            transport = L2CAPTransport(self.btaddr, self.model)
+        self._transport = transport
+        self._reactor = reactor if reactor is not None else shared_reactor()
+        # every report is received into the same buffer. Report types have a
+        # fixed length, so handlers never look at bytes left by a longer report.
+        self._rx_buffer = bytearray(32)
+        self._rx_report = memoryview(self._rx_buffer)[1:]  # without transaction header
         self.set_report_mode(self.MODE_ACC_IR)
 
     def _send(self, *bytes_to_send, signed=False):
-        _debug("sending " + str(bytes_to_send))
-        data_str = self._CMD_SET_REPORT.to_bytes(1, 'big')
+        """
+        Queues an output report. It is sent from the reactor thread, the rumble
+        bit is set according to the rumble state at that time.
+        """
         bytes_to_send = _flatten(bytes_to_send)
-        bytes_to_send[1] |= int(self.rumble)
-        for b in bytes_to_send:
-            data_str += b.to_bytes(1, 'big', signed=signed)
-        self._sendsocket.send(data_str)
+        data = bytearray(len(bytes_to_send) + 1)
+        data[0] = self._CMD_SET_REPORT
+        data[1:] = [b & 0xff for b in bytes_to_send] if signed else bytes_to_send
+        if self._outbound.put(data):
+            self._reactor.notify_output()
 
-    def run(self):
+    def _send_report(self, report_id, payload):
+        """
+        Queues an output report whose payload is already encoded (bytes).
+        """
+        data = bytearray(len(payload) + 2)
+        data[0] = self._CMD_SET_REPORT
+        data[1] = report_id
+        data[2:] = payload
+        if self._outbound.put(data):
+            self._reactor.notify_output()
+
+    def _send_report_now(self, report_id, payload):
+        """
+        Like `_send_report()`, but the report is written from the calling
+        thread unless other output reports are waiting (for paced speaker
+        data). Returns True if it was written, False if it was queued.
+        """
+        data = bytearray(len(payload) + 2)
+        data[0] = self._CMD_SET_REPORT
+        data[1] = report_id
+        data[2:] = payload
+        if self._outbound.send_now(self._transport, data, int(self.rumble)):
+            return True
+        if self._outbound.put(data):
+            self._reactor.notify_output()
+        return False
+
+    def _poll(self, now):
+        """
+        Called by the reactor to update the report mode and send due output reports.
+        Returns the time the next call is due or None.
+        """
+        policy_due = None
+        if self.mode_policy is not None:
+            policy_due = self.mode_policy.update(now)
+        try:
+            due = self._outbound.flush(self._transport, int(self.rumble), now)
+        except (bluetooth.BluetoothError, OSError) as e:
+            tracing.error(tracing.TX, "could not send output report: " + str(e))
+            self._outbound.clear()
+            self.running = False  # the reactor removes a disconnected handler
+            return None
+        if due is None or (policy_due is not None and policy_due < due):
+            return policy_due
+        return due
+
+    def refresh_report_mode(self):
+        """
+        Called when callbacks are (un)registered: lets the report mode policy
+        choose a mode for the new set of callbacks right away.
+        """
+        if self.mode_policy is not None:
+            self.mode_policy.activity(time.monotonic())
+            self._reactor.notify_output()
+
+    def get_stats(self):
+        """
+        Receive statistics (see `DeviceStats`) and output queue statistics (see `OutboundQueue`).
+        """
+        stats = self.stats.as_dict()
+        stats.update(self._outbound.as_dict())
+        stats['report_mode'] = self.reporting_mode
+        if self.mode_policy is not None:
+            stats['mode_switches'] = self.mode_policy.switches
+        return stats
+
+    def start(self):
+        """
+        Starts receiving reports on the reactor.
+        """
         self.running = True
+        self._reactor.register(self)
+
+    def _receive_pending(self):
+        """
+        Reads and handles all reports waiting in the data socket.
+        Called by the reactor when the socket becomes readable.
+        """
         while self.running:
-            try:
-                data = self._datasocket.recv(32)
-            except bluetooth.BluetoothError:
-                _debug("BluetoothError while waiting for data")
-                continue
-            if len(data) < 2:  # disconnect!
+            length = self._transport.recv_into(self._rx_buffer)
+            if length is None:  # socket drained
+                return
+            if length < 2:  # disconnect!
                 self.running = False
             else:
-                self._handle(data)
-            time.sleep(0.001)  # Wiimote: 100 Hz, check ten times as often
-        self._dispose()
+                self.report_time = time.monotonic()
+                if tracing.flags & tracing.RX:
+                    tracing.record(tracing.RX, self._rx_buffer, length)
+                if self._untimed_reports:
+                    self._untimed_reports -= 1
+                    self._handle_report(self._rx_report)
+                else:
+                    self._untimed_reports = self.stats.timing_interval - 1
+                    started = time.perf_counter()
+                    self._handle_report(self._rx_report)
+                    self.stats.record_decode(time.perf_counter() - started, self._rx_buffer[1])
+                self.stats.record(self.report_time, self._rx_buffer[1])
+
+    def stop(self):
+        """
+        Stops receiving reports. Sockets get closed by the reactor thread.
+        """
+        self.running = False
+        self._reactor.unregister(self)
 
     def _dispose(self):
-        self._datasocket.close()
-        self._controlsocket.close()
         self.running = False
+        self._transport.close()
 
     def set_report_mode(self, mode):
         self.reporting_mode = mode
         self._send(0x12, 0x00, mode)
 
     def _handle(self, bytes_read):
-        _debug("received " + str(bytes_read))
         # assert(bytes_read[0] == self._CMD_SET_REPORT + 1)
-        rpt_type = bytes_read[1]
+        self.report_time = time.monotonic()
+        self._handle_report(memoryview(bytes_read)[1:])
+
+    def _handle_report(self, report):
+        """
+        Passes a report (a memoryview without the transaction header) to all
+        handlers. Handlers decode it in place and must not keep the view.
+        The sensor records are reused, but the decoded values are still Python
+        ints and floats: a 0x33 report with DIRECT callbacks and no telemetry
+        costs about 7 us and 540 bytes of short-lived objects (bench_wiimote.py
+        decode, "app"), telemetry adds about 1.7 us and 60 bytes.
+        """
+        rpt_type = report[0]
         # all reports include button data
-        self.wiimote.buttons.handle_report(bytes_read[1:])
+        self.wiimote.buttons.handle_report(report)
         if rpt_type in Accelerometer.SUPPORTED_REPORTS:
-            self.wiimote.accelerometer.handle_report(bytes_read[1:])
+            self.wiimote.accelerometer.handle_report(report)
         if rpt_type in Memory.SUPPORTED_REPORTS:
-            self.wiimote.memory.handle_report(bytes_read[1:])
+            self.wiimote.memory.handle_report(report)
         if rpt_type in IRCam.SUPPORTED_REPORTS:
-            self.wiimote.ir.handle_report(bytes_read[1:])
+            self.wiimote.ir.handle_report(report)
+        policy = self.mode_policy
+        if policy is not None and self.report_time >= policy.observe_after:
+            policy.observe(rpt_type, self.report_time)
 
     def set_rumble(self, state):
         self.rumble = state
@@ -670,14 +1873,128 @@ class CommunicationHandler(threading.Thread):
         self._send(self.RPT_STATUS_REQ, int(state))
 
 
+class ReportModePolicy(object):
+    """
+    Chooses the cheapest report mode that still delivers what the registered
+    callbacks need: `MODE_DEFAULT` (0x30, buttons only, sent on change) if
+    nobody listens to accelerometer or IR data, `MODE_ACC` (0x31) if only
+    accelerometer callbacks exist (e.g. gesture detection) and `MODE_ACC_IR`
+    (0x33) while the pointer is in use.
+    The pointer is idle when no IR object has been seen, no button held and the
+    Wiimote not moved for `idle_timeout` seconds. The IR camera stays configured
+    while idle, so a button press, a movement larger than `motion_threshold` or
+    an IR object found during the short checks (`probe_time` seconds every
+    `probe_interval` seconds) switches back to 0x33 with the next report.
+    Reports are only looked at (`observe()`) while IR callbacks exist, and not
+    again within `observe_interval` seconds after a sign of use.
+    Runs on the reactor thread.
+    """
+
+    NEVER = float('inf')
+
+    def __init__(self, wiimote, idle_timeout=5.0, probe_interval=1.0, probe_time=0.1, motion_threshold=30,
+                 observe_interval=0.1):
+        self.idle_timeout = idle_timeout
+        self.probe_interval = probe_interval
+        self.probe_time = probe_time
+        self.motion_threshold = motion_threshold
+        self.observe_interval = observe_interval
+        self.switches = 0
+        self.last_activity = time.monotonic()
+        # the receive loop only calls observe() for reports received at or after this time
+        self.observe_after = 0.0
+        self._wiimote = wiimote
+        self._com = wiimote._com
+        self._probe_until = 0.0
+        self._next_probe = 0.0
+        self._last_acc = None
+
+    def activity(self, now):
+        self.last_activity = now
+        if self.observe_after != self.NEVER:
+            self.observe_after = now + self.observe_interval
+
+    def observe(self, rpt_type, now):
+        """
+        Looks for signs of use in the report that has just been decoded.
+        """
+        wiimote = self._wiimote
+        active = wiimote.buttons._state.mask != 0
+        if rpt_type in Accelerometer.SUPPORTED_REPORTS:
+            state = wiimote.accelerometer._state
+            last = self._last_acc
+            if last is None:
+                self._last_acc = last = state.copy()
+            elif abs(state.x - last.x) + abs(state.y - last.y) + abs(state.z - last.z) > self.motion_threshold:
+                active = True
+                last.x, last.y, last.z = state.x, state.y, state.z
+        if not active and rpt_type in IRCam.SUPPORTED_REPORTS:
+            for blob in wiimote.ir._blobs:
+                if blob.y < 1023:  # empty slots read 0x3ff
+                    active = True
+                    break
+        if active:
+            self.activity(now)
+
+    def choose(self, now):
+        """
+        Returns (report mode, time of the next check or None).
+        """
+        wiimote = self._wiimote
+        if len(wiimote.ir._dispatcher) > 0:
+            if self.observe_after == self.NEVER:
+                self.observe_after = 0.0
+            idle_at = self.last_activity + self.idle_timeout
+            if now < idle_at:
+                return CommunicationHandler.MODE_ACC_IR, idle_at
+            if now >= self._next_probe:
+                self._probe_until = now + self.probe_time
+                self._next_probe = now + self.probe_interval
+            if now < self._probe_until:
+                return CommunicationHandler.MODE_ACC_IR, self._probe_until
+            due = self._next_probe
+        else:
+            self.observe_after = self.NEVER  # the mode does not depend on activity
+            due = None
+        if len(wiimote.accelerometer._dispatcher) > 0:
+            return CommunicationHandler.MODE_ACC, due
+        return CommunicationHandler.MODE_DEFAULT, due
+
+    def update(self, now):
+        """
+        Switches the report mode if needed. Returns the time of the next check or None.
+        """
+        mode, due = self.choose(now)
+        if mode != self._com.reporting_mode:
+            self._com.set_report_mode(mode)
+            self.switches += 1
+        return due
+
+
 class WiiMote(object):
 
     # instance methods
-    def __init__(self, btaddr, model):
+    def __init__(self, btaddr, model, transport=None, telemetry_capacity=1024, reactor=None, send_rate=200,
+                 adaptive_report_mode=True):
+        """
+        Connects to the Wiimote at *btaddr*. A *transport* other than the
+        default `L2CAPTransport` (e.g. a `SocketPairTransport`) may be given.
+        The last *telemetry_capacity* samples of every sensor stream are kept
+        in `telemetry` (see telemetry.WiimoteTelemetry). With a capacity of 0
+        `telemetry` is None and the receive loop skips it (about 1.7 us of
+        the decode time of a 0x33 report).
+        Reports are received on *reactor*, by default on the `shared_reactor()`
+        that serves all connected Wiimotes from one thread.
+        At most *send_rate* output reports per second are sent to the Wiimote
+        (on average, memory writes and speaker data excepted, see `OutboundQueue`).
+        With *adaptive_report_mode* the mode follows the registered callbacks
+        and drops to a cheaper one while the Wiimote is idle (see `ReportModePolicy`).
+        """
         self.btaddr = btaddr
         self.model = model
         self.connected = False
-        self._com = CommunicationHandler(self)
+        self.telemetry = WiimoteTelemetry(telemetry_capacity) if telemetry_capacity else None
+        self._com = CommunicationHandler(self, transport, reactor, send_rate)
         self._leds = LEDs(self)
         self.accelerometer = Accelerometer(self)
         self.buttons = Buttons(self)
@@ -691,11 +2008,31 @@ class WiiMote(object):
         CommunicationHandler can not be started earlier because the sensors
         would not yet be assigned to variables
         """
+        if adaptive_report_mode:
+            self._com.mode_policy = ReportModePolicy(self)
         self._com.start()
         self.leds[0] = True  # set first LED to signal successful connection.
 
     def disconnect(self):
-        self._com.running = False
+        self._com.stop()
+        for sensor in (self.accelerometer, self.buttons, self.ir):
+            sensor._dispatcher.close()
+
+    def get_stats(self):
+        """
+        Returns receive statistics (reports/s, gaps, decode time) and output
+        queue statistics (depth, send latency), see `DeviceStats` and `OutboundQueue`.
+        """
+        return self._com.get_stats()
+
+    def get_dispatch_stats(self):
+        """
+        Returns delivery statistics of all registered callbacks per sensor stream,
+        e.g. {'ir': [{'policy': 'latest', 'delivered': 812, 'coalesced': 40, ...}]}
+        """
+        return {'accelerometer': self.accelerometer._dispatcher.get_stats(),
+                'buttons': self.buttons._dispatcher.get_stats(),
+                'ir': self.ir._dispatcher.get_stats()}
 
     def _get_capabilities(self):
         return None